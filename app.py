@@ -1,411 +1,513 @@
-from fastapi import FastAPI, Request, Form
+from fastapi import Depends, FastAPI, Header, Request, Response, Form
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 import uvicorn
-from diagnosis_engine import DiagnosisEngine, T1, T2, T3
+from diagnosis_engine import rank_diagnoses
+from differential import Differential
+import tiers
+from kb_compiler import kb_sha256
+from kb_release import KBRelease, ReleaseRegistry, freeze, load_corpus, remove_release
+from worker_pool import create_engine_pool
+from sessions import SESSION_COOKIE, SESSION_HEADER, Case, Session, SessionStore
+from logging_setup import configure_logging
+from metrics import (DIAGNOSES, ENGINE_INFERENCES, ENGINE_STAGE_SECONDS, FALLBACKS, HTTP_LATENCY,
+                     HTTP_REQUESTS, KB_RELOADS, PROLOG_CALLS, REGISTRY)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Pediatric Diagnosis System")
 templates = Jinja2Templates(directory="templates")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Create two engines for the two modes
-normal_engine = DiagnosisEngine(mode="normal")
-dcg_engine = DiagnosisEngine(mode="dcg")
+# Prolog backend: one engine thread, or DIAGNOSIS_WORKERS processes with
+# each session pinned to one of them. Created at startup so that spawned
+# workers re-importing this module do not start pools of their own.
+engine_pool = None
+
+# Per-client diagnosis state, keyed by session cookie or X-Session-ID header
+sessions = SessionStore(max_sessions=1000, ttl=3600)
+
+# Frozen KB releases (see kb_release.py). New cases start on releases.current;
+# a case keeps the release it started on, so a reload never changes the KB
+# under a case that is part-way through the tiers.
+releases = ReleaseRegistry()
+# Serializes reloads and the retiring of releases no case uses any more
+reload_lock = asyncio.Lock()
+# Seconds between checks of the KB files for changes; 0 turns the watcher off
+KB_RELOAD_INTERVAL = float(os.environ.get("KB_RELOAD_INTERVAL", "0"))
+# POST /admin/reload_kb needs this token in X-Admin-Token; unset disables it
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+kb_watcher = None
+
+# Send "X-Debug-Timing: 1" to get the engine stage times of that request
+# back in a Server-Timing response header (streams: in their last line)
+TIMING_HEADER = "X-Debug-Timing"
+request_stages = contextvars.ContextVar("request_stages", default=None)
+
+# Diseases evaluated per engine call by the streaming diagnose endpoints
+STREAM_BATCH = 4
+NDJSON = "application/x-ndjson"
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    stages = {} if request.headers.get(TIMING_HEADER) == "1" else None
+    token = request_stages.set(stages)
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        # A stream's headers go out before its body runs the engine, so
+        # streams report the timings in their last line instead
+        if stages and response.headers.get("content-type") != NDJSON:
+            response.headers["Server-Timing"] = _server_timing(stages)
+        return response
+    finally:
+        # Label by route template, not raw URL, to keep cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_LATENCY.observe(time.perf_counter() - start, path)
+        HTTP_REQUESTS.inc(request.method, path, str(status))
+        request_stages.reset(token)
+
+
+def _server_timing(stages) -> str:
+    """{stage: [seconds, inferences]} -> "parse;dur=1.234;desc=\"812 inferences\", ..." """
+    entries = []
+    for stage, (seconds, inferences) in stages.items():
+        entry = f"{stage};dur={seconds * 1000:.3f}"
+        if inferences:
+            entry += f';desc="{inferences} inferences"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 # Request model for Tier 1 (Normal Mode)
 class Tier1Input(BaseModel):
     symptoms: list[str]
 
+# Request model for the stateless single-request diagnosis
+class CaseInput(BaseModel):
+    # Tier 1: checklist symptoms (normal) or free-text descriptions (dcg)
+    symptoms: list[str]
+    # Tier 2: primary symptom -> detail text
+    details: dict[str, str] = {}
+    # Tier 3: question key (e.g. "fever_rash_0") -> y/n answer
+    answers: dict[str, str] = {}
+
+
+def _attach_session(response: Response, session: Session, cookie_id):
+    if cookie_id != session.session_id:
+        response.set_cookie(SESSION_COOKIE, session.session_id, httponly=True, samesite="lax")
+    response.headers[SESSION_HEADER] = session.session_id
+
+
+def get_session(request: Request, response: Response) -> Session:
+    cookie_id = request.cookies.get(SESSION_COOKIE)
+    session = sessions.get(request.headers.get(SESSION_HEADER) or cookie_id)
+    _attach_session(response, session, cookie_id)
+    return session
+
 # Render the UI with tabs for selecting mode
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    # Reset engines on home page load
-    normal_engine._reset_state()
-    dcg_engine._reset_state()
-    return templates.TemplateResponse("index.html",
-        {"request": request, "symptoms": T1})
+    cookie_id = request.cookies.get(SESSION_COOKIE)
+    session = sessions.get(request.headers.get(SESSION_HEADER) or cookie_id)
+    # Start fresh cases on home page load
+    release = releases.current
+    session.new_case("normal", release.version)
+    session.new_case("dcg", release.version)
+    response = templates.TemplateResponse("index.html",
+        {"request": request, "symptoms": release.snapshot.t1})
+    _attach_session(response, session, cookie_id)
+    return response
 
-# ---------- Normal Mode Endpoints ----------
-@app.post("/normal/process_tier1")
-async def normal_process_tier1(input: Tier1Input):
-    # Reset before starting a new diagnosis
-    normal_engine._reset_state()
-    
-    responses = {}
-    # Process each selected symptom
-    for symptom in input.symptoms:
-        detected = normal_engine.process_natural_language(symptom.lower())
-        for s in detected:
-            responses[s] = "y"
-            normal_engine.add_symptom(s, 1)
-    for s in T1:
-        responses.setdefault(s, "n")
+# ---------- Shared tier logic ----------
+
+@contextmanager
+def _pinned(mode: str, session: Session) -> Iterator[Tuple[Case, KBRelease]]:
+    """The session's case for mode and the KB release it runs on, which is
+    not retired before the block ends"""
+    case = session.case(mode)
+    release = releases.get(case.kb_version)
+    if release is None:
+        # A case created outside tier 1, or one whose release was retired
+        release = releases.current
+        case.kb_version = release.version
+    with releases.hold(release):
+        yield case, release
+
+
+async def _call_engine(session: Session, mode: str, method: str, *args, version: Optional[str] = None):
+    PROLOG_CALLS.inc(mode, method)
+    start = time.perf_counter()
+    result, stages = await engine_pool.for_session(session.session_id).call(
+        mode, "timed_call", method, *args, version=version)
+    # Queueing for the engine thread/worker plus pickling across the pipe
+    inside = stages["total"][0] + stages.get("load", (0.0,))[0]
+    stages["dispatch"] = [max(time.perf_counter() - start - inside, 0.0), 0]
+    for stage, (seconds, inferences) in stages.items():
+        ENGINE_STAGE_SECONDS.observe(seconds, mode, method, stage)
+        if inferences:
+            ENGINE_INFERENCES.observe(inferences, mode, method, stage)
+    request_timings = request_stages.get()
+    if request_timings is not None:
+        for stage, (seconds, inferences) in stages.items():
+            entry = request_timings.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += inferences
+    return result
+
+
+def _provisional(mode: str, session: Session, closed_tier: int = None):
+    """Update the case's differential and return its provisional ranking"""
+    with _pinned(mode, session) as (case, release):
+        rules = release.compiled_rules(mode)
+        if rules is None:
+            return {}
+        differential = session.differentials.get(mode)
+        if differential is None or differential.rules is not rules:
+            differential = session.differentials[mode] = Differential(rules)
+        differential.update(case)
+        if closed_tier is not None:
+            differential.close_tier(closed_tier)
+        ranked = differential.ranked(release.snapshot.rule_len)
+    return {d.replace('_', ' ').title(): score for d, score in ranked.items()}
+
+
+async def _process_tier1(mode: str, session: Session, texts, release: Optional[KBRelease] = None):
+    # Start a new diagnosis, on the current KB unless told otherwise
+    release = release or releases.current
+    with releases.hold(release):
+        case = session.new_case(mode, release.version)
+        detected = await _call_engine(session, mode, "parse_many", [text.lower() for text in texts],
+                                      version=release.version)
+        result = tiers.tier1(case, detected, release.snapshot)
+        result["differential"] = _provisional(mode, session)
+    return result
+
+
+async def _process_tier2(mode: str, session: Session, form_data):
+    with _pinned(mode, session) as (case, release):
+        parsed = await _call_engine(session, mode, "parse_many", list(form_data.values()),
+                                    version=release.version)
+        symptoms_present, triggered_t3 = tiers.tier2(case, form_data, parsed, release.snapshot)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("tier 2 processed", extra={
+                "mode": mode, "form": dict(form_data), "symptoms_present": symptoms_present,
+                "adaptive_symptoms": case.symptom_names(2), "tier3_questions": list(triggered_t3)})
+        return {"tier3_questions": triggered_t3, "differential": _provisional(mode, session, closed_tier=2)}
+
+
+def _process_tier3(mode: str, session: Session, form_data):
+    with _pinned(mode, session) as (case, release):
+        processed_responses = tiers.tier3(case, form_data, release.snapshot)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("tier 3 processed", extra={
+            "mode": mode, "form": dict(form_data), "processed_responses": processed_responses})
+    return processed_responses
+
+
+def _candidates(mode: str, session: Session):
+    """Diseases the case can still match, or None to let the engine decide"""
+    # Only the rules the differential has not ruled out are evaluated
+    if mode in session.differentials:
+        _provisional(mode, session, closed_tier=2)
+        return session.differentials[mode].candidates()
+    return None
+
+
+def _diagnosis_result(mode: str, case, results, department, probabilities):
+    # If no diagnosis is returned by the engine, then compute a fallback.
+    DIAGNOSES.inc(mode)
+    if not results or results == []:
+        kind, results, department, probabilities = tiers.fallback_diagnosis(case.responses)
+        FALLBACKS.inc(mode, kind)
+        logger.info("no rule matched, using fallback diagnosis", extra={"mode": mode, "fallback": kind})
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("diagnosis", extra={
+            "mode": mode, "symptoms": case.symptom_names(), "responses": case.responses,
+            "diagnoses": results, "department": department, "probabilities": probabilities})
     return {
-        "symptoms": responses,
-        "tier2_questions": {s: T2[s] for s in responses if responses[s] == "y" and s in T2}
+        "diagnoses": results,
+        "department": department,
+        "probabilities": probabilities
     }
 
+
+async def _diagnose(mode: str, session: Session, strict: bool = False):
+    """The case's diagnosis; an engine error falls back to the heuristics
+    unless strict, when it is reported like any other failure"""
+    with _pinned(mode, session) as (case, release):
+        try:
+            candidates = _candidates(mode, session)
+            # First, try to compute the diagnosis using the engine.
+            try:
+                results, department, probabilities = await _call_engine(session, mode, "diagnose_case",
+                                                                        case, candidates,
+                                                                        version=release.version)
+            except Exception:
+                if strict:
+                    raise
+                logger.exception("get_diagnosis failed", extra={"mode": mode})
+                results, department, probabilities = None, None, None
+            return _diagnosis_result(mode, case, results, department, probabilities)
+        except Exception as e:
+            logger.exception("diagnose failed", extra={"mode": mode})
+            return JSONResponse(
+                content={"error": str(e), "message": "Please consult a doctor."},
+                status_code=500
+            )
+
+async def _diagnose_stream(mode: str, session: Session):
+    """NDJSON lines: one {"match": ...} per disease as soon as its rule holds,
+    then {"result": ...} with the same body as /<mode>/diagnose (and, with
+    X-Debug-Timing, the Server-Timing value of the request as "timing").
+
+    The candidate diseases are evaluated STREAM_BATCH at a time, in rule
+    order, so the first matches arrive before the whole KB has been tried.
+    The case's release is held while the body is sent.
+    """
+    async def lines():
+        with _pinned(mode, session) as (case, release):
+            candidates = _candidates(mode, session)
+            rules = release.compiled_rules(mode)
+            if candidates is None and rules is not None:
+                candidates = rules.dispatch.candidates(s for s, _ in case.symptoms)
+            batches = [None] if candidates is None else [
+                candidates[i:i + STREAM_BATCH] for i in range(0, len(candidates), STREAM_BATCH)]
+            matched = []
+            try:
+                for batch in batches:
+                    for disease in await _call_engine(session, mode, "match_case", case, batch,
+                                                      version=release.version):
+                        if disease not in matched:
+                            matched.append(disease)
+                            yield json.dumps({"match": disease.replace('_', ' ').title()}) + "\n"
+                ranked = rank_diagnoses(matched, release.snapshot)
+            except Exception:
+                # As in _diagnose, an engine failure falls back to the heuristics
+                logger.exception("get_diagnosis failed", extra={"mode": mode})
+                ranked = (None, None, None)
+            last = {"result": _diagnosis_result(mode, case, *ranked)}
+            stages = request_stages.get()
+            if stages:
+                last["timing"] = _server_timing(stages)
+            yield json.dumps(last) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+# ---------- Normal Mode Endpoints ----------
+@app.post("/normal/process_tier1")
+async def normal_process_tier1(input: Tier1Input, session: Session = Depends(get_session)):
+    return await _process_tier1("normal", session, input.symptoms)
+
 @app.post("/normal/process_tier2")
-async def normal_process_tier2(request: Request):
+async def normal_process_tier2(request: Request, session: Session = Depends(get_session)):
     form_data = await request.form()
-    triggered_t3 = {}
-    symptoms_present = []
-    
-    print("Normal Tier 2 form data:", dict(form_data))
-    
-    # Map specific keywords to adaptive symptoms
-    keyword_to_symptom = {
-        "high": "high_grade_fever",
-        "intermittent": "persistent_fever",
-        "chills": "chills",
-        "night": "night_sweats",
-        "dry": "dry_cough",
-        "wheez": "wheezing",
-        "night": "worsens_at_night",
-        "productive": "productive_cough",
-        "phlegm": "productive_cough",
-        "itchy": "itchy_rash",
-        "localized": "rash_localized_or_widespread",
-        "widespread": "rash_localized_or_widespread",
-        "peeling": "peeling_skin",
-        "blisters": "chickenpox_blisters",
-        "frequent": "frequent_loose_stools",
-        "severe": "dehydration_signs",
-        "watery": "watery_stool",
-        "cramps": "abdominal_cramps"
-    }
-    
-    for key, details in form_data.items():
-        symptom = key.replace("_detail", "")
-        symptoms_present.append(symptom)
-        
-        # Store the original input
-        atom = f"{symptom}_detail"
-        normal_engine.add_response(atom, details)
-        normal_engine.add_response(symptom, details)
-        
-        # Process keywords in the details to map to specific adaptive symptoms
-        details_lower = details.lower()
-        for keyword, adaptive_symptom in keyword_to_symptom.items():
-            if keyword in details_lower:
-                print(f"Found keyword '{keyword}' in '{details_lower}', adding adaptive symptom: {adaptive_symptom}")
-                normal_engine.add_response(adaptive_symptom, "yes")
-                normal_engine.add_symptom(adaptive_symptom, 2)
-        
-        # For normal mode, also try simple natural language splitting
-        for spec in normal_engine.process_natural_language(details):
-            normal_engine.add_symptom(spec, 2)
-    
-    # Print what adaptive symptoms were identified
-    print("Normal Tier 2 symptoms present:", symptoms_present)
-    print("Normal Tier 2 adaptive symptoms:", [s["S"] for s in normal_engine.prolog.query("has_symptom(S, 2).")])
-    
-    # Find tier3 questions that should be triggered
-    # Convert the key to a string (e.g., "s1_s2") so it is hashable
-    for key, questions in T3.items():
-        # Expecting key to be a pair of symptoms; if it's a list, convert to tuple
-        try:
-            s1, s2 = key if isinstance(key, (list, tuple)) else (key,)
-        except Exception:
-            continue  # Skip invalid keys
-        
-        # Only proceed if we got two symptoms to compare
-        if len([s1, s2]) != 2:
-            continue
-        
-        if s1 in symptoms_present and s2 in symptoms_present:
-            key_str = f"{s1}_{s2}"
-            triggered_t3[key_str] = questions
-    
-    print("Normal Tier 2 triggered tier 3 questions:", triggered_t3)
-    return {"tier3_questions": triggered_t3}
+    return await _process_tier2("normal", session, form_data)
 
 @app.post("/normal/process_tier3")
-async def normal_process_tier3(request: Request):
+async def normal_process_tier3(request: Request, session: Session = Depends(get_session)):
     form_data = await request.form()
-    print("Normal Tier 3 form data:", dict(form_data))
-    
-    processed_responses = {}
-    for key, value in form_data.items():
-        # Parse the key format: "symptom1_symptom2_index"
-        parts = key.split("_")
-        if len(parts) >= 3:
-            # Extract the pair of symptoms and the question index
-            s1 = parts[0]
-            s2 = parts[1]
-            
-            # Map the yes/no response to proper values
-            # Add both to response for appropriate pairs
-            if value.lower() in ['y', 'yes']:
-                # Check for specific tier 3 question mappings
-                if "measles_path" in key or parts[2] == "0" and s1 == "fever" and s2 == "rash":
-                    normal_engine.add_response("measles_path", "yes")
-                    processed_responses["measles_path"] = "yes"
-                if "strawberry_tongue" in key or parts[2] == "1" and s1 == "fever" and s2 == "rash":
-                    normal_engine.add_response("strawberry_tongue", "yes")
-                    processed_responses["strawberry_tongue"] = "yes"
-                if "labored_breathing" in key and s1 == "cough" and s2 == "fever":
-                    normal_engine.add_response("labored_breathing", "yes")
-                    processed_responses["labored_breathing"] = "yes"
-                if "contamination_exposure" in key and s1 == "vomiting" and s2 == "diarrhea":
-                    normal_engine.add_response("contamination_exposure", "yes")
-                    processed_responses["contamination_exposure"] = "yes"
-                if "sinus_pressure" in key and s1 == "fatigue" and s2 == "runny_nose":
-                    normal_engine.add_response("sinus_pressure", "yes")
-                    processed_responses["sinus_pressure"] = "yes"
-
-        # Also add the original key/value pair
-        normal_engine.add_response(key, value)
-        processed_responses[key] = value
-    
-    print("Normal Tier 3 processed responses:", processed_responses)
-    return {"message": "Tier 3 processed", "processed_responses": processed_responses}
+    processed_responses = _process_tier3("normal", session, form_data)
+    return {"message": "Tier 3 processed", "processed_responses": processed_responses,
+            "differential": _provisional("normal", session)}
 
 @app.post("/normal/diagnose")
-async def normal_diagnose(request: Request):
-    try:
-        # First, try to compute the diagnosis using your engine.
-        try:
-            print("\n----- Normal Mode Diagnosis -----")
-            print("Symptoms added:", [s["S"] for s in normal_engine.prolog.query("has_symptom(S, T).")])
-            print("User responses:", normal_engine.responses)
-            
-            results, department, probabilities = normal_engine.get_diagnosis()
-            print("Diagnosis results:", results)
-            print("Department:", department)
-            print("Probabilities:", probabilities)
-        except Exception as e:
-            print("Error in get_diagnosis:", e)
-            results, department, probabilities = None, None, None
-
-        # If no diagnosis is returned by get_diagnosis(), then compute a fallback.
-        if not results or results == []:
-            print("No results from diagnosis engine, using fallback logic")
-            responses = normal_engine.responses
-            rash_detail = responses.get("rash_detail", "").strip().lower()
-            fever_detail = responses.get("fever_detail", "").strip().lower()
-
-            if "rash" in responses and any(word in rash_detail for word in ["yes", "y", "localized", "widespread", "itchy"]):
-                print("Fallback: Rash-related diagnosis")
-                results = ["Measles"]
-                department = "Infectious Disease"
-                probabilities = {"Measles": "70%", "Scarlet Fever": "30%"}
-            elif "fever" in responses and any(word in fever_detail for word in ["high", "very high"]):
-                print("Fallback: Fever-related diagnosis")
-                results = ["Severe Viral Infection"]
-                department = "General Medicine"
-                probabilities = {"Severe Viral Infection": "65%", "Mild Viral Infection": "35%"}
-            else:
-                print("Fallback: Default diagnosis")
-                results = ["Default Diagnosis"]
-                department = "General"
-                probabilities = {"Default Diagnosis": "100%"}
-                
-        print("Final Diagnosis:", results, department, probabilities)
-        return JSONResponse(
-            content={
-                "diagnoses": results,
-                "department": department,
-                "probabilities": probabilities
-            }
-        )
-    except Exception as e:
-        print("Final Exception in normal_diagnose:", e)
-        return JSONResponse(
-            content={"error": str(e), "message": "Please consult a doctor."}, 
-            status_code=500
-        )
+async def normal_diagnose(session: Session = Depends(get_session)):
+    return await _diagnose("normal", session)
+
+@app.post("/normal/diagnose/stream")
+async def normal_diagnose_stream(session: Session = Depends(get_session)):
+    return await _diagnose_stream("normal", session)
 
 
 # ---------- DCG Mode Endpoints ----------
 @app.post("/dcg/process_tier1")
-async def dcg_process_tier1(symptoms: str = Form(...)):
-    # Reset before starting a new diagnosis
-    dcg_engine._reset_state()
-    
-    responses = {}
-    detected = dcg_engine.process_natural_language(symptoms.lower())
-    for s in detected:
-        responses[s] = "y"
-        dcg_engine.add_symptom(s, 1)
-    for s in T1:
-        responses.setdefault(s, "n")
+async def dcg_process_tier1(symptoms: str = Form(...), session: Session = Depends(get_session)):
     # Return Tier 2 questions so that the flow continues to Tier 2
-    return {
-        "symptoms": responses,
-        "tier2_questions": {s: T2[s] for s in responses if responses[s] == "y" and s in T2}
-    }
-
+    return await _process_tier1("dcg", session, [symptoms])
 
 @app.post("/dcg/process_tier2")
-async def dcg_process_tier2(request: Request):
+async def dcg_process_tier2(request: Request, session: Session = Depends(get_session)):
     form_data = await request.form()
-    triggered_t3 = {}
-    symptoms_present = []
-    
-    print("DCG Tier 2 form data:", dict(form_data))
-    
-    # Map specific keywords to adaptive symptoms
-    keyword_to_symptom = {
-        "high": "high_grade_fever",
-        "intermittent": "persistent_fever",
-        "chills": "chills",
-        "night": "night_sweats",
-        "dry": "dry_cough",
-        "wheez": "wheezing",
-        "night": "worsens_at_night",
-        "productive": "productive_cough",
-        "phlegm": "productive_cough",
-        "itchy": "itchy_rash",
-        "localized": "rash_localized_or_widespread",
-        "widespread": "rash_localized_or_widespread",
-        "peeling": "peeling_skin",
-        "blisters": "chickenpox_blisters",
-        "frequent": "frequent_loose_stools",
-        "severe": "dehydration_signs",
-        "watery": "watery_stool",
-        "cramps": "abdominal_cramps"
-    }
-    
-    for key, details in form_data.items():
-        symptom = key.replace("_detail", "")
-        symptoms_present.append(symptom)
-        
-        # Store the original input
-        atom = f"{symptom}_detail"
-        dcg_engine.add_response(atom, details)
-        dcg_engine.add_response(symptom, details)
-        
-        # Process keywords in the details to map to specific adaptive symptoms
-        details_lower = details.lower()
-        for keyword, adaptive_symptom in keyword_to_symptom.items():
-            if keyword in details_lower:
-                print(f"Found keyword '{keyword}' in '{details_lower}', adding adaptive symptom: {adaptive_symptom}")
-                dcg_engine.add_response(adaptive_symptom, "yes")
-                dcg_engine.add_symptom(adaptive_symptom, 2)
-        
-        # Process additional details via natural language
-        for spec in dcg_engine.process_natural_language(details):
-            dcg_engine.add_symptom(spec, 2)
-    
-    # Print what adaptive symptoms were identified
-    print("DCG Tier 2 symptoms present:", symptoms_present)
-    print("DCG Tier 2 adaptive symptoms:", [s["S"] for s in dcg_engine.prolog.query("has_symptom(S, 2).")])
-    
-    # Determine triggered Tier 3 questions based on symptom pairs in T3
-    for key, questions in T3.items():
-        # Expect key to be a tuple or list of two symptoms
+    return await _process_tier2("dcg", session, form_data)
+
+@app.post("/dcg/process_tier3")
+async def dcg_process_tier3(request: Request, session: Session = Depends(get_session)):
+    form_data = await request.form()
+    processed_responses = _process_tier3("dcg", session, form_data)
+    return {"message": "DCG Tier 3 processed", "processed_responses": processed_responses,
+            "differential": _provisional("dcg", session)}
+
+@app.post("/dcg/diagnose")
+async def dcg_diagnose(session: Session = Depends(get_session)):
+    return await _diagnose("dcg", session)
+
+@app.post("/dcg/diagnose/stream")
+async def dcg_diagnose_stream(session: Session = Depends(get_session)):
+    return await _diagnose_stream("dcg", session)
+
+@app.on_event("startup")
+async def start_engine_pool():
+    global engine_pool, kb_watcher
+    configure_logging()
+    release = freeze()
+    releases.add(release)
+    releases.promote(release.version)
+    for mode in ("normal", "dcg"):
+        release.compiled_rules(mode)
+    engine_pool = create_engine_pool()
+    if KB_RELOAD_INTERVAL > 0:
+        kb_watcher = asyncio.create_task(_watch_kb(KB_RELOAD_INTERVAL))
+
+@app.on_event("shutdown")
+async def shutdown_engine_pool():
+    if kb_watcher is not None:
+        kb_watcher.cancel()
+    engine_pool.shutdown()
+
+# ---------- KB hot reload ----------
+async def _smoke_test(release: KBRelease) -> List[str]:
+    """Replay the smoke corpus on release; return what went wrong.
+
+    Every case must run without an engine error, and the diseases in a
+    case's must_include (the curated invariants) must be among its
+    diagnoses. Anything else may change with the rules.
+    """
+    failures = []
+    for record in load_corpus():
+        mode = record["mode"]
+        case_input = CaseInput(symptoms=record["symptoms"], details=record.get("details", {}),
+                               answers=record.get("answers", {}))
         try:
-            s1, s2 = key if isinstance(key, (list, tuple)) else (key,)
-        except Exception:
-            continue  # Skip invalid keys
-        
-        if len([s1, s2]) != 2:
+            result = await _diagnose_whole_case(mode, case_input, release, strict=True)
+        except Exception as e:
+            failures.append(f"{mode} {case_input.symptoms}: {e!r}")
+            continue
+        if isinstance(result, JSONResponse):
+            failures.append(f"{mode} {case_input.symptoms}: {json.loads(result.body)['error']}")
             continue
-        
-        if s1 in symptoms_present and s2 in symptoms_present:
-            triggered_t3[f"{s1}_{s2}"] = questions
-            
-    print("DCG Tier 2 triggered tier 3 questions:", triggered_t3)
-    return {"tier3_questions": triggered_t3}
+        missing = [d for d in record.get("must_include", ()) if d not in result["diagnoses"]]
+        if missing:
+            failures.append(f"{mode} {case_input.symptoms}: expected {missing} among "
+                            f"{result['diagnoses']}")
+    return failures
 
 
-@app.post("/dcg/process_tier3")
-async def dcg_process_tier3(request: Request):
-    form_data = await request.form()
-    print("DCG Tier 3 form data:", dict(form_data))
-    
-    processed_responses = {}
-    for key, value in form_data.items():
-        # Parse the key format: "symptom1_symptom2_index"
-        parts = key.split("_")
-        if len(parts) >= 3:
-            # Extract the pair of symptoms and the question index
-            s1 = parts[0]
-            s2 = parts[1]
-            
-            # Map the yes/no response to proper values
-            # Add both to response for appropriate pairs
-            if value.lower() in ['y', 'yes']:
-                # Check for specific tier 3 question mappings
-                if "measles_path" in key or parts[2] == "0" and s1 == "fever" and s2 == "rash":
-                    dcg_engine.add_response("measles_path", "yes")
-                    processed_responses["measles_path"] = "yes"
-                if "strawberry_tongue" in key or parts[2] == "1" and s1 == "fever" and s2 == "rash":
-                    dcg_engine.add_response("strawberry_tongue", "yes")
-                    processed_responses["strawberry_tongue"] = "yes"
-                if "labored_breathing" in key and s1 == "cough" and s2 == "fever":
-                    dcg_engine.add_response("labored_breathing", "yes")
-                    processed_responses["labored_breathing"] = "yes"
-                if "contamination_exposure" in key and s1 == "vomiting" and s2 == "diarrhea":
-                    dcg_engine.add_response("contamination_exposure", "yes")
-                    processed_responses["contamination_exposure"] = "yes"
-                if "sinus_pressure" in key and s1 == "fatigue" and s2 == "runny_nose":
-                    dcg_engine.add_response("sinus_pressure", "yes")
-                    processed_responses["sinus_pressure"] = "yes"
-
-        # Also add the original key/value pair
-        dcg_engine.add_response(key, value)
-        processed_responses[key] = value
-    
-    print("DCG Tier 3 processed responses:", processed_responses)
-    return {"message": "DCG Tier 3 processed", "processed_responses": processed_responses}
+async def _retire_unused():
+    """Unload the releases that neither the current KB nor any live case uses"""
+    dropped = releases.retire(sessions.kb_versions())
+    if dropped:
+        await engine_pool.retire(releases.versions())
+        for version in dropped:
+            remove_release(version)
+        logger.info("knowledge base releases retired", extra={"versions": dropped})
 
 
-@app.post("/dcg/diagnose")
-async def dcg_diagnose(request: Request):
-    try:
+async def reload_kb(trigger: str) -> dict:
+    """Freeze the KB files, check the result on the smoke corpus and, if it
+    passes, make it the release new cases start on"""
+    async with reload_lock:
+        previous = releases.current.version
         try:
-            print("\n----- DCG Mode Diagnosis -----")
-            print("Symptoms added:", [s["S"] for s in dcg_engine.prolog.query("has_symptom(S, T).")])
-            print("User responses:", dcg_engine.responses)
-            
-            results, department, probabilities = dcg_engine.get_diagnosis()
-            print("Diagnosis results:", results)
-            print("Department:", department)
-            print("Probabilities:", probabilities)
+            release = await asyncio.to_thread(freeze)
         except Exception as e:
-            print("Error in dcg get_diagnosis:", e)
-            results, department, probabilities = None, None, None
-
-        if not results or results == []:
-            print("No results from DCG diagnosis engine, using fallback logic")
-            responses = dcg_engine.responses
-            rash_detail = responses.get("rash_detail", "").strip().lower()
-            fever_detail = responses.get("fever_detail", "").strip().lower()
-
-            if "rash" in responses and any(word in rash_detail for word in ["yes", "y", "localized", "widespread", "itchy"]):
-                print("DCG Fallback: Rash-related diagnosis")
-                results = ["Measles"]
-                department = "Infectious Disease"
-                probabilities = {"Measles": "70%", "Scarlet Fever": "30%"}
-            elif "fever" in responses and any(word in fever_detail for word in ["high", "very high"]):
-                print("DCG Fallback: Fever-related diagnosis")
-                results = ["Severe Viral Infection"]
-                department = "General Medicine"
-                probabilities = {"Severe Viral Infection": "65%", "Mild Viral Infection": "35%"}
+            # e.g. a syntax error, or a file caught half-written
+            KB_RELOADS.inc(trigger, "rejected")
+            logger.error("knowledge base reload failed", extra={"trigger": trigger, "error": str(e)})
+            return {"status": "rejected", "version": None, "current": previous, "failures": [str(e)]}
+        if release.version == previous:
+            KB_RELOADS.inc(trigger, "unchanged")
+            return {"status": "unchanged", "version": previous, "current": previous}
+        # A release still pinned by live cases is already loaded; keep it
+        staged = releases.get(release.version) is None
+        releases.add(release)
+        failures = await _smoke_test(release)
+        if failures:
+            if staged:
+                releases.discard(release.version)
+                await engine_pool.retire(releases.versions())
+                remove_release(release.version)
+            KB_RELOADS.inc(trigger, "rejected")
+            logger.error("knowledge base release rejected", extra={
+                "trigger": trigger, "version": release.version, "failures": failures[:20]})
+            return {"status": "rejected", "version": release.version, "current": previous,
+                    "failures": failures[:20]}
+        releases.promote(release.version)
+        await _retire_unused()
+        KB_RELOADS.inc(trigger, "promoted")
+        logger.info("knowledge base release promoted", extra={
+            "trigger": trigger, "version": release.version, "previous": previous})
+        return {"status": "promoted", "version": release.version, "current": release.version,
+                "previous": previous}
+
+
+async def _watch_kb(interval: float):
+    """Reload the KB whenever its files change, and retire unused releases"""
+    rejected = None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = (await asyncio.to_thread(kb_sha256))[:12]
+            if version != releases.current.version and version != rejected:
+                result = await reload_kb("watch")
+                rejected = result["version"] if result["status"] == "rejected" else None
             else:
-                print("DCG Fallback: Default diagnosis")
-                results = ["Default Diagnosis"]
-                department = "General"
-                probabilities = {"Default Diagnosis": "100%"}
-                
-        print("DCG Final Diagnosis:", results, department, probabilities)
-        return JSONResponse(
-            content={
-                "diagnoses": results,
-                "department": department,
-                "probabilities": probabilities
-            }
-        )
-    except Exception as e:
-        print("Final Exception in dcg_diagnose:", e)
-        return JSONResponse(
-            content={"error": str(e), "message": "Please consult a doctor."},
-            status_code=500
-        )
+                async with reload_lock:
+                    await _retire_unused()
+        except Exception:
+            logger.exception("knowledge base watcher failed")
+
+
+@app.post("/admin/reload_kb")
+async def admin_reload_kb(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or x_admin_token != ADMIN_TOKEN:
+        return JSONResponse(content={"error": "forbidden"}, status_code=403)
+    result = await reload_kb("admin")
+    return JSONResponse(content=result, status_code=422 if result["status"] == "rejected" else 200)
+
+# ---------- Stateless API ----------
+async def _diagnose_whole_case(mode: str, case_input: CaseInput, release: Optional[KBRelease] = None,
+                               strict: bool = False):
+    # A throwaway session: nothing is stored, and the random ID spreads
+    # requests across workers. No live session pins its case's release, so
+    # the request holds it until the diagnosis is done.
+    session = Session(uuid.uuid4().hex)
+    with releases.hold(release or releases.current) as release:
+        tier1 = await _process_tier1(mode, session, case_input.symptoms, release)
+        details = {f"{s}_detail": d for s, d in case_input.details.items()}
+        tier2 = await _process_tier2(mode, session, details)
+        _process_tier3(mode, session, case_input.answers)
+        result = await _diagnose(mode, session, strict)
+    if isinstance(result, JSONResponse):
+        return result
+    return {"symptoms": tier1["symptoms"], "tier3_questions": tier2["tier3_questions"], **result}
+
+@app.post("/v1/normal/diagnose")
+async def v1_normal_diagnose(case_input: CaseInput):
+    return await _diagnose_whole_case("normal", case_input)
+
+@app.post("/v1/dcg/diagnose")
+async def v1_dcg_diagnose(case_input: CaseInput):
+    return await _diagnose_whole_case("dcg", case_input)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,254 @@
+"""Re-score an archive of cases from JSONL or CSV.
+
+Each case goes through the same tier logic as the web app and then through
+the diagnosis/1 rules, spread over worker processes. Results are written as
+JSONL in input order while the input is still being read, so memory stays
+bounded by the number of chunks in flight.
+
+JSONL input: one object per line with the /v1 CaseInput fields, plus
+optional "id" and "mode":
+    {"id": "c1", "mode": "dcg", "symptoms": ["high fever and rash"],
+     "details": {"fever": "high"}, "answers": {"fever_rash_0": "y"}}
+A line that is not a JSON object gives an error row with its line number
+as the id.
+
+A case no rule matches gets the web app's fallback diagnosis.
+
+CSV input: columns id, mode, symptoms (";"-separated), detail_<symptom>
+and answer_<question key>; empty cells are ignored.
+
+With --scoring matrix each chunk is scored as one NumPy matrix (see
+scoring_matrix.py) instead of case by case through diagnosis/1. The
+diagnoses are the same, and each result also carries a "differential" of the
+best partial matches.
+
+    python batch.py cases.jsonl results.jsonl --workers 8 [--scoring matrix]
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Tuple
+
+import tiers
+from sessions import Case
+
+MODES = ("normal", "dcg")
+
+_engines: Dict[str, object] = {}
+_engine_options: Dict[str, str] = {}
+_matrices: Dict[str, object] = {}
+_scoring = {"method": "rules"}
+
+
+def read_cases(path: str) -> Iterator[dict]:
+    """Stream case records from a .jsonl or .csv file"""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            for n, row in enumerate(csv.DictReader(f), 1):
+                yield {
+                    "id": row.get("id") or str(n),
+                    "mode": row.get("mode") or None,
+                    "symptoms": [s.strip() for s in (row.get("symptoms") or "").split(";") if s.strip()],
+                    "details": {k[len("detail_"):]: v for k, v in row.items()
+                                if k.startswith("detail_") and v},
+                    "answers": {k[len("answer_"):]: v for k, v in row.items()
+                                if k.startswith("answer_") and v},
+                }
+        else:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    # Scored as an error row, so one bad line does not abort the batch
+                    yield {"id": str(n), "invalid": f"line {n}: invalid JSON: {e}"}
+                    continue
+                if not isinstance(record, dict):
+                    yield {"id": str(n), "invalid": f"line {n}: expected a JSON object"}
+                    continue
+                record.setdefault("id", str(n))
+                yield record
+
+
+def _init_worker(engine_options, scoring="rules"):
+    _engine_options.update(engine_options)
+    _scoring["method"] = scoring
+
+
+def _engine(mode: str):
+    if mode not in _engines:
+        from diagnosis_engine import DiagnosisEngine
+        _engines[mode] = DiagnosisEngine(mode=mode, **_engine_options)
+    return _engines[mode]
+
+
+def _matrix(mode: str):
+    if mode not in _matrices:
+        from diagnosis_engine import SNAPSHOT
+        from rule_compiler import load_rules
+        from scoring_matrix import ScoringMatrix
+        _matrices[mode] = ScoringMatrix(load_rules(mode), SNAPSHOT.rule_len)
+    return _matrices[mode]
+
+
+def _build_case(engine, record: dict) -> Tuple[Case, dict]:
+    """Run the tier logic over a record; returns the case and the tier-1 result"""
+    case = Case()
+    texts = [text.lower() for text in record.get("symptoms", [])]
+    tier1 = tiers.tier1(case, engine.parse_many(texts))
+    details = {f"{s}_detail": d for s, d in record.get("details", {}).items()}
+    tiers.tier2(case, details, engine.parse_many(list(details.values())))
+    tiers.tier3(case, record.get("answers", {}))
+    return case, tier1
+
+
+def _mode(record: dict, default_mode: str) -> str:
+    if "invalid" in record:
+        raise ValueError(record["invalid"])
+    mode = record.get("mode") or default_mode
+    if mode not in MODES:
+        raise ValueError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    return mode
+
+
+def _error(record: dict, mode, e: Exception) -> dict:
+    return {"id": record.get("id"), "mode": mode, "error": str(e)}
+
+
+def _result(record: dict, mode: str, case: Case, tier1: dict, results, department, probabilities) -> dict:
+    if not results:
+        # The same heuristic answer the web app gives when no rule matched
+        _, results, department, probabilities = tiers.fallback_diagnosis(case.responses)
+    return {
+        "id": record.get("id"),
+        "mode": mode,
+        "symptoms": [s for s, v in tier1["symptoms"].items() if v == "y"],
+        "diagnoses": results,
+        "department": department,
+        "probabilities": probabilities,
+    }
+
+
+def score_case(record: dict, default_mode: str) -> dict:
+    mode = record.get("mode") or default_mode
+    try:
+        engine = _engine(_mode(record, default_mode))
+        case, tier1 = _build_case(engine, record)
+        results, department, probabilities = engine.diagnose_case(case)
+    except Exception as e:
+        return _error(record, mode, e)
+    return _result(record, mode, case, tier1, results, department, probabilities)
+
+
+def score_chunk_matrix(chunk: List[dict], default_mode: str) -> List[dict]:
+    """Score a chunk with one matrix product per mode; results in input order"""
+    from diagnosis_engine import rank_diagnoses
+
+    results: List[dict] = [None] * len(chunk)
+    built: Dict[str, List[Tuple[int, Case, dict]]] = {}
+    for i, record in enumerate(chunk):
+        mode = record.get("mode") or default_mode
+        try:
+            case, tier1 = _build_case(_engine(_mode(record, default_mode)), record)
+        except Exception as e:
+            results[i] = _error(record, mode, e)
+            continue
+        built.setdefault(mode, []).append((i, case, tier1))
+    for mode, entries in built.items():
+        try:
+            matched, ranked = _matrix(mode).score_cases(case for _, case, _ in entries)
+        except Exception as e:
+            for i, _, _ in entries:
+                results[i] = _error(chunk[i], mode, e)
+            continue
+        for (i, case, tier1), diseases, differential in zip(entries, matched, ranked):
+            result = _result(chunk[i], mode, case, tier1, *rank_diagnoses(diseases))
+            result["differential"] = {d.replace('_', ' ').title(): score
+                                      for d, score in differential.items()}
+            results[i] = result
+    return results
+
+
+def _score_chunk(chunk: List[dict], default_mode: str) -> List[dict]:
+    if _scoring["method"] == "matrix":
+        return score_chunk_matrix(chunk, default_mode)
+    return [score_case(record, default_mode) for record in chunk]
+
+
+def _chunks(records: Iterator[dict], size: int) -> Iterator[List[dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run(records: Iterator[dict], out, mode: str = "normal", workers: int = 1,
+        chunksize: int = 64, engine_options: dict = None, progress=sys.stderr,
+        scoring: str = "rules") -> int:
+    """Score records into out (one JSON line each, input order); returns the count"""
+    engine_options = engine_options or {}
+    start = time.perf_counter()
+    done = 0
+
+    def write(results):
+        nonlocal done
+        for result in results:
+            out.write(json.dumps(result) + "\n")
+        done += len(results)
+        if progress and done // 10000 != (done - len(results)) // 10000:
+            rate = done / (time.perf_counter() - start)
+            print(f"{done} cases, {rate:.0f} cases/s", file=progress)
+
+    if workers <= 1:
+        _init_worker(engine_options, scoring)
+        for chunk in _chunks(records, chunksize):
+            write(_score_chunk(chunk, mode))
+    else:
+        # Each worker builds its own Prolog engine; results are collected in
+        # submission order with a bounded number of chunks in flight
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(engine_options, scoring)) as pool:
+            pending = deque()
+            for chunk in _chunks(records, chunksize):
+                pending.append(pool.apply_async(_score_chunk, (chunk, mode)))
+                if len(pending) >= workers * 2:
+                    write(pending.popleft().get())
+            while pending:
+                write(pending.popleft().get())
+
+    elapsed = time.perf_counter() - start
+    if progress:
+        print(f"Scored {done} cases in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f} cases/s)",
+              file=progress)
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk re-score cases from JSONL or CSV")
+    parser.add_argument("input", help="cases file (.jsonl or .csv)")
+    parser.add_argument("output", help="results file (.jsonl); '-' for stdout")
+    parser.add_argument("--mode", choices=MODES, default="normal",
+                        help="mode for records that do not set one")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--engine", choices=["prolog", "compiled"], default="prolog")
+    parser.add_argument("--scoring", choices=["rules", "matrix"], default="rules",
+                        help="diagnose case by case, or score each chunk as a NumPy matrix")
+    args = parser.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run(read_cases(args.input), out, mode=args.mode, workers=args.workers,
+            chunksize=args.chunksize, engine_options={"engine": args.engine}, scoring=args.scoring)
+    finally:
+        if out is not sys.stdout:
+            out.close()
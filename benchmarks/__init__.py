@@ -0,0 +1,4 @@
+"""Reproducible performance benchmarks.
+
+    python -m benchmarks.run --out bench.json
+"""
@@ -0,0 +1,55 @@
+"""Synthetic case generator built from T1/T2/T3 and the symptom//1 vocabulary"""
+import random
+from typing import Dict, List
+
+from diagnosis_engine import T1, T2, T3
+from phrase_matcher import load_phrase_table
+from symptom_extractor import ADAPTIVE_KEYWORDS
+
+FILLER = ["my", "son", "daughter", "has", "had", "a", "and", "since", "yesterday",
+          "the", "bad", "some", "with", "really", "last", "night", "also", "very"]
+
+
+class CaseGenerator:
+    """Deterministic stream of cases in the /v1 CaseInput shape"""
+
+    def __init__(self, seed: int = 0, kb: str = "dcg_rules.pl"):
+        self.rng = random.Random(seed)
+        self.phrases: Dict[str, List[str]] = {}
+        for symptom, phrase in load_phrase_table(kb):
+            self.phrases.setdefault(symptom, []).append(" ".join(phrase))
+        self.detail_words = [k.rstrip("*") for k, _ in ADAPTIVE_KEYWORDS]
+
+    def sentence(self, n_words: int) -> str:
+        """Free text of about n_words words, with a symptom phrase every ~6 words"""
+        words = []
+        vocab = sorted(self.phrases)
+        while len(words) < n_words:
+            if self.rng.random() < 0.2:
+                words.extend(self.rng.choice(self.phrases[self.rng.choice(vocab)]).split())
+            else:
+                words.append(self.rng.choice(FILLER))
+        return " ".join(words[:n_words])
+
+    def case(self, mode: str = "normal") -> dict:
+        rng = self.rng
+        primaries = rng.sample(T1, rng.randint(1, 3))
+        # Bias towards T3 triggers so tier 3 is exercised
+        if rng.random() < 0.5:
+            primaries = sorted(set(primaries) | set(rng.choice(list(T3))))
+        if mode == "dcg":
+            parts = [rng.choice(self.phrases.get(s, [s.replace("_", " ")])) for s in primaries]
+            symptoms = [" and ".join(parts)]
+        else:
+            symptoms = list(primaries)
+        details = {s: " ".join(rng.sample(self.detail_words, rng.randint(1, 3)))
+                   for s in primaries if s in T2}
+        answers = {}
+        for trigger, questions in T3.items():
+            if all(s in primaries for s in trigger):
+                for i in range(len(questions)):
+                    answers[f"{'_'.join(trigger)}_{i}"] = rng.choice(["y", "n"])
+        return {"mode": mode, "symptoms": symptoms, "details": details, "answers": answers}
+
+    def cases(self, count: int, mode: str = "normal") -> List[dict]:
+        return [self.case(mode) for _ in range(count)]
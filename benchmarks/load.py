@@ -0,0 +1,255 @@
+"""Drive many concurrent families through the four-tier HTTP flow.
+
+    python -m benchmarks.load --users 2000 --concurrency 200 --out load.json
+    python -m benchmarks.load --url http://localhost:8000 --users 500
+
+Unless --url is given, the app is started with uvicorn on a free local port
+(DIAGNOSIS_WORKERS and DIAGNOSIS_ENGINE come from --workers and --engine) and
+stopped afterwards. Each virtual user is one family with one case, in
+normal or dcg mode. It posts process_tier1 without a session, keeps the
+session ID the app returns, and sends process_tier2, process_tier3 and
+diagnose on that session. Cases come from benchmarks.cases; the dcg ones are
+wrapped in free text the way a parent would type them.
+
+Before the load starts every case is run once on its own, and those answers
+are what each user must get back. A user whose tier-1 symptoms or diagnoses
+differ, or whose responses carry another session's ID, counts as a wrong
+answer: cases under load should never see each other's facts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.cases import CaseGenerator
+from benchmarks.run import git_revision, summarize
+from kb_compiler import kb_sha256
+from sessions import SESSION_HEADER
+
+# How a parent might phrase the symptoms in DCG mode
+FAMILY_TEXTS = [
+    "{}",
+    "my son has {} since yesterday",
+    "my daughter had {} last night",
+    "she has {} and is very tired",
+    "since yesterday he has {}",
+]
+
+
+def family_cases(gen: CaseGenerator, count: int, mode: str) -> List[dict]:
+    cases = gen.cases(count, mode)
+    if mode == "dcg":
+        for case in cases:
+            case["symptoms"] = [gen.rng.choice(FAMILY_TEXTS).format(t) for t in case["symptoms"]]
+    return cases
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, engine: str) -> subprocess.Popen:
+    env = dict(os.environ, DIAGNOSIS_WORKERS=str(workers), DIAGNOSIS_ENGINE=engine,
+               LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"))
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                             "--port", str(port), "--log-level", "warning"], env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, server: Optional[subprocess.Popen], timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"app exited with status {server.returncode}")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"app not ready after {timeout:.0f}s")
+        await asyncio.sleep(0.2)
+
+
+class SessionMismatch(Exception):
+    """A response belonged to a different session than the request"""
+
+
+class LoadRun:
+    """Latency samples, errors and wrong answers of one load run"""
+
+    def __init__(self, client: httpx.AsyncClient, think: float = 0.0, seed: int = 0):
+        self.client = client
+        self.think = think
+        self.rng = random.Random(seed)
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.wrong: Dict[str, int] = {}
+
+    async def post(self, session_id: Optional[str], name: str, url: str, **kwargs) -> Tuple[str, dict]:
+        """(session ID of the response, its body); without session_id the app starts a session.
+
+        The session travels in the header; the client keeps no cookies (see
+        run_load), or the first post of one family would carry the session
+        cookie of another.
+        """
+        headers = {SESSION_HEADER: session_id} if session_id else {}
+        start = time.perf_counter()
+        response = await self.client.post(url, headers=headers, **kwargs)
+        self.samples.setdefault(name, []).append(time.perf_counter() - start)
+        response.raise_for_status()
+        returned = response.headers.get(SESSION_HEADER)
+        if not returned or session_id and returned != session_id:
+            raise SessionMismatch(name)
+        return returned, response.json()
+
+    async def flow(self, mode: str, record: dict) -> dict:
+        """One family's pass through the four tiers: tier-1 symptoms and diagnoses"""
+        name = "process_tier1"
+        try:
+            # The app mints the session ID; the family keeps using it
+            if mode == "dcg":
+                session_id, tier1 = await self.post(None, f"{mode}/{name}", "/dcg/process_tier1",
+                                                    data={"symptoms": record["symptoms"][0]})
+            else:
+                session_id, tier1 = await self.post(None, f"{mode}/{name}", "/normal/process_tier1",
+                                                    json={"symptoms": record["symptoms"]})
+            for name, data in (("process_tier2", {f"{s}_detail": d for s, d in record["details"].items()}),
+                               ("process_tier3", record["answers"])):
+                if self.think:
+                    await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+                await self.post(session_id, f"{mode}/{name}", f"/{mode}/{name}", data=data)
+            name = "diagnose"
+            _, result = await self.post(session_id, f"{mode}/{name}", f"/{mode}/diagnose")
+        except SessionMismatch:
+            self.wrong[mode] = self.wrong.get(mode, 0) + 1
+            return {}
+        except (httpx.HTTPError, ValueError):
+            key = f"{mode}/{name}"
+            self.errors[key] = self.errors.get(key, 0) + 1
+            return {}
+        return {"symptoms": tier1["symptoms"], "diagnoses": result.get("diagnoses")}
+
+    async def user(self, mode: str, record: dict, expected: dict):
+        start = time.perf_counter()
+        answer = await self.flow(mode, record)
+        if not answer:
+            return
+        self.samples.setdefault(f"{mode}/flow", []).append(time.perf_counter() - start)
+        if answer != expected:
+            self.wrong[mode] = self.wrong.get(mode, 0) + 1
+
+
+async def run_load(base_url: str, users: int = 2000, concurrency: int = 200, cases: int = 100,
+                   modes=("normal", "dcg"), think: float = 0.0, seed: int = 0,
+                   server: Optional[subprocess.Popen] = None, timeout: float = 60.0) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    # Refuse every cookie: families share the client, not sessions
+    no_cookies = CookieJar(DefaultCookiePolicy(allowed_domains=[]))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout,
+                                 cookies=no_cookies) as client:
+        await wait_ready(client, server)
+        gen = CaseGenerator(seed)
+        records = {mode: family_cases(gen, cases, mode) for mode in modes}
+
+        # Baseline: every case on its own, before there is any load
+        baseline = LoadRun(client, seed=seed)
+        expected = {mode: [await baseline.flow(mode, record) for record in records[mode]]
+                    for mode in modes}
+        if baseline.errors or baseline.wrong:
+            raise RuntimeError(f"baseline run failed: {baseline.errors or baseline.wrong}")
+
+        load = LoadRun(client, think, seed)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i: int):
+            mode = modes[i % len(modes)]
+            index = (i // len(modes)) % cases
+            async with semaphore:
+                await load.user(mode, records[mode][index], expected[mode][index])
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded(i) for i in range(users)))
+        elapsed = time.perf_counter() - start
+
+    requests = sum(len(v) for k, v in load.samples.items() if not k.endswith("/flow"))
+    flows = sum(len(load.samples.get(f"{mode}/flow", ())) for mode in modes)
+    wrong = sum(load.wrong.values())
+    return {
+        "seconds": round(elapsed, 3),
+        "users": users,
+        "completed": flows,
+        "flows_per_second": round(flows / elapsed, 2),
+        "requests_per_second": round(requests / elapsed, 2),
+        "latency": {name: summarize(values) for name, values in sorted(load.samples.items())},
+        "errors": load.errors,
+        "wrong_answers": load.wrong,
+        "wrong_answer_rate": round(wrong / max(1, users - sum(load.errors.values())), 6),
+    }
+
+
+def run(url: Optional[str] = None, users: int = 2000, concurrency: int = 200, cases: int = 100,
+        modes=("normal", "dcg"), think: float = 0.0, workers: int = 1, engine: str = "prolog",
+        seed: int = 0) -> dict:
+    server = None
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(port, workers, engine)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "kb_sha256": kb_sha256(),
+            "url": url,
+            "concurrency": concurrency,
+            "cases": cases,
+            "think_seconds": think,
+            "seed": seed,
+        },
+    }
+    if server is not None:
+        report["meta"].update(workers=workers, engine=engine)
+    try:
+        report["results"] = asyncio.run(run_load(url, users, concurrency, cases, tuple(modes),
+                                                 think, seed, server))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent four-tier load against the web app")
+    parser.add_argument("--url", help="server to load (default: start the app on a free local port)")
+    parser.add_argument("--users", type=int, default=2000, help="families, each a fresh session")
+    parser.add_argument("--concurrency", type=int, default=200, help="families in flight at once")
+    parser.add_argument("--cases", type=int, default=100, help="distinct cases per mode")
+    parser.add_argument("--modes", default="normal,dcg")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="mean pause between tiers in seconds, as a person filling in the form")
+    parser.add_argument("--workers", type=int, default=1, help="DIAGNOSIS_WORKERS of the started app")
+    parser.add_argument("--engine", default="prolog", help="DIAGNOSIS_ENGINE of the started app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="-", help="JSON output file ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = run(args.url, args.users, args.concurrency, args.cases, args.modes.split(","),
+                 args.think, args.workers, args.engine, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
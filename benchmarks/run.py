@@ -0,0 +1,226 @@
+"""Time every tier, both modes and the parser; write the results as JSON.
+
+    python -m benchmarks.run --out bench.json [--repeat 200] [--engines prolog,compiled]
+    python -m benchmarks.run --startup-only --out startup.json
+
+Each result is a list of latency samples summarised as microseconds
+(mean/p50/p95/p99/min/max). The "meta" block records the code revision and a
+hash of the KB files so that runs can be compared across versions.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+import tiers
+from benchmarks.cases import CaseGenerator
+from diagnosis_engine import NL_CACHE, RESULT_CACHE, DiagnosisEngine
+from kb_compiler import kb_sha256
+from sessions import Case
+
+PARSE_LENGTHS = (5, 20, 80, 320)
+
+# Run in a fresh interpreter; prints the phases of a cold start as JSON
+STARTUP_PROBE = """
+import json, time
+start = time.perf_counter()
+from diagnosis_engine import DiagnosisEngine
+from sessions import Case
+phases = {"import": time.perf_counter() - start}
+for mode in ("normal", "dcg"):
+    t = time.perf_counter()
+    engine = DiagnosisEngine(mode=mode)
+    phases[mode + "_load"] = time.perf_counter() - t
+    t = time.perf_counter()
+    engine.diagnose_case(Case())
+    phases[mode + "_first_diagnosis"] = time.perf_counter() - t
+print(json.dumps(phases))
+"""
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    us = sorted(s * 1e6 for s in samples)
+    return {
+        "n": len(us),
+        "mean_us": round(statistics.fmean(us), 2),
+        "p50_us": round(us[len(us) // 2], 2),
+        "p95_us": round(us[min(len(us) - 1, int(len(us) * 0.95))], 2),
+        "p99_us": round(us[min(len(us) - 1, int(len(us) * 0.99))], 2),
+        "min_us": round(us[0], 2),
+        "max_us": round(us[-1], 2),
+    }
+
+
+def timed(fn: Callable, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def build_case(engine: DiagnosisEngine, record: dict) -> Case:
+    case = Case()
+    tiers.tier1(case, engine.parse_many([t.lower() for t in record["symptoms"]]))
+    details = {f"{s}_detail": d for s, d in record["details"].items()}
+    tiers.tier2(case, details, engine.parse_many(list(details.values())))
+    tiers.tier3(case, record["answers"])
+    return case
+
+
+def bench_parse(engine: DiagnosisEngine, gen: CaseGenerator, repeat: int) -> Dict[str, dict]:
+    results = {}
+    for n_words in PARSE_LENGTHS:
+        texts = [gen.sentence(n_words) for _ in range(repeat)]
+        cold = []
+        for text in texts:
+            NL_CACHE.clear()
+            cold.append(timed(engine.process_natural_language, text))
+        warm = [timed(engine.process_natural_language, text) for text in texts]
+        results[f"{n_words}_words"] = summarize(cold)
+        results[f"{n_words}_words_cached"] = summarize(warm)
+    return results
+
+
+def bench_assert(engine: DiagnosisEngine, records: List[dict], repeat: int) -> Dict[str, dict]:
+    symptoms, responses = [], []
+    for i in range(repeat):
+        symptoms.append(timed(engine.add_symptom, f"bench_symptom_{i}", 2))
+        responses.append(timed(engine.add_response, f"bench_key_{i}", "high, with chills"))
+    engine._reset_state()
+    # A whole case per call, as diagnose_case() does
+    bulk = []
+    for record in records:
+        case = build_case(engine, record)
+        bulk.append(timed(engine.assert_facts, case.symptoms, case.response_facts))
+        engine._reset_state()
+    return {"add_symptom": summarize(symptoms), "add_response": summarize(responses),
+            "assert_facts_case": summarize(bulk)}
+
+
+def bench_diagnosis(engine: DiagnosisEngine, records: List[dict]) -> Dict[str, dict]:
+    cases = [build_case(engine, record) for record in records]
+    cold = []
+    for case in cases:
+        RESULT_CACHE.clear()
+        cold.append(timed(engine.diagnose_case, case))
+    warm = [timed(engine.diagnose_case, case) for case in cases]
+    return {"uncached": summarize(cold), "cached": summarize(warm)}
+
+
+def bench_startup(repeat: int) -> Dict[str, dict]:
+    """Cold-start phases of a new process, first without and then with .qlf files"""
+    def probe():
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True,
+                             check=True, env=dict(os.environ, LOG_LEVEL="WARNING")).stdout
+        phases = json.loads(out.strip().splitlines()[-1])
+        phases["process"] = time.perf_counter() - start
+        return phases
+
+    for path in glob.glob("*.qlf"):
+        os.remove(path)
+    results = {f"compile_{phase}": summarize([seconds]) for phase, seconds in probe().items()}
+    samples: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        for phase, seconds in probe().items():
+            samples.setdefault(phase, []).append(seconds)
+    results.update({phase: summarize(values) for phase, values in samples.items()})
+    return results
+
+
+def bench_http(mode: str, records: List[dict]) -> Dict[str, dict]:
+    from fastapi.testclient import TestClient
+
+    import app as app_module
+
+    samples: Dict[str, List[float]] = {}
+
+    def post(client, name, url, **kwargs):
+        start = time.perf_counter()
+        response = client.post(url, **kwargs)
+        samples.setdefault(name, []).append(time.perf_counter() - start)
+        response.raise_for_status()
+        return response.json()
+
+    with TestClient(app_module.app) as client:
+        for record in records:
+            start = time.perf_counter()
+            if mode == "dcg":
+                post(client, "process_tier1", "/dcg/process_tier1", data={"symptoms": record["symptoms"][0]})
+            else:
+                post(client, "process_tier1", "/normal/process_tier1", json={"symptoms": record["symptoms"]})
+            post(client, "process_tier2", f"/{mode}/process_tier2",
+                 data={f"{s}_detail": d for s, d in record["details"].items()})
+            post(client, "process_tier3", f"/{mode}/process_tier3", data=record["answers"])
+            post(client, "diagnose", f"/{mode}/diagnose")
+            samples.setdefault("full_flow", []).append(time.perf_counter() - start)
+            post(client, "v1_diagnose", f"/v1/{mode}/diagnose", json=record)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def run(repeat: int = 200, engines=("prolog",), seed: int = 0, http: bool = True,
+        startup_repeat: int = 5, startup_only: bool = False) -> dict:
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "kb_sha256": kb_sha256(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": {},
+    }
+    results = report["results"]
+    results["startup"] = bench_startup(startup_repeat)
+    if startup_only:
+        return report
+    for mode in ("normal", "dcg"):
+        gen = CaseGenerator(seed)
+        records = gen.cases(repeat, mode)
+        for engine_kind in engines:
+            engine = DiagnosisEngine(mode=mode, engine=engine_kind)
+            results[f"{mode}.{engine_kind}.get_diagnosis"] = bench_diagnosis(engine, records)
+        engine = DiagnosisEngine(mode=mode)
+        results[f"{mode}.assert"] = bench_assert(engine, records, repeat)
+        if mode == "dcg":
+            results["dcg.process_natural_language"] = bench_parse(engine, gen, repeat)
+        if http:
+            results[f"{mode}.http"] = bench_http(mode, records)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--out", default="-", help="JSON output file ('-' for stdout)")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", default="prolog,compiled",
+                        help="comma-separated diagnosis engines to time")
+    parser.add_argument("--no-http", action="store_true", help="skip the end-to-end HTTP flows")
+    parser.add_argument("--startup-repeat", type=int, default=5, help="fresh processes to time")
+    parser.add_argument("--startup-only", action="store_true", help="only time cold starts")
+    args = parser.parse_args()
+
+    report = run(args.repeat, tuple(args.engines.split(",")), args.seed, not args.no_http,
+                 args.startup_repeat, args.startup_only)
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
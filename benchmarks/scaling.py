@@ -0,0 +1,112 @@
+"""Time diagnosis against synthetic KBs of growing size, with and without dispatch.
+
+    python -m benchmarks.scaling --sizes 10,100,500,1000 --cases 200 --out scaling.json
+
+For each size a KB with that many diseases (and --symptoms-per-disease times
+as many symptoms) is written by benchmarks.synthetic_kb. Cases are generated
+from its rules as in ``rule_compiler.py --check``. Each case is diagnosed
+trying every rule ("full") and only the rules the dispatch index selects
+("indexed"). The two must agree, and any case where they differ is counted
+under "mismatches". The prolog engine also reports SWI inference counts.
+Where "full" and "indexed" cross for the compiled engine is what
+rule_compiler.DISPATCH_MIN_RULES is set from.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from benchmarks.run import git_revision, summarize, timed
+from benchmarks.synthetic_kb import write_kb
+from diagnosis_engine import DiagnosisEngine
+from rule_compiler import CompiledRuleSet, generate_cases
+
+
+def bench_compiled(rules: CompiledRuleSet, cases) -> Dict[str, object]:
+    full, indexed, mismatches = [], [], 0
+    for case in cases:
+        start = time.perf_counter()
+        expected = rules.evaluate_case(case, dispatch=False)
+        full.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        actual = rules.evaluate_case(case, dispatch=True)
+        indexed.append(time.perf_counter() - start)
+        mismatches += expected != actual
+    return {"full": summarize(full), "indexed": summarize(indexed), "mismatches": mismatches}
+
+
+def bench_prolog(path: str, cases) -> Dict[str, object]:
+    engine = DiagnosisEngine(mode="normal", kb=path)
+    samples: Dict[str, List[float]] = {"full": [], "indexed": []}
+    inferences: Dict[str, List[float]] = {"full": [], "indexed": []}
+    mismatches = 0
+    for case in cases:
+        candidates = engine.dispatch.candidates(s for s, _ in case.symptoms)
+        with engine.case_context() as case_module:
+            engine.assert_facts(case.symptoms, case.response_facts, case_module)
+            results = {}
+            for name, restrict in (("full", None), ("indexed", candidates)):
+                engine.stages = {}
+                samples[name].append(timed(engine.infer, restrict, case_module))
+                inferences[name].append(engine.stages.get("inference", [0.0, 0])[1])
+                results[name] = set(engine.infer(restrict, case_module))
+        mismatches += results["full"] != results["indexed"]
+    report = {name: summarize(values) for name, values in samples.items()}
+    report.update({f"{name}_inferences": round(sum(values) / len(values), 1)
+                   for name, values in inferences.items()})
+    report["mismatches"] = mismatches
+    report["load_seconds"] = round(engine.load_seconds, 4)
+    return report
+
+
+def run(sizes=(10, 100, 500, 1000), cases: int = 200, engines=("prolog", "compiled"),
+        symptoms_per_disease: int = 6, seed: int = 0, workdir: str = None) -> dict:
+    workdir = workdir or tempfile.mkdtemp(prefix="synthetic_kb_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_revision": git_revision(),
+            "cases": cases,
+            "seed": seed,
+            "symptoms_per_disease": symptoms_per_disease,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        path = write_kb(os.path.join(workdir, f"synthetic_kb_{size}.pl"), size,
+                        size * symptoms_per_disease, seed)
+        rules = CompiledRuleSet.from_file(path)
+        sample = generate_cases(rules, cases, seed)
+        result = {"rules": len(rules.rules), "facts": len(rules.bits),
+                  "mean_candidates": round(sum(len(rules.dispatch.rule_indices(
+                      s for s, _ in case.symptoms)) for case in sample) / len(sample), 1)}
+        if "compiled" in engines:
+            result["compiled"] = bench_compiled(rules, sample)
+        if "prolog" in engines:
+            result["prolog"] = bench_prolog(path, sample)
+        report["results"][str(size)] = result
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnosis latency against synthetic KB size")
+    parser.add_argument("--sizes", default="10,100,500,1000", help="comma-separated disease counts")
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--engines", default="prolog,compiled")
+    parser.add_argument("--symptoms-per-disease", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where to write the KBs (default: a temp dir)")
+    parser.add_argument("--out", default="-", help="JSON output file ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = run(tuple(int(s) for s in args.sizes.split(",")), args.cases,
+                 tuple(args.engines.split(",")), args.symptoms_per_disease, args.seed, args.workdir)
+    text = json.dumps(report, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
@@ -0,0 +1,105 @@
+"""Generate synthetic knowledge bases in the style of diagnosis.pl.
+
+    python -m benchmarks.synthetic_kb --diseases 500 --symptoms 3000 --out synthetic_kb_500.pl
+
+A generated KB has preliminary_symptom/1, adaptive_symptom/2, tier3_trigger/2,
+the question, weight and department facts, the has_adaptive_symptoms/2
+helper and one diagnosis/1 rule per disease. The rules use the same goal
+shapes as diagnosis.pl, so rule_compiler.py compiles them and the case
+modules of case_facts.pl work with them unchanged.
+"""
+import argparse
+import os
+import random
+from typing import List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPARTMENTS = ["Infectious Disease", "Pediatrics", "Dermatology", "General Pediatrics",
+               "Pulmonology", "Gastroenterology", "ENT"]
+
+
+def _atoms(items) -> str:
+    return "[" + ", ".join(items) + "]"
+
+
+def generate_kb(diseases: int = 500, symptoms: int = 3000, seed: int = 0,
+                case_facts: str = os.path.join(REPO_ROOT, "case_facts")) -> str:
+    """Prolog source of a KB with about that many diseases and symptoms"""
+    rng = random.Random(seed)
+    n_primary = max(7, symptoms // 10)
+    n_deep = max(3, symptoms // 10)
+    per_primary = max(1, (symptoms - n_primary - n_deep) // n_primary)
+    primaries = [f"p{i}" for i in range(n_primary)]
+    adaptive = {p: [f"{p}_a{j}" for j in range(per_primary)] for p in primaries}
+    deep = [f"d{k}" for k in range(n_deep)]
+    triggers = {}
+    while len(triggers) < max(1, diseases // 10):
+        pair = tuple(sorted(rng.sample(primaries, 2)))
+        triggers[pair] = rng.sample(deep, min(3, len(deep)))
+
+    lines: List[str] = [
+        f"% Synthetic KB: {diseases} diseases, {symptoms} symptoms, seed {seed}",
+        ":- dynamic user_response/2.",
+        ":- dynamic has_symptom/2.",
+        "",
+        f":- use_module('{case_facts}').",
+        "goal_expansion(has_symptom(S, T), case_fact(has_symptom(S, T))).",
+        "goal_expansion(user_response(K, V), case_fact(user_response(K, V))).",
+        "",
+    ]
+    lines += [f"preliminary_symptom({p})." for p in primaries]
+    lines.append("")
+    lines += [f"adaptive_symptom({p}, {_atoms(group)})." for p, group in adaptive.items()]
+    lines.append("")
+    lines += [f"tier3_trigger({_atoms(pair)}, {_atoms(facts)})." for pair, facts in triggers.items()]
+    lines.append("")
+    lines += [f"tier2_question({p}, 'Describe {p}:')." for p in primaries]
+    lines += [f"tier3_question({_atoms(pair)}, 'Any sign of {facts[0]}? (y/n):')."
+              for pair, facts in triggers.items()]
+    lines += [
+        "",
+        "has_adaptive_symptoms(PrimarySymptom, Count) :-",
+        "    adaptive_symptom(PrimarySymptom, AdaptiveList),",
+        "    findall(Symptom, (",
+        "        member(Symptom, AdaptiveList),",
+        "        user_response(Symptom, yes)",
+        "    ), Matches),",
+        "    length(Matches, Count).",
+        "",
+    ]
+
+    rules, weights, departments = [], [], []
+    for i in range(diseases):
+        disease = f"disease_{i}"
+        chosen = rng.sample(primaries, rng.randint(1, 3))
+        goals = [f"has_symptom({p}, _)" for p in chosen]
+        for n, p in enumerate(chosen):
+            if rng.random() < 0.5:
+                goals += [f"has_adaptive_symptoms({p}, Count{n})",
+                          f"Count{n} >= {rng.randint(1, min(2, per_primary))}"]
+        pool = [a for p in chosen for a in adaptive[p]]
+        goals += [f"user_response({a}, yes)" for a in rng.sample(pool, min(len(pool), rng.randint(1, 3)))]
+        if rng.random() < 0.3:
+            goals.append(f"user_response({rng.choice(deep)}, yes)")
+        rules.append(f"diagnosis({disease}) :-\n    " + ",\n    ".join(goals) + ".")
+        weights.append(f"rule_weight({disease}, {len(goals)}).")
+        departments.append(f"department({disease}, '{rng.choice(DEPARTMENTS)}').")
+    lines += weights + [""] + departments + [""] + rules
+    return "\n".join(lines) + "\n"
+
+
+def write_kb(path: str, diseases: int = 500, symptoms: int = 3000, seed: int = 0) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(generate_kb(diseases, symptoms, seed))
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic diagnosis KB")
+    parser.add_argument("--diseases", type=int, default=500)
+    parser.add_argument("--symptoms", type=int, default=3000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="synthetic_kb.pl")
+    args = parser.parse_args()
+    write_kb(args.out, args.diseases, args.symptoms, args.seed)
+    print(f"{args.out}: {args.diseases} diseases, {args.symptoms} symptoms")
@@ -0,0 +1,58 @@
+% Case fact stores for DiagnosisEngine.
+%
+% Every case gets its own module holding its has_symptom/2 and
+% user_response/2 facts. The KB files rewrite their fact lookups into
+% case_fact/1 calls (see the goal_expansion/2 clauses at their top).
+% case_fact/1 looks the fact up in the module named by the case_module
+% global variable, so
+%
+%     b_setval(case_module, Case), normal:diagnosis(D)
+%
+% runs the normal KB's rules against Case's facts only. Cases never see
+% each other's facts, and clearing one case does not touch any other.
+% Without case_module set, facts are looked up in the calling module as
+% before, so the KB files still work when consulted on their own.
+:- module(case_facts, [assert_case_facts/3,
+                       case_fact/1,
+                       new_case_module/1,
+                       clear_case_module/1]).
+
+:- module_transparent case_fact/1.
+
+% case_fact(+Fact)
+%   Fact is a has_symptom/2 or user_response/2 goal of the current case.
+case_fact(Fact) :-
+    (   nb_current(case_module, Case)
+    ->  Case:Fact
+    ;   context_module(Module),
+        Module:Fact
+    ).
+
+% assert_case_facts(+Module, +Symptoms, +Responses)
+%   Symptoms is a list of Symptom-Tier pairs and Responses a list of
+%   Key-Value pairs. They become Module:has_symptom/2 and
+%   Module:user_response/2 facts; facts that already exist are skipped.
+%   The facts arrive as terms built by pyswip, so no Prolog text is parsed.
+assert_case_facts(Module, Symptoms, Responses) :-
+    forall(member(Symptom-Tier, Symptoms),
+           assert_once(Module:has_symptom(Symptom, Tier))),
+    forall(member(Key-Value, Responses),
+           assert_once(Module:user_response(Key, Value))).
+
+assert_once(Fact) :-
+    (   Fact
+    ->  true
+    ;   assertz(Fact)
+    ).
+
+% new_case_module(+Case)
+%   Create Case as an empty fact store.
+new_case_module(Case) :-
+    Case:dynamic(has_symptom/2),
+    Case:dynamic(user_response/2).
+
+% clear_case_module(+Case)
+%   Drop Case's facts so that the module can be reused for another case.
+clear_case_module(Case) :-
+    retractall(Case:has_symptom(_, _)),
+    retractall(Case:user_response(_, _)).
@@ -81,6 +81,11 @@ words_after --> [_], words_after.
 % Dynamic predicates for tracking symptoms and responses
 :- dynamic has_symptom/2.
 :- dynamic user_response/2.
+% Fact lookups go through case_fact/1, so the rules can run against the
+% facts of a per-case module (see case_facts.pl)
+:- use_module(case_facts).
+goal_expansion(has_symptom(S, T), case_fact(has_symptom(S, T))).
+goal_expansion(user_response(K, V), case_fact(user_response(K, V))).
 
 % Symptom categories
 preliminary_symptom(fever).
@@ -1,71 +1,18 @@
 import os
-from pyswip import Prolog
+from pyswip import Atom, Functor, Prolog, Query, Variable
+from kb_compiler import load_snapshot
 
 # ── Prolog init ─────────────────────────────────────────────────────
 prolog = Prolog()
 prolog.consult("dcg_rules.pl")
 
-# ── static config ──────────────────────────────────────────────────
-RULE_LEN = {
-    "common_cold":4,"flu":5,"strep_throat":4,"ear_infection":4,"bronchitis":4,
-    "bronchiolitis":4,"hand_foot_mouth":3,"conjunctivitis":3,"gastroenteritis":4,
-    "chickenpox":4,"measles":5,"mumps":4,"rubella":3,"scarlet_fever":4,
-    "roseola":2,"rsv":5,"croup":4,"kawasaki_disease":4,"whooping_cough":3,
-    "fifth_disease":3
-}
-DEPT = {
-    "common_cold":"General Pediatrics","flu":"General Pediatrics",
-    "strep_throat":"ENT","ear_infection":"ENT","bronchitis":"Pulmonology",
-    "bronchiolitis":"Pulmonology","hand_foot_mouth":"Dermatology",
-    "conjunctivitis":"Ophthalmology","gastroenteritis":"Gastroenterology",
-    "chickenpox":"Dermatology","measles":"Infectious Disease",
-    "mumps":"Infectious Disease","rubella":"Infectious Disease",
-    "scarlet_fever":"Infectious Disease","roseola":"Pediatrics",
-    "rsv":"Pulmonology","croup":"Pulmonology","kawasaki_disease":"Cardiology",
-    "whooping_cough":"Pulmonology","fifth_disease":"Dermatology"
-}
-
-T1 = ["fever","cough","rash","vomiting","diarrhea","runny_nose","fatigue"]
-
-T2 = {
-    "fever":[
-        "Describe the fever (low-grade / high-grade / intermittent):"
-    ],
-    "cough":[
-        "Type of cough (dry / productive / wheezing):"
-    ],
-    "rash":[
-        "Describe the rash (localized / widespread / itchy):"
-    ],
-    "vomiting":[
-        "Frequency of vomiting (occasional / frequent / severe):"
-    ],
-    "diarrhea":[
-        "Severity of diarrhea (mild / moderate / severe):"
-    ],
-    "runny_nose":[
-        "Runny-nose severity (0-5):"
-    ],
-    "fatigue":[
-        "Fatigue severity (0-5):"
-    ]
-}
-
-T3 = {
-    ("fever","rash"):[
-        "Did the rash move from face to trunk? (y/n):",
-        "Is the tongue 'strawberry' red? (y/n):"
-    ],
-    ("cough","fever"):[
-        "Is the child having laboured breathing? (y/n):"
-    ],
-    ("vomiting","diarrhea"):[
-        "Did symptoms start after recent travel? (y/n):"
-    ],
-    ("fatigue","runny_nose"):[
-        "Was there recent contact with someone sick? (y/n):"
-    ]
-}
+# ── static config (compiled from the KB, see kb_compiler.py) ───────
+KB = load_snapshot()
+RULE_LEN = KB.rule_len
+DEPT = KB.dept
+T1 = KB.t1
+T2 = KB.t2
+T3 = KB.t3
 
 # ── helpers ─────────────────────────────────────────────────────────
 responses = {}
@@ -82,14 +29,16 @@ def ask(quest):
     return ans
 
 def dcg_parse(text):
-    safe = text.replace('"','\"')
-    q = f'parse_symptoms("{safe}", S)'
+    # Pass the text as an atom, not as Prolog source
+    S = Variable()
+    q = Query(Functor("parse_symptoms", 2)(Atom(text), S))
     try:
-        r = list(prolog.query(q, maxresult=1))
-        return r[0]["S"] if r else []
+        return [str(s) for s in S.value] if q.nextSolution() else []
     except Exception as e:
         print(f"Warning: Error parsing symptoms: {e}")
         return []
+    finally:
+        q.closeQuery()
 
 # Simplified tier functions for DCG only
 def tier1():
@@ -126,7 +75,7 @@ def tier3():
             triggered = True
             for q in qs:
                 details = input(q+" ")
-                atom = f"{trig[0]}_{trig[1]}_detail"
+                atom = f"{'_'.join(trig)}_detail"
                 prolog.assertz(f"user_response({atom},'{details}')")
     if not triggered: print("No additional questions needed.")
     upd(40)
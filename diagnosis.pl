@@ -1,7 +1,12 @@
-:- [dcg_rules].
 :- dynamic user_response/2.
 :- dynamic has_symptom/2.
 
+% Fact lookups go through case_fact/1, so the rules can run against the
+% facts of a per-case module (see case_facts.pl)
+:- use_module(case_facts).
+goal_expansion(has_symptom(S, T), case_fact(has_symptom(S, T))).
+goal_expansion(user_response(K, V), case_fact(user_response(K, V))).
+
 % Tier 1: Preliminary Symptoms
 preliminary_symptom(fever).
 preliminary_symptom(cough).
@@ -31,6 +36,43 @@ tier3_trigger([cough, fever], [labored_breathing, barking_cough, persistent_coug
 tier3_trigger([vomiting, diarrhea], [travel_food_history, contamination_exposure, stomach_pain]).
 tier3_trigger([fatigue, runny_nose], [prolonged_fatigue, sinus_pressure, seasonal_triggers]).
 
+% Questions asked by the web app and the CLIs (compiled by kb_compiler.py)
+tier2_question(fever, 'Describe the fever (low-grade / high-grade / intermittent):').
+tier2_question(cough, 'Type of cough (dry / productive / wheezing):').
+tier2_question(rash, 'Describe the rash (localized / widespread / itchy):').
+tier2_question(vomiting, 'Frequency of vomiting (occasional / frequent / severe):').
+tier2_question(diarrhea, 'Severity of diarrhea (mild / moderate / severe):').
+tier2_question(runny_nose, 'Runny-nose severity (0-5):').
+tier2_question(fatigue, 'Fatigue severity (0-5):').
+
+tier3_question([fever, rash], 'Did the rash move from face to trunk? (y/n):').
+tier3_question([fever, rash], 'Is the tongue ''strawberry'' red? (y/n):').
+tier3_question([cough, fever], 'Is the child having laboured breathing? (y/n):').
+tier3_question([vomiting, diarrhea], 'Did symptoms start after recent travel? (y/n):').
+tier3_question([fatigue, runny_nose], 'Was there recent contact with someone sick? (y/n):').
+
+% Disease metadata: rule weight (relative likelihood when several rules
+% match; defaults to the number of goals in the rule) and referral department
+rule_weight(measles, 5).
+rule_weight(roseola, 2).
+rule_weight(chickenpox, 4).
+rule_weight(scarlet_fever, 4).
+rule_weight(flu, 5).
+rule_weight(bronchitis, 4).
+rule_weight(rsv, 5).
+rule_weight(food_poisoning, 4).
+rule_weight(sinusitis, 4).
+
+department(measles, 'Infectious Disease').
+department(roseola, 'Pediatrics').
+department(chickenpox, 'Dermatology').
+department(scarlet_fever, 'Infectious Disease').
+department(flu, 'General Pediatrics').
+department(bronchitis, 'Pulmonology').
+department(rsv, 'Pulmonology').
+department(food_poisoning, 'Gastroenterology').
+department(sinusitis, 'ENT').
+
 
 % Diagnosis Rules (Aligned with Tier 1, 2, and 3)
 
@@ -1,103 +1,43 @@
 import os
 from pyswip import Prolog
+from kb_compiler import load_snapshot
+from tiers import TIER3_QUESTION_FACTS
 
 # Set up Prolog engine and load our knowledge bases
 prolog = Prolog()
 prolog.consult("diagnosis.pl")
-prolog.consult("dcg_rules.pl")  # We'll need this for natural language mode
 
 # Clear any lingering facts from previous runs
 prolog.query("retractall(user_response(_, _)).")
 prolog.query("retractall(has_symptom(_, _)).")
 
-# Disease rule complexity - helps us calculate diagnosis confidence
-rule_lengths = {
-    "common_cold": 4, "flu": 5, "strep_throat": 4, "ear_infection": 4,
-    "bronchitis": 4, "bronchiolitis": 4, "hand_foot_mouth": 3,
-    "conjunctivitis": 3, "gastroenteritis": 4, "chickenpox": 4,
-    "measles": 5, "mumps": 4, "rubella": 3, "scarlet_fever": 4,
-    "roseola": 2, "rsv": 5, "croup": 4, "kawasaki_disease": 4,
-    "whooping_cough": 3, "fifth_disease": 3
-}
+# Disease weights, departments and the tier tables come from the KB (see
+# kb_compiler.py); rule weights help us calculate diagnosis confidence
+KB = load_snapshot()
+rule_lengths = KB.rule_len
+department_map = KB.dept
+tier1_symptoms = KB.t1
 
-# Which department should handle each condition
-department_map = {
-    "common_cold": "General Pediatrics", "flu": "General Pediatrics",
-    "strep_throat": "ENT", "ear_infection": "ENT",
-    "bronchitis": "Pulmonology", "bronchiolitis": "Pulmonology",
-    "hand_foot_mouth": "Dermatology", "conjunctivitis": "Ophthalmology",
-    "gastroenteritis": "Gastroenterology", "chickenpox": "Dermatology",
-    "measles": "Infectious Disease", "mumps": "Infectious Disease",
-    "rubella": "Infectious Disease", "scarlet_fever": "Infectious Disease",
-    "roseola": "Pediatrics", "rsv": "Pulmonology", "croup": "Pulmonology",
-    "kawasaki_disease": "Cardiology", "whooping_cough": "Pulmonology",
-    "fifth_disease": "Dermatology"
-}
 
-# Tier 1: Basic symptoms we check first
-tier1_symptoms = [
-    "fever", "cough", "rash", "vomiting", "diarrhea", "runny_nose", "fatigue"
-]
+def _tier3_fact(trigger, index: int) -> str:
+    """Fact a "yes" to a tier-3 question records, as in tiers.tier3"""
+    key = "_".join(trigger)
+    fact = TIER3_QUESTION_FACTS.get((trigger, str(index)))
+    return fact if fact in KB.differentiators.get(key, ()) else f"{key}_{index}"
+
 
-# Tier 2: Follow-up questions for each primary symptom
+# Tier 2: a yes/no question for each adaptive symptom of a primary symptom
 # Format: (symptom_id, "Question to ask")
 tier2_questions = {
-    "fever": [
-        ("high_grade_fever",      "Is the fever high‑grade (>39 °C)? (y/n)"),
-        ("persistent_fever",      "Has the fever lasted more than 3 days? (y/n)"),
-        ("chills",                "Is the child experiencing chills? (y/n)"),
-        ("night_sweats",          "Are there night sweats? (y/n)")
-    ],
-    "cough": [
-        ("dry_cough",             "Is it a dry cough? (y/n)"),
-        ("wheezing",              "Do you hear wheezing? (y/n)"),
-        ("worsens_at_night",      "Does the cough worsen at night? (y/n)"),
-        ("productive_cough",      "Is the cough productive with sputum? (y/n)")
-    ],
-    "rash": [
-        ("itchy_rash",            "Is the rash itchy? (y/n)"),
-        ("rash_localized_or_widespread", "Is the rash widespread (vs local)? (y/n)"),
-        ("peeling_skin",          "Is skin peeling? (y/n)")
-    ],
-    "vomiting": [
-        ("blood_in_vomit",        "Is there blood in the vomit? (y/n)"),
-        ("dehydration_signs",     "Are there signs of dehydration? (y/n)"),
-        ("nausea",                "Is the child nauseous? (y/n)")
-    ],
-    "diarrhea": [
-        ("frequent_loose_stools", "Are stools frequently loose? (y/n)"),
-        ("abdominal_cramps",      "Is the child having abdominal cramps? (y/n)"),
-        ("watery_stool",          "Is the stool watery? (y/n)")
-    ],
-    "runny_nose": [
-        ("nasal_congestion",      "Is there nasal congestion? (y/n)"),
-        ("sneezing",              "Is the child sneezing a lot? (y/n)"),
-        ("post_nasal_drip",       "Is there post‑nasal drip? (y/n)")
-    ],
-    "fatigue": [
-        ("chronic_tiredness",     "Is the tiredness persistent or chronic? (y/n)"),
-        ("low_energy",            "Is the child low on energy? (y/n)"),
-        ("difficulty_concentrating", "Is concentration difficult? (y/n)")
-    ]
+    primary: [(s, f"Does the child have {s.replace('_', ' ')}? (y/n)") for s in symptoms]
+    for primary, symptoms in KB.adaptive.items()
 }
 
-# Tier 3: Specific questions when certain symptoms appear together
+# Tier 3: the KB's questions for symptoms that appear together
 # Helps us differentiate between similar conditions
 tier3_triggers = {
-    ("fever", "rash"): [
-        ("measles_path",        "Did the rash start on the face and spread down? (y/n)"),
-        ("strawberry_tongue",   "Is the tongue red and bumpy like a strawberry? (y/n)")
-    ],
-    ("cough", "fever"): [
-        ("labored_breathing",  "Is the child experiencing labored breathing? (y/n)")
-    ],
-    ("vomiting", "diarrhea"): [
-        ("contamination_exposure", "Could this be food or water contamination? (y/n)"),
-        ("dehydration_signs",      "Are there signs of dehydration? (y/n)")
-    ],
-    ("fatigue", "runny_nose"): [
-        ("sinus_pressure", "Is there sinus pressure? (y/n)")
-    ]
+    trigger: [(_tier3_fact(trigger, i), question) for i, question in enumerate(questions)]
+    for trigger, questions in KB.t3.items()
 }
 
 # Helper functions for getting user input
@@ -146,8 +86,8 @@ def tier2():
 def tier3():
     print("\nTier 3 – deep‑dive questions")
     something_asked = False
-    for trigger_pair, qlist in tier3_triggers.items():
-        if all(list(prolog.query(f"has_symptom({t}, _)")) for t in trigger_pair):
+    for trigger, qlist in tier3_triggers.items():
+        if all(list(prolog.query(f"has_symptom({t}, _)")) for t in trigger):
             something_asked = True
             for atom, prompt in qlist:
                 ans = ask_yes_no(prompt)
@@ -1,139 +1,415 @@
-from pyswip import Prolog
-from typing import List, Dict, Tuple, Optional
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Dict, Tuple, Optional
+from cache import LRUCache
+from kb_compiler import KB_SOURCES, kb_sha256, load_snapshot
+from phrase_matcher import PhraseMatcher, split_into_words
+from rule_compiler import KB_FILES, CompiledRuleSet, DispatchIndex
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyswip import Atom, Functor, Prolog, Query, Variable
+except Exception as e:
+    # pyswip is missing, or cannot find SWI-Prolog. The compiled engine and
+    # parser still work (e.g. for the checks in tests/); anything else fails
+    # when the engine is built.
+    Prolog = None
+    PROLOG_ERROR = e
+
+# Symptom extraction results keyed by (module, parser, normalized words).
+# Shared by every engine in the process and cleared when a KB is reloaded.
+NL_CACHE = LRUCache(maxsize=4096)
+
+# Ranked diagnose_case() results keyed by (KB hash, module, engine, case
+# fingerprint, candidates). The KB hash changes with any edit to the KB
+# files, so a changed KB never serves results computed from the old one.
+RESULT_CACHE = LRUCache(maxsize=8192, ttl=3600)
+
+
+def case_fingerprint(case) -> Tuple[tuple, tuple]:
+    """Canonical form of a case's has_symptom/2 and user_response/2 facts"""
+    return tuple(sorted(set(case.symptoms))), tuple(sorted(set(case.response_facts)))
+
 
 class DiagnosisEngine:
-    def __init__(self, mode: str = "normal"):
-        self.prolog = Prolog()
+    def __init__(self, mode: str = "normal", parser: str = "compiled", engine: str = "prolog",
+                 kb: Optional[str] = None, version: Optional[str] = None):
+        if Prolog is None and (engine != "compiled" or (mode == "dcg" and parser != "compiled")):
+            raise RuntimeError(f"the {engine} engine needs SWI-Prolog: {PROLOG_ERROR}")
+        self.prolog = Prolog() if Prolog is not None else None
         self.mode = mode
-        # Load KB according to mode
-        if mode == "normal":
-            self.prolog.consult("diagnosis.pl")
-        else:  # dcg mode
-            self.prolog.consult("dcg_rules.pl")
+        # kb overrides the mode's KB file (e.g. a synthetic KB for benchmarks)
+        self.kb_path = kb or KB_FILES[mode]
+        # Each KB lives in its own SWI module, so both modes can share one
+        # SWI instance without their diagnosis/1 definitions colliding
+        self.module = mode if kb is None else os.path.splitext(os.path.basename(kb))[0]
+        # Tables for tier-1 filtering and ranking
+        self.snapshot = SNAPSHOT
+        self.version = version
+        if version is not None:
+            # A frozen KB release (see kb_release.py), in modules of its own
+            # so that other releases can stay loaded next to it
+            from kb_release import load_release
+
+            release = load_release(version)
+            self.kb_path = release.files[mode]
+            self.module = f"{mode}_{version}"
+            self.snapshot = release.snapshot
+        # Guards the KB module's own has_symptom/user_response facts (used by
+        # add_symptom/add_response/get_diagnosis) and the case module pool
+        self.lock = threading.RLock()
+        # Emptied case modules ready for reuse (see open_case)
+        self._free_cases: List[str] = []
+        self._case_count = 0
+        # "compiled" matches the symptom//1 phrases in linear time;
+        # "dcg" runs parse_symptoms/2 in Prolog
+        self.parser = parser
+        # "prolog" queries diagnosis/1; "compiled" evaluates the same rules
+        # as bitmask tests in Python (see rule_compiler.py)
+        self.engine = engine
+        # Per-stage [seconds, inferences] since the last timed_call()
+        self.stages: Dict[str, list] = {}
+        self.load_seconds = 0.0
+        self._load_kb()
+        if self.prolog is not None:
+            # Terms for assert_facts() and _parse_symptoms(); functors need
+            # the SWI instance above
+            self._pair = Functor("-", 2)
+            self._assert_case_facts = Functor("assert_case_facts", 3)
+            self._call, self._qualify = Functor("call", 1), Functor(":", 2)
+            self._parse_symptoms_goal = Functor("parse_symptoms", 2)
         self._reset_state()
         # Store user responses for easier access in diagnosis
         self.responses = {}
 
+    def _load_kb(self, reload: bool = False):
+        start = time.perf_counter()
+        path = self.kb_path
+        if self.prolog is not None:
+            self._consult(path, "true" if reload else "not_loaded")
+        self.matcher = PhraseMatcher.from_file(path) if self.mode == "dcg" else None
+        self.rules = CompiledRuleSet.from_file(path) if self.engine == "compiled" else None
+        self.dispatch = self.rules.dispatch if self.rules else DispatchIndex.from_file(path)
+        # The rules come from path, the RULE_LEN/DEPT tables from KB_SOURCES
+        self.kb_sha256 = kb_sha256(tuple(dict.fromkeys(KB_SOURCES + (path,))))
+        self.load_seconds = time.perf_counter() - start
+        # Reported as a "load" stage by the next timed_call()
+        self._unreported_load = self.load_seconds
+        logger.info("knowledge base loaded", extra={
+            "mode": self.mode, "kb": path, "seconds": round(self.load_seconds, 4)})
+
+    def _consult(self, path: str, condition: str):
+        try:
+            # qcompile(auto) loads the .qlf next to the source when it is
+            # up to date and (re)writes it otherwise
+            list(self.prolog.query(
+                f"{self.module}:load_files('{path}', [if({condition}), qcompile(auto)])"))
+        except Exception as e:
+            # e.g. a read-only checkout where the .qlf cannot be written
+            logger.warning("Quick-load compile of %s failed, loading source: %s", path, e)
+            list(self.prolog.query(f"{self.module}:load_files('{path}', [if({condition})])"))
+        list(self.prolog.query("use_module(case_facts)"))
+
+    def close(self):
+        """Unload this engine's KB file, e.g. when its release is retired"""
+        if self.prolog is None:
+            return
+        with self.lock:
+            list(self.prolog.query(f"unload_file('{self.kb_path}')"))
+
+    def reload_kb(self):
+        """Re-consult the knowledge base and drop cached parses"""
+        with self.lock:
+            self._load_kb(reload=True)
+            NL_CACHE.clear()
+            RESULT_CACHE.clear()
+
+    # ── instrumentation ────────────────────────────────────────────
+    def _record(self, stage: str, seconds: float, inferences: int = 0):
+        entry = self.stages.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += inferences
+
+    @contextmanager
+    def _stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(stage, time.perf_counter() - start)
+
+    def _timed_query(self, stage: str, goal: str, maxresult: int = -1) -> List[dict]:
+        """Run goal, recording its inference time and count under stage.
+
+        statistics/2 and get_time/1 are read inside the same query, so the
+        rest of the wall time (building the query, converting the answers
+        back to Python) is recorded separately as "marshal".
+        """
+        start = time.perf_counter()
+        rows = list(self.prolog.query(
+            f"statistics(inferences, I0_), get_time(T0_), {goal}, "
+            f"get_time(T1_), statistics(inferences, I1_)", maxresult=maxresult))
+        elapsed = time.perf_counter() - start
+        solved = 0.0
+        for row in rows:
+            # I1_ - I0_ includes the statistics/2 call itself: one inference
+            solved = float(row.pop("T1_")) - float(row.pop("T0_"))
+            self._record(stage, solved, int(row.pop("I1_")) - int(row.pop("I0_")) - 1)
+        self._record("marshal", max(elapsed - solved, 0.0))
+        return rows
+
+    def timed_call(self, method: str, *args):
+        """Run self.<method>(*args); return (result, stages) for that call only.
+
+        stages maps a stage name (parse, match, assert, reset, inference,
+        marshal, compiled, total) to [seconds, inferences]. The first call
+        after the KB was (re)loaded also reports the load time as "load".
+        """
+        self.stages = {}
+        if self._unreported_load:
+            self._record("load", self._unreported_load)
+            self._unreported_load = 0.0
+        start = time.perf_counter()
+        result = getattr(self, method)(*args)
+        self._record("total", time.perf_counter() - start)
+        return result, self.stages
+
     def _reset_state(self):
         """Reset all Prolog state between diagnoses"""
-        self.prolog.query("retractall(user_response(_, _)).")
-        self.prolog.query("retractall(has_symptom(_, _)).")
         self.responses = {}
+        if self.prolog is None:
+            return
+        # query() is lazy, so the retracts only run once consumed
+        with self._stage("reset"):
+            list(self.prolog.query(f"retractall({self.module}:user_response(_, _))."))
+            list(self.prolog.query(f"retractall({self.module}:has_symptom(_, _))."))
 
     def process_natural_language(self, text: str) -> List[str]:
+        """Extract symptom atoms from text, served from NL_CACHE when seen before"""
         if self.mode == "dcg":
+            words = tuple(split_into_words(text))
+        else:
+            words = tuple(text.replace(",", " ").split())
+        key = (self.module, self.parser, words)
+        cached = NL_CACHE.get(key)
+        if cached is None:
+            cached = tuple(self._extract_symptoms(text))
+            NL_CACHE.put(key, cached)
+        return list(cached)
+
+    def parse_many(self, texts: List[str]) -> List[List[str]]:
+        """process_natural_language() for several texts in one call"""
+        return [self.process_natural_language(text) for text in texts]
+
+    def _extract_symptoms(self, text: str) -> List[str]:
+        if self.mode == "dcg" and self.parser == "compiled":
+            with self._stage("match"):
+                return self.matcher.match(text)
+        elif self.mode == "dcg":
             # Use DCG parsing for DCG mode
-            safe_text = text.replace('"', '\\"')
-            query = f'parse_symptoms("{safe_text}", S)'
             try:
-                result = list(self.prolog.query(query, maxresult=1))
-                return result[0]["S"] if result else []
+                with self._stage("parse"):
+                    return self._parse_symptoms(text)
             except Exception as e:
-                print(f"DCG parsing error: {e}")
+                logger.warning("DCG parsing error: %s", e)
                 return []
         else:
             # For normal mode, simply split on comma or space as a simple heuristic.
             words = [w.strip() for w in text.replace(",", " ").split() if w.strip()]
             # Only return those that are in T1 (your predefined Tier‑1 symptoms)
-            return [w for w in words if w in T1]
+            return [w for w in words if w in self.snapshot.t1]
+
+    def _parse_symptoms(self, text: str) -> List[str]:
+        """First answer of parse_symptoms/2 in the KB module.
+
+        The text goes in as an atom argument of a constructed goal, like the
+        facts of assert_facts(), so it is never read as Prolog source.
+        """
+        symptoms = Variable()
+        goal = self._call(self._qualify(
+            Atom(self.module), self._parse_symptoms_goal(Atom(text), symptoms)))
+        query = Query(goal)
+        try:
+            if not query.nextSolution():
+                return []
+            return [str(s) for s in symptoms.value]
+        finally:
+            query.closeQuery()
+
+    # ── per-case fact stores ──────────────────────────────────────
+    def open_case(self) -> str:
+        """Return the name of an empty case module.
+
+        Facts asserted into it (assert_facts(..., module=name)) are seen
+        only by get_diagnosis(module=name). Opening and closing a case costs
+        the same however many other cases are open.
+        """
+        with self.lock, self._stage("case"):
+            if self._free_cases:
+                return self._free_cases.pop()
+            self._case_count += 1
+            name = f"{self.module}_case_{self._case_count}"
+            list(self.prolog.query(f"new_case_module({name})"))
+            return name
+
+    def close_case(self, case_module: str):
+        """Retract the case's facts and keep its module for reuse"""
+        with self.lock, self._stage("case"):
+            list(self.prolog.query(f"clear_case_module({case_module})"))
+            self._free_cases.append(case_module)
+
+    @contextmanager
+    def case_context(self):
+        case_module = self.open_case()
+        try:
+            yield case_module
+        finally:
+            self.close_case(case_module)
+
+    def assert_facts(self, symptoms: Iterable[Tuple[str, int]] = (),
+                     responses: Iterable[Tuple[str, str]] = (), module: Optional[str] = None):
+        """Assert has_symptom/2 and user_response/2 facts in one call.
+
+        The facts go to module (a case module from open_case(), by default
+        the KB module). They are handed to assert_case_facts/3
+        (case_facts.pl) as terms, so user text is never parsed as Prolog
+        source, and facts that are already asserted are skipped.
+        """
+        symptoms = list(dict.fromkeys(symptoms))
+        responses = list(dict.fromkeys(responses))
+        if not symptoms and not responses:
+            return
+        pair = self._pair
+        goal = self._assert_case_facts(
+            Atom(module or self.module),
+            [pair(Atom(s), int(tier)) for s, tier in symptoms],
+            [pair(Atom(k), Atom(v)) for k, v in responses])
+        with self._stage("assert"):
+            query = Query(goal)
+            try:
+                query.nextSolution()
+            finally:
+                query.closeQuery()
+        if module is None:
+            # Also store in our Python dictionary for easier access
+            self.responses.update(responses)
 
     def add_symptom(self, symptom: str, tier: int = 1):
         """Add a symptom with its tier to the Prolog KB"""
         try:
-            self.prolog.assertz(f"has_symptom({symptom},{tier})")
+            self.assert_facts(symptoms=[(symptom, tier)])
         except Exception as e:
-            print(f"Error adding symptom {symptom}: {e}")
+            logger.warning("Error adding symptom %s: %s", symptom, e)
 
     def add_response(self, key: str, value: str):
         """Add a user response to the Prolog KB"""
         try:
-            safe_value = value.replace("'", "''")  # Escape single quotes for Prolog
-            self.prolog.assertz(f"user_response({key},'{safe_value}')")
-            # Also store in our Python dictionary for easier access
-            self.responses[key] = value
+            self.assert_facts(responses=[(key, value)])
         except Exception as e:
-            print(f"Error adding response {key}: {e}")
+            logger.warning("Error adding response %s: %s", key, e)
 
-    def get_diagnosis(self) -> Tuple[List[str], str, Dict[str, str]]:
-        """Get diagnosis results based on symptoms and responses"""
-        try:
-            diagnoses = [d["Disease"] for d in self.prolog.query("diagnosis(Disease).")]
-            # Filter and calculate based on RULE_LEN
-            diagnoses = [d for d in diagnoses if d in RULE_LEN]
-            
-            if not diagnoses:
+    def diagnose_case(self, case, candidates: Optional[List[str]] = None) -> Tuple[List[str], str, Dict[str, str]]:
+        """Evaluate a session case in its own case module.
+
+        candidates, when given, restricts the rules tried to those diseases
+        (see differential.py); an empty list skips inference altogether.
+        Otherwise the dispatch index picks the rules the case's symptoms can
+        satisfy (for the compiled engine, only when the KB is large enough
+        for that to pay off; see CompiledRuleSet.evaluate_case). Results
+        are cached in RESULT_CACHE by the case's facts and the candidates,
+        so a restricted result is never served to a call with other
+        candidates or none.
+        """
+        key = (self.kb_sha256, self.module, self.engine, case_fingerprint(case),
+               None if candidates is None else tuple(candidates))
+        cached = RESULT_CACHE.get(key)
+        if cached is None:
+            try:
+                cached = self._rank(self.match_case(case, candidates))
+            except Exception as e:
+                logger.exception("Diagnosis error: %s", e)
                 return [], None, {}
-                
-            total = sum(RULE_LEN.get(d, 1) for d in diagnoses)
-            
-            # Create a list of disease names (formatted for display)
-            results = [d.replace('_', ' ').title() for d in diagnoses]
-            
-            # Find the most likely disease
-            best = max(diagnoses, key=lambda d: RULE_LEN.get(d, 0))
-            department = DEPT.get(best, "General Pediatrics")
-            
-            # Create probability dictionary
-            probabilities = {}
-            for d in diagnoses:
-                probability = round(RULE_LEN.get(d, 1) * 100 / total, 1)
-                probabilities[d.replace('_', ' ').title()] = f"{probability}%"
-                
-            return results, department, probabilities
-            
+            RESULT_CACHE.put(key, cached)
+        results, department, probabilities = cached
+        # Copies, so that a caller editing its result cannot alter the cache
+        return list(results), department, dict(probabilities)
+
+    def match_case(self, case, candidates: Optional[List[str]] = None) -> List[str]:
+        """Diseases whose rule holds for a session case, in rule order, unranked"""
+        # evaluate_case() consults the dispatch index itself
+        if candidates is None and self.rules is None:
+            candidates = self.dispatch.candidates(s for s, _ in case.symptoms)
+        if candidates is not None and not candidates:
+            return []
+        if self.rules is not None:
+            with self._stage("compiled"):
+                return self.rules.evaluate_case(case, candidates)
+        with self.case_context() as case_module:
+            self.assert_facts(case.symptoms, case.response_facts, case_module)
+            return self.infer(candidates, case_module)
+
+    def get_diagnosis(self, candidates: Optional[List[str]] = None,
+                      module: Optional[str] = None) -> Tuple[List[str], str, Dict[str, str]]:
+        """Get diagnosis results based on the symptoms and responses in module"""
+        try:
+            return self._rank(self.infer(candidates, module))
         except Exception as e:
-            print(f"Diagnosis error: {e}")
+            logger.exception("Diagnosis error: %s", e)
             return [], None, {}
 
-# Predefined mode‐independent constants
-T1 = ["fever", "cough", "rash", "vomiting", "diarrhea", "runny_nose", "fatigue"]
-
-T2 = {
-    "fever": ["Describe the fever (low-grade / high-grade / intermittent):"],
-    "cough": ["Type of cough (dry / productive / wheezing):"],
-    "rash": ["Describe the rash (localized / widespread / itchy):"],
-    "vomiting": ["Frequency of vomiting (occasional / frequent / severe):"],
-    "diarrhea": ["Severity of diarrhea (mild / moderate / severe):"],
-    "runny_nose": ["Runny-nose severity (0-5):"],
-    "fatigue": ["Fatigue severity (0-5):"]
-}
-
-T3 = {
-    ("fever", "rash"): [
-        "Did the rash move from face to trunk? (y/n):",
-        "Is the tongue 'strawberry' red? (y/n):"
-    ],
-    ("cough", "fever"): [
-        "Is the child having laboured breathing? (y/n):"
-    ],
-    ("vomiting", "diarrhea"): [
-        "Did symptoms start after recent travel? (y/n):"
-    ],
-    ("fatigue", "runny_nose"): [
-        "Was there recent contact with someone sick? (y/n):"
-    ]
-}
-
-RULE_LEN = {
-    "common_cold": 4, "flu": 5, "strep_throat": 4, "ear_infection": 4,
-    "bronchitis": 4, "bronchiolitis": 4, "hand_foot_mouth": 3,
-    "conjunctivitis": 3, "gastroenteritis": 4, "chickenpox": 4,
-    "measles": 5, "mumps": 4, "rubella": 3, "scarlet_fever": 4,
-    "roseola": 2, "rsv": 5, "croup": 4, "kawasaki_disease": 4,
-    "whooping_cough": 3, "fifth_disease": 3, "food_poisoning": 4,
-    "sinusitis": 4  # Added missing diseases from diagnosis.pl
-}
-
-DEPT = {
-    "common_cold": "General Pediatrics", "flu": "General Pediatrics",
-    "strep_throat": "ENT", "ear_infection": "ENT",
-    "bronchitis": "Pulmonology", "bronchiolitis": "Pulmonology",
-    "hand_foot_mouth": "Dermatology", "conjunctivitis": "Ophthalmology",
-    "gastroenteritis": "Gastroenterology", "chickenpox": "Dermatology",
-    "measles": "Infectious Disease", "mumps": "Infectious Disease",
-    "rubella": "Infectious Disease", "scarlet_fever": "Infectious Disease",
-    "roseola": "Pediatrics", "rsv": "Pulmonology", "croup": "Pulmonology",
-    "kawasaki_disease": "Cardiology", "whooping_cough": "Pulmonology",
-    "fifth_disease": "Dermatology", "food_poisoning": "Gastroenterology",
-    "sinusitis": "ENT"  # Added missing departments
-}
\ No newline at end of file
+    def infer(self, candidates: Optional[List[str]] = None, module: Optional[str] = None) -> List[str]:
+        """Diseases whose diagnosis/1 rule holds for the facts in module"""
+        goal = f"{self.module}:diagnosis(D)"
+        if candidates is not None:
+            # A bound first argument lets SWI index straight to those clauses
+            goal = f"member(D, [{', '.join(candidates)}]), {goal}"
+        # case_fact/1 reads the facts from the module named by case_module
+        case = f"b_setval(case_module, {module or self.module})"
+        rows = self._timed_query("inference", f"{case}, findall(D, ({goal}), Diseases)", maxresult=1)
+        return [str(d) for d in rows[0]["Diseases"]] if rows else []
+
+    def _rank(self, diagnoses: List[str]) -> Tuple[List[str], str, Dict[str, str]]:
+        return rank_diagnoses(diagnoses, self.snapshot)
+
+
+def rank_diagnoses(diagnoses: List[str], kb=None) -> Tuple[List[str], str, Dict[str, str]]:
+    """Weight matched diseases by RULE_LEN and pick a department.
+
+    kb is the KBSnapshot to take RULE_LEN and DEPT from (default: SNAPSHOT).
+    """
+    kb = kb if kb is not None else SNAPSHOT
+    # Filter and calculate based on RULE_LEN
+    diagnoses = [d for d in diagnoses if d in kb.rule_len]
+
+    if not diagnoses:
+        return [], None, {}
+
+    total = sum(kb.rule_len.get(d, 1) for d in diagnoses)
+
+    # Create a list of disease names (formatted for display)
+    results = [d.replace('_', ' ').title() for d in diagnoses]
+
+    # Find the most likely disease
+    best = max(diagnoses, key=lambda d: kb.rule_len.get(d, 0))
+    department = kb.dept.get(best, "General Pediatrics")
+
+    # Create probability dictionary
+    probabilities = {}
+    for d in diagnoses:
+        probability = round(kb.rule_len.get(d, 1) * 100 / total, 1)
+        probabilities[d.replace('_', ' ').title()] = f"{probability}%"
+
+    return results, department, probabilities
+
+
+# Mode-independent lookup tables, compiled from the KB (see kb_compiler.py)
+SNAPSHOT = load_snapshot()
+T1 = SNAPSHOT.t1
+T2 = SNAPSHOT.t2
+T3 = SNAPSHOT.t3
+RULE_LEN = SNAPSHOT.rule_len
+DEPT = SNAPSHOT.dept
@@ -0,0 +1,74 @@
+"""Live differential diagnosis for a case that is still being filled in.
+
+A Differential follows one sessions.Case. Each update() folds only the facts
+added since the previous call into a bitmask over the compiled rules (see
+rule_compiler.py). Once tier 2 is complete, rules that need an absent
+symptom are dropped: has_symptom/2 facts only arrive in tiers 1 and 2.
+Nothing is dropped after tier 1 alone, since tier 2 adds every symptom
+parsed from the detail text, tier-1 symptoms such as "fever" included.
+
+ranked() scores the surviving rules by the share of their conditions
+already met. The final diagnosis then only asks the engine about
+candidates().
+"""
+from typing import Dict, List
+
+from rule_compiler import CompiledRule, CompiledRuleSet, _popcount
+
+
+def _progress(rule: CompiledRule, mask: int) -> float:
+    """Share of the rule's conditions that mask already satisfies"""
+    met = _popcount(mask & rule.required)
+    total = _popcount(rule.required) + len(rule.alternatives) + len(rule.thresholds)
+    met += sum(1 for alt in rule.alternatives if mask & alt)
+    met += sum(min(_popcount(mask & group) / minimum, 1.0) if minimum else 1.0
+               for group, minimum in rule.thresholds)
+    return met / total if total else 1.0
+
+
+class Differential:
+    """Candidate rules for one case, updated as its facts arrive"""
+
+    def __init__(self, rules: CompiledRuleSet):
+        self.rules = rules
+        self.mask = 0
+        self.alive: List[int] = list(range(len(rules.rules)))
+        self._seen_symptoms = (0, 0)
+        self._seen_responses = 0
+        # Mask of the has_symptom bits each rule requires
+        symptom_bits = 0
+        for fact, bit in rules.bits.items():
+            if fact[0] == "has_symptom":
+                symptom_bits |= bit
+        self._symptom_bits = symptom_bits
+
+    def update(self, case):
+        """Fold in the case facts added since the last update"""
+        bits = self.rules.bits
+        for symptom in case.symptoms_since(self._seen_symptoms):
+            self.mask |= bits.get(("has_symptom", symptom), 0)
+        for key, value in case.response_facts[self._seen_responses:]:
+            self.mask |= bits.get(("user_response", key, value), 0)
+        self._seen_symptoms = case.symptom_mark()
+        self._seen_responses = case.response_count()
+
+    def close_tier(self, tier: int):
+        """Drop rules that the facts still to come cannot satisfy"""
+        rules = self.rules.rules
+        if tier >= 2:
+            self.alive = [i for i in self.alive
+                          if rules[i].required & self._symptom_bits & ~self.mask == 0]
+
+    def candidates(self) -> List[str]:
+        """Diseases that may still be diagnosed, in rule order"""
+        return list(dict.fromkeys(self.rules.rules[i].disease for i in self.alive))
+
+    def ranked(self, weights: Dict[str, int] = None, limit: int = 5) -> Dict[str, float]:
+        """Provisional {disease: share of conditions met}, best first"""
+        weights = weights or {}
+        scores: Dict[str, float] = {}
+        for i in self.alive:
+            rule = self.rules.rules[i]
+            scores[rule.disease] = max(scores.get(rule.disease, 0.0), _progress(rule, self.mask))
+        order = sorted(scores, key=lambda d: (-scores[d], -weights.get(d, 0)))
+        return {d: round(scores[d], 2) for d in order[:limit]}
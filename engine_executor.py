@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from diagnosis_engine import DiagnosisEngine
+
+
+EngineKey = Tuple[str, Optional[str]]  # (mode, KB release version or None)
+
+
+def get_engine(engines: Dict[EngineKey, DiagnosisEngine], mode: str, version: Optional[str],
+               engine_options: dict) -> DiagnosisEngine:
+    if (mode, version) not in engines:
+        engines[mode, version] = DiagnosisEngine(mode=mode, version=version, **engine_options)
+    return engines[mode, version]
+
+
+def retire_engines(engines: Dict[EngineKey, DiagnosisEngine], keep: Iterable[str]):
+    """Close the engines of every KB release that is not in keep"""
+    keep = set(keep)
+    for key in [k for k in engines if k[1] is not None and k[1] not in keep]:
+        engines.pop(key).close()
+
+
+class EngineExecutor:
+    """Runs every Prolog call on one dedicated thread.
+
+    pyswip binds the SWI-Prolog engine to the thread that uses it, so the
+    engines are built lazily on the executor thread and all calls are funnelled
+    through it. Callers await the result, which keeps the event loop free for
+    cheap endpoints while inference runs.
+    """
+
+    def __init__(self, **engine_options):
+        self._engine_options = engine_options
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prolog")
+        self._engines: Dict[EngineKey, DiagnosisEngine] = {}
+
+    def _invoke(self, mode: str, version: Optional[str], method: str, args):
+        # Only ever called on the executor thread
+        engine = get_engine(self._engines, mode, version, self._engine_options)
+        return getattr(engine, method)(*args)
+
+    async def call(self, mode: str, method: str, *args, version: Optional[str] = None):
+        """Run DiagnosisEngine.<method>(*args) for mode (and KB release) on the engine thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._invoke, mode, version, method, args)
+
+    async def retire(self, keep: Iterable[str]):
+        """Unload every KB release not in keep"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._pool, retire_engines, self._engines, list(keep))
+
+    def for_session(self, session_id: str) -> "EngineExecutor":
+        # A single engine thread serves every session
+        return self
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
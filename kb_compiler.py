@@ -0,0 +1,201 @@
+"""Compile the Prolog KB's lookup tables into one versioned snapshot.
+
+T1 comes from preliminary_symptom/1, T2 from tier2_question/2, T3 from
+tier3_trigger/2 and tier3_question/2 (symptom combinations of any size),
+RULE_LEN from rule_weight/2 (or the number of goals in a
+disease's rule), and DEPT from department/2. The adaptive lists come from
+adaptive_symptom(s)/2 and the differentiating facts from tier3_trigger/2.
+The result is written as JSON together with a SHA-256 of the KB sources.
+load_snapshot() rebuilds it whenever the sources change, so the app and the
+CLIs never read stale tables.
+
+    python kb_compiler.py            # write kb_snapshot.json
+    python kb_compiler.py --check    # exit 1 if a disease has no department
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from prolog_reader import conjuncts, read_file
+from rule_compiler import KB_FILES, clauses_by_predicate, entry_clauses
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+SNAPSHOT_PATH = "kb_snapshot.json"
+KB_SOURCES: Tuple[str, ...] = tuple(dict.fromkeys(KB_FILES.values()))
+
+
+def sha256_of(contents: Iterable[bytes]) -> str:
+    """KB hash of the given file contents, in order"""
+    digest = hashlib.sha256()
+    for content in contents:
+        digest.update(hashlib.sha256(content).digest())
+    return digest.hexdigest()
+
+
+def kb_sha256(paths: Sequence[str] = KB_SOURCES) -> str:
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return sha256_of(contents)
+
+
+def _facts(preds, name: str, arity: int) -> List[tuple]:
+    return [head.args for head, body in preds.get((name, arity), []) if body == "true"]
+
+
+def compile_kb(kb_files: Mapping[str, str] = KB_FILES) -> dict:
+    """Derive the snapshot (as plain JSON data) from the KB files"""
+    sources = tuple(dict.fromkeys(kb_files.values()))
+    preds_by_file = {path: clauses_by_predicate(read_file(path)) for path in sources}
+    merged: Dict[Tuple[str, int], list] = {}
+    for preds in preds_by_file.values():
+        for key, clauses in preds.items():
+            merged.setdefault(key, []).extend(clauses)
+
+    # Both KB files may state the same fact; keep the first occurrence
+    t1 = list(dict.fromkeys(s for (s,) in _facts(merged, "preliminary_symptom", 1)))
+    t2: Dict[str, List[str]] = {}
+    for symptom, question in dict.fromkeys(_facts(merged, "tier2_question", 2)):
+        t2.setdefault(symptom, []).append(question)
+    t3: Dict[Tuple[str, ...], List[str]] = {}
+    for trigger, _ in _facts(merged, "tier3_trigger", 2):
+        t3.setdefault(tuple(trigger), [])
+    for trigger, question in dict.fromkeys((tuple(t), q) for t, q in _facts(merged, "tier3_question", 2)):
+        t3.setdefault(trigger, []).append(question)
+    adaptive: Dict[str, List[str]] = {}
+    for name in ("adaptive_symptom", "adaptive_symptoms"):
+        for primary, symptoms in _facts(merged, name, 2):
+            group = adaptive.setdefault(primary, [])
+            group.extend(s for s in symptoms if s not in group)
+    differentiators = {"_".join(trigger): list(facts) for trigger, facts in _facts(merged, "tier3_trigger", 2)}
+
+    weights = dict(_facts(merged, "rule_weight", 2))
+    departments = dict(_facts(merged, "department", 2))
+    rules: Dict[str, List[str]] = {}
+    rule_len: Dict[str, int] = {}
+    for mode, path in kb_files.items():
+        for head, body in entry_clauses(preds_by_file[path]):
+            disease = head.args[0]
+            if not isinstance(disease, str):
+                continue
+            rules.setdefault(mode, [])
+            if disease not in rules[mode]:
+                rules[mode].append(disease)
+            rule_len.setdefault(disease, weights.get(disease, len(conjuncts(body))))
+    dept = {d: departments[d] for d in rule_len if d in departments}
+
+    # Interned IDs: tier-1 symptoms first, then adaptive ones, then the rest
+    symptoms = list(dict.fromkeys(
+        t1 + [s for group in adaptive.values() for s in group]
+        + [s for trigger in t3 for s in trigger]))
+    diseases = list(rule_len)
+    # Inverted index: symptom -> positions of the triggers that contain it
+    t3_by_symptom: Dict[str, List[int]] = {}
+    for index, trigger in enumerate(t3):
+        for s in dict.fromkeys(trigger):
+            t3_by_symptom.setdefault(s, []).append(index)
+
+    return {
+        "format": FORMAT_VERSION,
+        "kb_sha256": kb_sha256(sources),
+        "sources": list(sources),
+        "symptoms": symptoms,
+        "diseases": diseases,
+        "t1": t1,
+        "t2": t2,
+        "t3": [[list(trigger), questions] for trigger, questions in t3.items()],
+        "adaptive": adaptive,
+        "differentiators": differentiators,
+        "rule_len": rule_len,
+        "dept": dept,
+        "rules": rules,
+        "indexes": {
+            "t3_by_symptom": t3_by_symptom,
+            "adaptive_parent": {s: p for p, group in adaptive.items() for s in group},
+        },
+    }
+
+
+def check(data: dict) -> List[str]:
+    """Problems that make the snapshot incomplete"""
+    problems = [f"{d}: no department/2 fact" for d in data["diseases"] if d not in data["dept"]]
+    problems += [f"{s}: tier-1 symptom without tier2_question/2" for s in data["t1"] if s not in data["t2"]]
+    return problems
+
+
+class KBSnapshot:
+    """Read-only tables from kb_snapshot.json"""
+
+    def __init__(self, data: dict):
+        self.version: str = data["kb_sha256"][:12]
+        self.kb_sha256: str = data["kb_sha256"]
+        self.symptoms: Tuple[str, ...] = tuple(data["symptoms"])
+        self.diseases: Tuple[str, ...] = tuple(data["diseases"])
+        self.symptom_ids = MappingProxyType({s: i for i, s in enumerate(self.symptoms)})
+        self.disease_ids = MappingProxyType({d: i for i, d in enumerate(self.diseases)})
+        self.t1: Tuple[str, ...] = tuple(data["t1"])
+        self.t2 = MappingProxyType({s: tuple(qs) for s, qs in data["t2"].items()})
+        self.t3 = MappingProxyType({tuple(trigger): tuple(qs) for trigger, qs in data["t3"]})
+        # Triggers by position, and by their "_"-joined key (as in "fever_rash_0")
+        self.t3_triggers: Tuple[Tuple[str, ...], ...] = tuple(self.t3)
+        self.t3_by_key = MappingProxyType({"_".join(t): t for t in self.t3_triggers})
+        self.t3_sizes: Tuple[int, ...] = tuple(len(set(t)) for t in self.t3_triggers)
+        self.adaptive = MappingProxyType({p: tuple(ss) for p, ss in data["adaptive"].items()})
+        self.differentiators = MappingProxyType({k: tuple(v) for k, v in data["differentiators"].items()})
+        self.rule_len = MappingProxyType(dict(data["rule_len"]))
+        self.dept = MappingProxyType(dict(data["dept"]))
+        self.rules = MappingProxyType({m: tuple(ds) for m, ds in data["rules"].items()})
+        self.t3_by_symptom = MappingProxyType(
+            {s: tuple(idx) for s, idx in data["indexes"]["t3_by_symptom"].items()})
+        self.adaptive_parent = MappingProxyType(dict(data["indexes"]["adaptive_parent"]))
+
+
+def write_snapshot(path: str = SNAPSHOT_PATH, kb_files: Mapping[str, str] = KB_FILES) -> dict:
+    data = compile_kb(kb_files)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+    return data
+
+
+def load_snapshot(path: str = SNAPSHOT_PATH, kb_files: Mapping[str, str] = KB_FILES) -> KBSnapshot:
+    """Load the snapshot, recompiling it first if it is missing or stale"""
+    data: Optional[dict] = None
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+    current = kb_sha256(tuple(dict.fromkeys(kb_files.values())))
+    if not data or data.get("format") != FORMAT_VERSION or data.get("kb_sha256") != current:
+        try:
+            data = write_snapshot(path, kb_files)
+        except OSError as e:
+            logger.warning("Could not write %s, using an in-memory snapshot: %s", path, e)
+            data = compile_kb(kb_files)
+        for problem in check(data):
+            logger.warning("KB snapshot: %s", problem)
+    return KBSnapshot(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the KB tables into a snapshot")
+    parser.add_argument("--out", default=SNAPSHOT_PATH)
+    parser.add_argument("--check", action="store_true", help="exit 1 if the KB tables are incomplete")
+    args = parser.parse_args()
+
+    data = write_snapshot(args.out)
+    problems = check(data)
+    for problem in problems:
+        print(f"WARNING {problem}")
+    print(f"{args.out}: KB {data['kb_sha256'][:12]}, {len(data['symptoms'])} symptoms, "
+          f"{len(data['diseases'])} diseases")
+    raise SystemExit(1 if args.check and problems else 0)
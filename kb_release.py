@@ -0,0 +1,185 @@
+"""Frozen, versioned copies of the KB, so it can be reloaded without a restart.
+
+A KBRelease is the KB as it was at one moment. Each source file is copied to
+``.<stem>.<version>.pl`` next to the original, so that its
+``use_module(case_facts)`` still resolves. The version is the first 12 hex
+digits of the sources' SHA-256 (see kb_compiler.kb_sha256). Engines load a
+release into modules of its own (``normal_<version>``, ``dcg_<version>``),
+so several releases can be loaded side by side. Each case keeps the release
+it started on while new cases start on the current one.
+
+A new release is only promoted after it has replayed the smoke corpus
+(smoke_corpus.jsonl), one case per line in the /v1 diagnose input shape plus
+the mode. Every case must run without an error; a case with "must_include"
+is a curated invariant, and each disease listed there must be among its
+diagnoses. Other diagnoses may change with the rules, so an intended rule
+change is accepted. To regenerate the cases that are only run (the
+invariants are kept):
+
+    python kb_release.py --write-corpus [--cases 25]
+"""
+import argparse
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional
+
+from kb_compiler import KBSnapshot, compile_kb, sha256_of
+from rule_compiler import KB_FILES, CompiledRuleSet, RuleCompileError
+from sessions import SYMBOLS, kb_words
+
+logger = logging.getLogger(__name__)
+
+SMOKE_CORPUS = "smoke_corpus.jsonl"
+
+
+def frozen_path(path: str, version: str) -> str:
+    directory, name = os.path.split(path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{stem}.{version}{ext}")
+
+
+class KBRelease:
+    """One frozen version of the KB files and the tables compiled from them"""
+
+    def __init__(self, version: str, files: Mapping[str, str]):
+        self.version = version
+        # mode -> frozen KB file
+        self.files = dict(files)
+        self.snapshot = KBSnapshot(compile_kb(self.files))
+        # Symptoms and answers the release adds are shared by cases too
+        SYMBOLS.add(self.snapshot.symptoms)
+        SYMBOLS.add_words(kb_words(self.snapshot))
+        self._rules: Dict[str, Optional[CompiledRuleSet]] = {}
+
+    def compiled_rules(self, mode: str) -> Optional[CompiledRuleSet]:
+        """The mode's compiled rules, or None if they cannot be compiled"""
+        if mode not in self._rules:
+            try:
+                self._rules[mode] = CompiledRuleSet.from_file(self.files[mode])
+            except (RuleCompileError, OSError) as e:
+                logger.warning("no live differential for %s mode: %s", mode, e)
+                self._rules[mode] = None
+        return self._rules[mode]
+
+
+def freeze(kb_files: Mapping[str, str] = KB_FILES) -> KBRelease:
+    """Copy the KB files as they are now and compile them into a release"""
+    sources = tuple(dict.fromkeys(kb_files.values()))
+    contents = {}
+    for path in sources:
+        with open(path, "rb") as f:
+            contents[path] = f.read()
+    version = sha256_of(contents[path] for path in sources)[:12]
+    for path, content in contents.items():
+        target = frozen_path(path, version)
+        if not os.path.exists(target):
+            tmp = f"{target}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(content)
+            os.replace(tmp, target)
+    return KBRelease(version, {mode: frozen_path(path, version) for mode, path in kb_files.items()})
+
+
+def load_release(version: str, kb_files: Mapping[str, str] = KB_FILES) -> KBRelease:
+    """A release frozen earlier, e.g. by the app process, from its copies"""
+    return KBRelease(version, {mode: frozen_path(path, version) for mode, path in kb_files.items()})
+
+
+def remove_release(version: str, kb_files: Mapping[str, str] = KB_FILES):
+    """Delete a release's frozen copies and their .qlf files"""
+    for path in dict.fromkeys(kb_files.values()):
+        target = frozen_path(path, version)
+        for name in (target, os.path.splitext(target)[0] + ".qlf"):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+class ReleaseRegistry:
+    """The releases the app has loaded and the one new cases start on.
+
+    current is replaced by a single attribute assignment, so a request sees
+    either the old or the new release, never a mix of the two. A request
+    holds the release it runs on (hold()) until it is done, and retire()
+    never drops a held release. Like the rest of the registry, holds are
+    only taken and released on the event loop.
+    """
+
+    def __init__(self):
+        self.current: Optional[KBRelease] = None
+        self._releases: Dict[str, KBRelease] = {}
+        # version -> requests in flight on it
+        self._holds: Dict[str, int] = {}
+
+    @contextmanager
+    def hold(self, release: KBRelease) -> Iterator[KBRelease]:
+        """Keep release from being retired while the block runs"""
+        version = release.version
+        self._holds[version] = self._holds.get(version, 0) + 1
+        try:
+            yield release
+        finally:
+            self._holds[version] -= 1
+            if not self._holds[version]:
+                del self._holds[version]
+
+    def get(self, version: Optional[str]) -> Optional[KBRelease]:
+        return self._releases.get(version) if version else None
+
+    def add(self, release: KBRelease):
+        self._releases[release.version] = release
+
+    def promote(self, version: str):
+        self.current = self._releases[version]
+
+    def discard(self, version: str):
+        if self.current is None or version != self.current.version:
+            self._releases.pop(version, None)
+
+    def versions(self) -> List[str]:
+        return list(self._releases)
+
+    def retire(self, in_use: Iterable[str]) -> List[str]:
+        """Drop every release except the current one, the held ones and those in in_use"""
+        keep = set(in_use) | set(self._holds)
+        if self.current is not None:
+            keep.add(self.current.version)
+        dropped = [v for v in self._releases if v not in keep]
+        for version in dropped:
+            del self._releases[version]
+        return dropped
+
+
+def load_corpus(path: str = SMOKE_CORPUS) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_corpus(path: str = SMOKE_CORPUS, cases: int = 25, seed: int = 0) -> int:
+    """Replace the generated cases of the corpus, keeping its invariants"""
+    from benchmarks.cases import CaseGenerator
+
+    records = [record for record in load_corpus(path) if record.get("must_include")]
+    for mode in ("normal", "dcg"):
+        records.extend(dict(record, mode=mode) for record in CaseGenerator(seed).cases(cases, mode))
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the hot-reload smoke corpus")
+    parser.add_argument("--write-corpus", action="store_true",
+                        help="regenerate the cases that are only run; invariants are kept")
+    parser.add_argument("--cases", type=int, default=25, help="cases per mode")
+    parser.add_argument("--out", default=SMOKE_CORPUS)
+    args = parser.parse_args()
+    if not args.write_corpus:
+        parser.error("nothing to do; pass --write-corpus")
+    print(f"{args.out}: {write_corpus(args.out, args.cases)} cases")
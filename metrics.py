@@ -0,0 +1,103 @@
+"""In-process metrics rendered in the Prometheus text exposition format"""
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (per-bucket counts incl. +Inf, sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                le_label = f'le="{le}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total:g}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route and status.", ("method", "path", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route.", ("path",)))
+PROLOG_CALLS = REGISTRY.register(Counter(
+    "prolog_calls_total", "DiagnosisEngine calls sent to the Prolog backend.", ("mode", "method")))
+DIAGNOSES = REGISTRY.register(Counter(
+    "diagnoses_total", "Completed diagnose requests.", ("mode",)))
+FALLBACKS = REGISTRY.register(Counter(
+    "diagnosis_fallbacks_total", "Diagnose requests answered by the fallback heuristics.", ("mode", "kind")))
+ENGINE_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "engine_stage_seconds", "Wall time per DiagnosisEngine stage and call.", ("mode", "method", "stage")))
+ENGINE_INFERENCES = REGISTRY.register(Histogram(
+    "engine_stage_inferences", "SWI-Prolog inferences per DiagnosisEngine stage and call.",
+    ("mode", "method", "stage"), buckets=(10, 100, 1000, 10000, 100000, 1000000)))
+WORKER_STARTUP = REGISTRY.register(Histogram(
+    "worker_startup_seconds", "Time from spawning a Prolog worker until it accepts calls.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)))
+KB_RELOADS = REGISTRY.register(Counter(
+    "kb_reloads_total", "Knowledge base reload attempts by outcome.", ("trigger", "result")))
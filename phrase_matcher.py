@@ -0,0 +1,179 @@
+"""Linear-time replacement for the symptom//1 DCG scan in dcg_rules.pl.
+
+parse_symptoms/2 wraps every symptom//1 phrase in words_before/words_after and
+collects all parses, which enumerates every segmentation of the input. The
+set it returns is exactly the set of symptoms whose phrase occurs as a
+contiguous run of words, so the phrase tables are compiled into an
+Aho-Corasick automaton over words and matched in one pass.
+
+Run ``python phrase_matcher.py --check`` to compare the matcher with
+parse_symptoms/2 on a generated corpus (and optionally ``--corpus FILE``).
+"""
+import argparse
+import random
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+
+from prolog_reader import PString, Term, read_file
+
+# Wildcard non-terminals allowed at the edges of a symptom//1 body
+_GAPS = ("words_before", "words_after")
+_SEPARATORS = re.compile("[ ,.]")
+
+
+def split_into_words(text: str) -> List[str]:
+    """Python twin of split_into_words/2: lower-case, split on ' ,.', drop empties"""
+    return [w for w in _SEPARATORS.split(text.lower()) if w]
+
+
+def _body_phrases(body) -> List[Tuple[str, ...]]:
+    """Expand a DCG body into the word sequences it accepts"""
+    if isinstance(body, list):
+        if not all(isinstance(w, PString) for w in body):
+            raise ValueError(f"Unsupported terminal list {body!r}")
+        return [tuple(body)]
+    if isinstance(body, Term) and body.name == ";":
+        return _body_phrases(body.args[0]) + _body_phrases(body.args[1])
+    if isinstance(body, Term) and body.name == ",":
+        left, right = body.args
+        if left in _GAPS:
+            return _body_phrases(right)
+        if right in _GAPS:
+            return _body_phrases(left)
+        return [a + b for a in _body_phrases(left) for b in _body_phrases(right)]
+    raise ValueError(f"Unsupported symptom//1 body {body!r}")
+
+
+def load_phrase_table(path: str = "dcg_rules.pl") -> List[Tuple[str, Tuple[str, ...]]]:
+    """Read every (symptom, phrase) pair from the symptom//1 rules in path"""
+    table = []
+    for clause in read_file(path):
+        if not (isinstance(clause, Term) and clause.name == "-->"):
+            continue
+        head, body = clause.args
+        if isinstance(head, Term) and head.name == "symptom" and len(head.args) == 1:
+            table.extend((head.args[0], phrase) for phrase in _body_phrases(body))
+    return table
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over words, built once from a phrase table"""
+
+    def __init__(self, table: Iterable[Tuple[str, Tuple[str, ...]]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[frozenset] = [frozenset()]
+        outputs: List[set] = [set()]
+        for symptom, phrase in table:
+            state = 0
+            for word in phrase:
+                if word not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append(set())
+                    self._goto[state][word] = len(self._goto) - 1
+                state = self._goto[state][word]
+            outputs[state].add(symptom)
+
+        # Breadth-first failure links; outputs inherit their fallback's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                outputs[child] |= outputs[self._fail[child]]
+        self._out = [frozenset(o) for o in outputs]
+
+    @classmethod
+    def from_file(cls, path: str = "dcg_rules.pl") -> "PhraseMatcher":
+        return cls(load_phrase_table(path))
+
+    def match_words(self, words: Iterable[str]) -> List[str]:
+        found = set()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for word in words:
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            if out[state]:
+                found |= out[state]
+        return sorted(found)
+
+    def match(self, text: str) -> List[str]:
+        """Same result as parse_symptoms/2: sorted unique symptom atoms"""
+        return self.match_words(split_into_words(text))
+
+
+# ── equivalence check against the DCG ───────────────────────────────
+
+_FILLER = ["my", "child", "has", "a", "and", "since", "yesterday", "the", "bad", "some", "with"]
+
+
+def generate_corpus(table, size: int = 300, seed: int = 7) -> List[str]:
+    """Short sentences mixing 1-3 known phrases with filler words.
+
+    Kept to about a dozen words so that the exponential DCG still finishes.
+    """
+    rng = random.Random(seed)
+    phrases = [" ".join(p) for _, p in table]
+    corpus = [f"{rng.choice(_FILLER)} {p}, {rng.choice(_FILLER)}." for p in phrases]
+    while len(corpus) < size:
+        parts = []
+        for phrase in rng.sample(phrases, rng.randint(1, 3)):
+            parts.extend(rng.sample(_FILLER, rng.randint(0, 2)))
+            parts.append(phrase)
+        corpus.append(" ".join(parts).capitalize())
+    return corpus
+
+
+def check_against_dcg(texts: Iterable[str], path: str = "dcg_rules.pl") -> List[Tuple[str, List[str], List[str]]]:
+    """Return (text, dcg, matcher) for every text where the two disagree"""
+    from pyswip import Atom, Functor, Prolog, Query, Variable
+
+    prolog = Prolog()
+    prolog.consult(path)
+    parse_symptoms = Functor("parse_symptoms", 2)
+    matcher = PhraseMatcher.from_file(path)
+    mismatches = []
+    for text in texts:
+        # The text is an atom argument, never Prolog source
+        symptoms = Variable()
+        query = Query(parse_symptoms(Atom(text), symptoms))
+        try:
+            expected = [str(s) for s in symptoms.value] if query.nextSolution() else []
+        finally:
+            query.closeQuery()
+        actual = matcher.match(text)
+        if expected != actual:
+            mismatches.append((text, expected, actual))
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare PhraseMatcher with parse_symptoms/2")
+    parser.add_argument("--check", action="store_true", help="run the equivalence check")
+    parser.add_argument("--corpus", help="file with one input text per line (default: generated)")
+    parser.add_argument("--kb", default="dcg_rules.pl")
+    args = parser.parse_args()
+
+    table = load_phrase_table(args.kb)
+    if not args.check:
+        print(f"{len(table)} phrases for {len({s for s, _ in table})} symptoms in {args.kb}")
+        raise SystemExit(0)
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            texts = [line.rstrip("\n") for line in f if line.strip()]
+    else:
+        texts = generate_corpus(table)
+    mismatches = check_against_dcg(texts, args.kb)
+    for text, expected, actual in mismatches:
+        print(f"MISMATCH {text!r}\n  dcg:     {expected}\n  matcher: {actual}")
+    print(f"{len(texts) - len(mismatches)}/{len(texts)} inputs match parse_symptoms/2")
+    raise SystemExit(1 if mismatches else 0)
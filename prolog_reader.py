@@ -0,0 +1,232 @@
+"""Minimal reader for the Prolog subset used by the knowledge-base files.
+
+Terms are returned as plain Python values: atoms are ``str``, double-quoted
+strings are ``PString``, numbers are ``int``/``float``, proper lists are
+``list``, variables are ``Var`` and compound terms are ``Term``.
+"""
+import re
+from typing import Iterator, List, NamedTuple, Tuple
+
+
+class Var(NamedTuple):
+    name: str
+
+
+class Term(NamedTuple):
+    name: str
+    args: tuple
+
+
+class PString(str):
+    """A double-quoted Prolog string (as opposed to an atom)"""
+
+
+class PrologSyntaxError(ValueError):
+    pass
+
+
+# Infix operators: name -> (priority, left max priority, right max priority)
+def _xfx(p): return (p, p - 1, p - 1)
+def _xfy(p): return (p, p - 1, p)
+def _yfx(p): return (p, p, p - 1)
+
+INFIX = {
+    ":-": _xfx(1200), "-->": _xfx(1200),
+    ";": _xfy(1100), "|": _xfy(1100), "->": _xfy(1050), ",": _xfy(1000),
+    "=": _xfx(700), "\\=": _xfx(700), "==": _xfx(700), "\\==": _xfx(700),
+    "is": _xfx(700), "<": _xfx(700), ">": _xfx(700), "=<": _xfx(700),
+    ">=": _xfx(700), "=:=": _xfx(700), "=\\=": _xfx(700), "=..": _xfx(700),
+    "+": _yfx(500), "-": _yfx(500), "*": _yfx(400), "/": _yfx(400),
+    "//": _yfx(400), "mod": _yfx(400), "**": _xfx(200), "^": _xfy(200),
+    ":": _xfy(200),
+}
+
+# Prefix operators: name -> (priority, argument max priority)
+PREFIX = {
+    ":-": (1200, 1199), "?-": (1200, 1199), "dynamic": (1150, 1149),
+    "discontiguous": (1150, 1149), "module_transparent": (1150, 1149),
+    "\\+": (900, 900), "-": (200, 200), "+": (200, 200),
+}
+
+_TOKEN_RE = re.compile(r"""
+    (?P<layout>\s+|%[^\n]*|/\*.*?\*/)
+  | (?P<num>\d+(?:\.\d+)?)
+  | (?P<var>[A-Z_][A-Za-z0-9_]*)
+  | (?P<atom>[a-z][A-Za-z0-9_]*)
+  | (?P<qatom>'(?:[^'\\]|''|\\.)*')
+  | (?P<str>"(?:[^"\\]|""|\\.)*")
+  | (?P<punct>[()\[\]{},|])
+  | (?P<solo>[!;])
+  | (?P<sym>[+\-*/\\^<>=~:.?@#&$]+)
+""", re.VERBOSE | re.DOTALL)
+
+
+class _Token(NamedTuple):
+    kind: str
+    value: object
+    layout_before: bool
+
+
+def _unquote(text: str) -> str:
+    quote = text[0]
+    body = text[1:-1].replace(quote * 2, quote)
+    return re.sub(r"\\(.)", lambda m: {"n": "\n", "t": "\t"}.get(m.group(1), m.group(1)), body)
+
+
+def _tokenize(text: str) -> Iterator[_Token]:
+    pos, layout = 0, True
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m:
+            raise PrologSyntaxError(f"Unexpected character {text[pos]!r} at offset {pos}")
+        pos = m.end()
+        kind, value = m.lastgroup, m.group()
+        if kind == "layout":
+            layout = True
+            continue
+        if kind == "sym" and value == "." and (pos >= len(text) or text[pos].isspace() or text[pos] == "%"):
+            kind = "end"
+        elif kind == "num":
+            value = float(value) if "." in value else int(value)
+        elif kind == "qatom":
+            kind, value = "atom", _unquote(value)
+        elif kind == "str":
+            value = PString(_unquote(value))
+        elif kind in ("solo", "sym"):
+            kind = "atom"
+        yield _Token(kind, value, layout)
+        layout = False
+
+
+class _Parser:
+    def __init__(self, tokens: List[_Token]):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else _Token("eof", None, True)
+
+    def next(self):
+        tok = self.peek()
+        self.pos += 1
+        return tok
+
+    def expect(self, kind, value=None):
+        tok = self.next()
+        if tok.kind != kind or (value is not None and tok.value != value):
+            raise PrologSyntaxError(f"Expected {value or kind}, got {tok.value!r}")
+        return tok
+
+    def _starts_term(self, tok):
+        if tok.kind in ("num", "var", "str", "atom"):
+            return tok.value not in INFIX or tok.value in PREFIX
+        return tok.kind == "punct" and tok.value in "([{"
+
+    def _arglist(self):
+        args = [self.parse(999)]
+        while self.peek() == ("punct", ",", self.peek().layout_before):
+            self.next()
+            args.append(self.parse(999))
+        return args
+
+    def primary(self, max_prec):
+        tok = self.next()
+        if tok.kind in ("num", "str"):
+            return tok.value, 0
+        if tok.kind == "var":
+            return Var(tok.value), 0
+        if tok.kind == "punct":
+            if tok.value == "(":
+                term = self.parse(1200)
+                self.expect("punct", ")")
+                return term, 0
+            if tok.value == "[":
+                if self.peek().value == "]":
+                    self.next()
+                    return [], 0
+                items = self._arglist()
+                tail = []
+                if self.peek().value == "|":
+                    self.next()
+                    tail = self.parse(999)
+                self.expect("punct", "]")
+                if tail == []:
+                    return items, 0
+                for item in reversed(items):
+                    tail = Term("[|]", (item, tail))
+                return tail, 0
+            if tok.value == "{":
+                term = self.parse(1200)
+                self.expect("punct", "}")
+                return Term("{}", (term,)), 0
+            raise PrologSyntaxError(f"Unexpected {tok.value!r}")
+        if tok.kind != "atom":
+            raise PrologSyntaxError(f"Unexpected {tok.kind}")
+        name = tok.value
+        nxt = self.peek()
+        if nxt.kind == "punct" and nxt.value == "(" and not nxt.layout_before:
+            self.next()
+            args = self._arglist()
+            self.expect("punct", ")")
+            return Term(name, tuple(args)), 0
+        if name == "-" and nxt.kind == "num" and not nxt.layout_before:
+            return -self.next().value, 0
+        if name in PREFIX and self._starts_term(nxt):
+            prec, arg_max = PREFIX[name]
+            if prec > max_prec:
+                prec, arg_max = 999, 999
+            arg = self.parse(arg_max)
+            return Term(name, (arg,)), prec
+        prec = max(INFIX.get(name, (0,))[0], PREFIX.get(name, (0,))[0])
+        return name, prec if prec <= max_prec else 0
+
+    def parse(self, max_prec=1200):
+        left, left_prec = self.primary(max_prec)
+        while True:
+            tok = self.peek()
+            if tok.kind not in ("atom", "punct") or tok.value not in INFIX:
+                return left
+            prec, left_max, right_max = INFIX[tok.value]
+            if prec > max_prec or left_prec > left_max:
+                return left
+            self.next()
+            right = self.parse(right_max)
+            left, left_prec = Term(tok.value, (left, right)), prec
+
+
+def read_terms(text: str) -> Iterator[object]:
+    """Yield every clause in text, in order"""
+    tokens = list(_tokenize(text))
+    start = 0
+    for i, tok in enumerate(tokens):
+        if tok.kind == "end":
+            parser = _Parser(tokens[start:i])
+            term = parser.parse(1200)
+            if parser.pos != i - start:
+                raise PrologSyntaxError(f"Unexpected {parser.peek().value!r} in clause")
+            yield term
+            start = i + 1
+    if start != len(tokens):
+        raise PrologSyntaxError("Clause not terminated with '.'")
+
+
+def read_file(path: str) -> List[object]:
+    with open(path, encoding="utf-8") as f:
+        return list(read_terms(f.read()))
+
+
+def conjuncts(body) -> List[object]:
+    """Flatten a (A, B, ...) clause body into a list of goals"""
+    goals = []
+    while isinstance(body, Term) and body.name == "," and len(body.args) == 2:
+        goals.append(body.args[0])
+        body = body.args[1]
+    goals.append(body)
+    return goals
+
+
+def split_clause(term) -> Tuple[object, object]:
+    """Return (head, body) of a clause; facts get the body 'true'"""
+    if isinstance(term, Term) and term.name == ":-" and len(term.args) == 2:
+        return term.args
+    return term, "true"
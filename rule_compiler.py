@@ -0,0 +1,382 @@
+"""Compile the diagnosis/1 rules of a KB file into a Python evaluator.
+
+Each fact a rule can test (``has_symptom(S, _)`` or ``user_response(K, V)``)
+is interned to one bit. A rule becomes a mask of required facts, groups of
+alternative facts (from ``(V = a ; V = b)`` disjunctions) and count
+thresholds (from the has_adaptive_symptoms/2 style findall helpers), so a
+case is evaluated with a few integer operations per rule.
+
+DispatchIndex files every rule under one of the symptoms it requires through
+has_symptom/2, so only the rules a case's symptoms can satisfy are tried,
+both here and (as a candidate list) in Prolog.
+
+Run ``python rule_compiler.py --check --mode normal`` to compare the compiled
+rules with Prolog's diagnosis/1 on generated cases.
+"""
+import argparse
+import random
+import time
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from prolog_reader import Term, Var, conjuncts, read_file, split_clause
+
+KB_FILES = {"normal": "diagnosis.pl", "dcg": "dcg_rules.pl"}
+# Below this many rules, testing every rule is faster than looking up the
+# dispatch index (benchmarks.scaling: the two cross at about 16 rules)
+DISPATCH_MIN_RULES = 16
+
+Fact = Tuple[str, ...]  # ("has_symptom", S) or ("user_response", K, V)
+
+
+class RuleCompileError(ValueError):
+    pass
+
+
+def _popcount(x: int) -> int:
+    return bin(x).count("1")
+
+
+class CompiledRule(NamedTuple):
+    disease: str
+    required: int
+    alternatives: Tuple[int, ...]
+    thresholds: Tuple[Tuple[int, int], ...]
+    # Tier-1 symptoms the rule needs via has_symptom/2
+    primaries: Tuple[str, ...]
+
+    def matches(self, mask: int) -> bool:
+        if mask & self.required != self.required:
+            return False
+        for alt in self.alternatives:
+            if not mask & alt:
+                return False
+        for group, minimum in self.thresholds:
+            if _popcount(mask & group) < minimum:
+                return False
+        return True
+
+
+def _atom(term) -> Optional[str]:
+    return term if isinstance(term, str) else None
+
+
+def clauses_by_predicate(terms) -> Dict[Tuple[str, int], List[Tuple[object, object]]]:
+    """{(name, arity): [(head, body), ...]} for every clause in terms"""
+    preds: Dict[Tuple[str, int], List[Tuple[object, object]]] = {}
+    for term in terms:
+        head, body = split_clause(term)
+        if isinstance(head, Term) and head.name in (":-", "-->"):
+            continue
+        if isinstance(head, Term):
+            preds.setdefault((head.name, len(head.args)), []).append((head, body))
+        elif isinstance(head, str):
+            preds.setdefault((head, 0), []).append((head, body))
+    return preds
+
+
+def _fact_template(goal, var: Var) -> Optional[Fact]:
+    """has_symptom(S, _) -> ("has_symptom",), user_response(S, yes) -> ("user_response", "yes")"""
+    if isinstance(goal, Term) and goal.args and goal.args[0] == var:
+        if goal.name == "has_symptom" and len(goal.args) == 2 and isinstance(goal.args[1], Var):
+            return ("has_symptom",)
+        if goal.name == "user_response" and len(goal.args) == 2 and _atom(goal.args[1]):
+            return ("user_response", goal.args[1])
+    return None
+
+
+def entry_clauses(preds, entry: str = "diagnosis"):
+    """(head, body) of every entry/1 rule; diagnosis(D) :- disease_rule(D) is inlined"""
+    for head, body in preds.get((entry, 1), []):
+        if isinstance(head.args[0], Var) and isinstance(body, Term) \
+                and len(body.args) == 1 and body.args[0] == head.args[0]:
+            yield from entry_clauses(preds, body.name)
+        else:
+            yield head, body
+
+
+class DispatchIndex:
+    """Rules worth trying for a set of reported symptoms.
+
+    A rule can only hold if every has_symptom(S, _) goal in its top-level
+    conjunction is satisfied. Each rule is filed under the rarest of those
+    symptoms, so a lookup touches the rules filed under the reported
+    symptoms (plus the few that require none) rather than every rule.
+    """
+
+    def __init__(self, rules: Iterable[Tuple[Optional[str], Iterable[str]]]):
+        self.diseases: List[Optional[str]] = []
+        self.required: List[FrozenSet[str]] = []
+        for disease, symptoms in rules:
+            self.diseases.append(disease)
+            self.required.append(frozenset(symptoms))
+        # A rule with a variable head may prove any disease, so no list of
+        # candidates is safe for that KB
+        self.exact = None not in self.diseases
+        frequency = Counter(s for required in self.required for s in required)
+        self.by_symptom: Dict[str, List[int]] = {}
+        self.unanchored: List[int] = []
+        for i, required in enumerate(self.required):
+            if required:
+                anchor = min(required, key=lambda s: (frequency[s], s))
+                self.by_symptom.setdefault(anchor, []).append(i)
+            else:
+                self.unanchored.append(i)
+
+    @classmethod
+    def from_terms(cls, terms: Iterable[object], entry: str = "diagnosis") -> "DispatchIndex":
+        rules = []
+        for head, body in entry_clauses(clauses_by_predicate(terms), entry):
+            symptoms = [goal.args[0] for goal in conjuncts(body)
+                        if isinstance(goal, Term) and goal.name == "has_symptom"
+                        and len(goal.args) == 2 and _atom(goal.args[0])]
+            rules.append((_atom(head.args[0]), symptoms))
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, path: str) -> "DispatchIndex":
+        return cls.from_terms(read_file(path))
+
+    def rule_indices(self, symptoms: Iterable[str]) -> List[int]:
+        """Positions of the rules whose required symptoms are all present"""
+        present = set(symptoms)
+        hits = list(self.unanchored)
+        for symptom in present:
+            hits.extend(self.by_symptom.get(symptom, ()))
+        hits.sort()
+        return [i for i in hits if self.required[i] <= present]
+
+    def candidates(self, symptoms: Iterable[str]) -> Optional[List[str]]:
+        """Diseases that may hold, in rule order; None if the KB cannot be indexed"""
+        if not self.exact:
+            return None
+        return list(dict.fromkeys(self.diseases[i] for i in self.rule_indices(symptoms)))
+
+
+class CompiledRuleSet:
+    """The diagnosis/1 rules of one KB, compiled to bitmask tests"""
+
+    def __init__(self, terms: Iterable[object], entry: str = "diagnosis"):
+        self.bits: Dict[Fact, int] = {}
+        self._preds = clauses_by_predicate(terms)
+        self._counters = self._find_counters()
+        self.rules: List[CompiledRule] = []
+        for head, body in entry_clauses(self._preds, entry):
+            self.rules.append(self._compile(head, body))
+        self.dispatch = DispatchIndex((rule.disease, rule.primaries) for rule in self.rules)
+
+    @classmethod
+    def from_file(cls, path: str) -> "CompiledRuleSet":
+        return cls(read_file(path))
+
+    # ── compilation ────────────────────────────────────────────────
+    def _bit(self, fact: Fact) -> int:
+        if fact not in self.bits:
+            self.bits[fact] = 1 << len(self.bits)
+        return self.bits[fact]
+
+    def _find_counters(self):
+        """Recognise helpers of the form
+
+            helper(P, Count) :- list_pred(P, L),
+                findall(S, (member(S, L), Test), Ms), length(Ms, Count).
+        """
+        counters = {}
+        for (name, arity), clauses in self._preds.items():
+            if arity != 2 or len(clauses) != 1:
+                continue
+            head, body = clauses[0]
+            goals = conjuncts(body)
+            if len(goals) != 3:
+                continue
+            lists, findall, length = goals
+            try:
+                member, test = conjuncts(findall.args[1])
+                ok = (findall.name == "findall" and length.name == "length"
+                      and member.name == "member" and member.args == (findall.args[0], lists.args[1])
+                      and lists.args[0] == head.args[0] and length.args == (findall.args[2], head.args[1]))
+            except (AttributeError, ValueError):
+                continue
+            template = _fact_template(test, findall.args[0]) if ok else None
+            if template is None:
+                continue
+            groups = {}
+            for fact_head, fact_body in self._preds.get((lists.name, 2), []):
+                if fact_body == "true":
+                    groups[fact_head.args[0]] = list(fact_head.args[1])
+            counters[name] = (template, groups)
+        return counters
+
+    def _compile(self, head, body) -> CompiledRule:
+        disease = _atom(head.args[0])
+        if disease is None:
+            raise RuleCompileError(f"Rule head {head!r} has no disease atom")
+        required, alternatives, thresholds, primaries = 0, [], [], []
+        open_responses: Dict[Var, str] = {}   # V -> K for user_response(K, V)
+        counts: Dict[Var, int] = {}           # Count -> mask of counted facts
+
+        for goal in conjuncts(body):
+            if not isinstance(goal, Term):
+                raise RuleCompileError(f"{disease}: unsupported goal {goal!r}")
+            name, args = goal.name, goal.args
+            if name == "has_symptom" and len(args) == 2 and _atom(args[0]) and isinstance(args[1], Var):
+                required |= self._bit(("has_symptom", args[0]))
+                primaries.append(args[0])
+            elif name == "user_response" and len(args) == 2 and _atom(args[0]) and _atom(args[1]):
+                required |= self._bit(("user_response", args[0], args[1]))
+            elif name == "user_response" and len(args) == 2 and _atom(args[0]) and isinstance(args[1], Var):
+                open_responses[args[1]] = args[0]
+            elif name in self._counters and len(args) == 2 and _atom(args[0]) and isinstance(args[1], Var):
+                template, groups = self._counters[name]
+                if args[0] not in groups:
+                    raise RuleCompileError(f"{disease}: no adaptive list for {args[0]}")
+                mask = 0
+                for symptom in groups[args[0]]:
+                    mask |= self._bit((template[0], symptom) + template[1:])
+                counts[args[1]] = mask
+            elif name in (">=", ">") and args[0] in counts and isinstance(args[1], int):
+                thresholds.append((counts[args[0]], args[1] + (name == ">")))
+            elif name in (";", "="):
+                var, values = self._alternatives(goal, disease)
+                if var not in open_responses:
+                    raise RuleCompileError(f"{disease}: {var.name} is not a user_response value")
+                key = open_responses.pop(var)
+                mask = 0
+                for value in values:
+                    mask |= self._bit(("user_response", key, value))
+                alternatives.append(mask)
+            else:
+                raise RuleCompileError(f"{disease}: unsupported goal {goal!r}")
+
+        if open_responses:
+            # user_response(K, _) with no constraint on the value
+            raise RuleCompileError(f"{disease}: unconstrained user_response value")
+        return CompiledRule(disease, required, tuple(alternatives), tuple(thresholds), tuple(primaries))
+
+    def _alternatives(self, goal, disease) -> Tuple[Var, List[str]]:
+        """(V = a ; V = b ; ...) -> (V, [a, b, ...])"""
+        if goal.name == ";":
+            var_l, left = self._alternatives(goal.args[0], disease)
+            var_r, right = self._alternatives(goal.args[1], disease)
+            if var_l == var_r:
+                return var_l, left + right
+        elif goal.name == "=" and isinstance(goal.args[0], Var) and _atom(goal.args[1]):
+            return goal.args[0], [goal.args[1]]
+        raise RuleCompileError(f"{disease}: unsupported disjunction {goal!r}")
+
+    # ── evaluation ────────────────────────────────────────────────
+    def fact_mask(self, facts: Iterable[Fact]) -> int:
+        mask = 0
+        for fact in facts:
+            mask |= self.bits.get(fact, 0)
+        return mask
+
+    def case_mask(self, case) -> int:
+        """Bitmask of a sessions.Case's facts; facts no rule tests are ignored"""
+        return self.fact_mask([("has_symptom", s) for s, _ in case.symptoms]
+                              + [("user_response", k, v) for k, v in case.response_facts])
+
+    def evaluate(self, mask: int, diseases: Optional[Iterable[str]] = None,
+                 indices: Optional[Iterable[int]] = None) -> List[str]:
+        """Diseases whose rule holds, in rule order, without duplicates.
+
+        When diseases is given only their rules are tested; when indices is
+        given only the rules at those positions are.
+        """
+        wanted = None if diseases is None else set(diseases)
+        rules = self.rules if indices is None else [self.rules[i] for i in indices]
+        found = []
+        for rule in rules:
+            if wanted is not None and rule.disease not in wanted:
+                continue
+            if rule.disease not in found and rule.matches(mask):
+                found.append(rule.disease)
+        return found
+
+    def evaluate_case(self, case, diseases: Optional[Iterable[str]] = None,
+                      dispatch: Optional[bool] = None) -> List[str]:
+        """evaluate() over the rules the dispatch index selects for the case.
+
+        The index is only used from DISPATCH_MIN_RULES rules on, unless
+        dispatch says otherwise.
+        """
+        if dispatch is None:
+            dispatch = len(self.rules) >= DISPATCH_MIN_RULES
+        indices = self.dispatch.rule_indices(s for s, _ in case.symptoms) if dispatch else None
+        return self.evaluate(self.case_mask(case), diseases, indices)
+
+
+def load_rules(mode: str) -> CompiledRuleSet:
+    return CompiledRuleSet.from_file(KB_FILES[mode])
+
+
+# ── differential check against Prolog ───────────────────────────────
+
+def generate_cases(rules: CompiledRuleSet, count: int, seed: int = 11):
+    """Random cases drawn from the facts the rules test, biased towards hits"""
+    from sessions import Case
+
+    rng = random.Random(seed)
+    facts = list(rules.bits)
+    cases = []
+    for i in range(count):
+        case = Case()
+        if rules.rules and i % 2 == 0:
+            # Start from a rule's own facts so that some cases match
+            rule = rng.choice(rules.rules)
+            chosen = [f for f, bit in rules.bits.items()
+                      if bit & (rule.required | sum(m for m, _ in rule.thresholds) | sum(rule.alternatives))]
+        else:
+            chosen = []
+        chosen += rng.sample(facts, rng.randint(0, min(len(facts), 8)))
+        for fact in dict.fromkeys(chosen):
+            if rng.random() < 0.15:
+                continue
+            if fact[0] == "has_symptom":
+                case.add_symptom(fact[1], rng.choice((1, 2)))
+            else:
+                case.add_response(fact[1], fact[2])
+        cases.append(case)
+    return cases
+
+
+def check_against_prolog(mode: str, count: int = 2000):
+    from diagnosis_engine import DiagnosisEngine
+
+    prolog_engine = DiagnosisEngine(mode=mode)
+    rules = load_rules(mode)
+    mismatches = []
+    prolog_time = compiled_time = 0.0
+    for case in generate_cases(rules, count):
+        start = time.perf_counter()
+        with prolog_engine.case_context() as case_module:
+            prolog_engine.assert_facts(case.symptoms, case.response_facts, case_module)
+            expected = set(prolog_engine.infer(module=case_module))
+        mid = time.perf_counter()
+        actual = set(rules.evaluate_case(case))
+        compiled_time += time.perf_counter() - mid
+        prolog_time += mid - start
+        if expected != actual:
+            mismatches.append((case, sorted(expected), sorted(actual)))
+    return mismatches, prolog_time, compiled_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare compiled diagnosis rules with Prolog")
+    parser.add_argument("--mode", choices=sorted(KB_FILES), default="normal")
+    parser.add_argument("--check", action="store_true", help="run the differential check")
+    parser.add_argument("--cases", type=int, default=2000)
+    args = parser.parse_args()
+
+    rules = load_rules(args.mode)
+    if not args.check:
+        for rule in rules.rules:
+            print(rule.disease, bin(rule.required), rule.alternatives, rule.thresholds)
+        raise SystemExit(0)
+    mismatches, prolog_time, compiled_time = check_against_prolog(args.mode, args.cases)
+    for case, expected, actual in mismatches[:20]:
+        print(f"MISMATCH {case.symptoms} {case.response_facts}\n  prolog:   {expected}\n  compiled: {actual}")
+    print(f"{args.cases - len(mismatches)}/{args.cases} cases agree; "
+          f"prolog {prolog_time / args.cases * 1e6:.1f} us/case, "
+          f"compiled {compiled_time / args.cases * 1e6:.1f} us/case")
+    raise SystemExit(1 if mismatches else 0)
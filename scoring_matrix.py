@@ -0,0 +1,190 @@
+"""Score cases against every compiled rule at once with NumPy.
+
+A ScoringMatrix turns a CompiledRuleSet (see rule_compiler.py) into dense
+matrices over the facts the rules test. A batch of cases becomes a 0/1 case
+x fact matrix X, and the share of each rule's conditions that a case meets
+is
+
+    (X @ required + clip(X @ groups / capacity, 0, 1) @ group_rules) / conditions
+
+where required holds each rule's required facts, and the groups are its
+alternatives (capacity 1) and adaptive-symptom thresholds (capacity = the
+minimum count). That is the same score differential.Differential gives a
+single case, computed for a whole batch in two matrix products. A rule holds
+when its score is 1, so the full matches are exactly what the diagnosis/1
+rules return. The other diseases get a partial-match score rather than
+nothing, which yields a ranked differential.
+
+Dense matrices take facts x rules floats each, which is small for the
+shipped KBs. NumPy is only needed for this module:
+
+    pip install numpy
+    python scoring_matrix.py --check --mode normal
+"""
+import argparse
+import time
+from typing import Dict, Iterable, List, Mapping, Optional
+
+import numpy as np
+
+from rule_compiler import KB_FILES, CompiledRuleSet, Fact, generate_cases, load_rules
+
+# Scores are sums of float32 fractions; anything this close to 1 is a match
+_FULL = 1.0 - 1e-6
+
+
+class ScoringMatrix:
+    """Disease x fact weights of one KB's diagnosis/1 rules"""
+
+    def __init__(self, rules: CompiledRuleSet, weights: Optional[Mapping[str, int]] = None):
+        self.rules = rules
+        # Column j is the fact interned to bit 1 << j
+        self.facts: List[Fact] = sorted(rules.bits, key=lambda f: rules.bits[f])
+        self.columns: Dict[Fact, int] = {f: j for j, f in enumerate(self.facts)}
+        self.diseases: List[str] = list(dict.fromkeys(rule.disease for rule in rules.rules))
+        index = {d: i for i, d in enumerate(self.diseases)}
+        self.rule_disease = np.array([index[rule.disease] for rule in rules.rules], dtype=np.intp)
+        weights = weights or {}
+        self.weights = np.array([weights.get(d, 1) for d in self.diseases], dtype=np.float32)
+
+        n_facts, n_rules = len(self.facts), len(rules.rules)
+        self.required = np.zeros((n_facts, n_rules), dtype=np.float32)
+        groups, capacity, owners = [], [], []
+        conditions = np.zeros(n_rules, dtype=np.float32)
+        for r, rule in enumerate(rules.rules):
+            for j in _bit_positions(rule.required):
+                self.required[j, r] = 1.0
+                conditions[r] += 1
+            for mask in rule.alternatives:
+                groups.append(mask)
+                capacity.append(1)
+                owners.append(r)
+            for mask, minimum in rule.thresholds:
+                groups.append(mask)
+                capacity.append(minimum)
+                owners.append(r)
+            conditions[r] += len(rule.alternatives) + len(rule.thresholds)
+        self.groups = np.zeros((n_facts, len(groups)), dtype=np.float32)
+        self.group_rules = np.zeros((len(groups), n_rules), dtype=np.float32)
+        for g, (mask, r) in enumerate(zip(groups, owners)):
+            self.groups[list(_bit_positions(mask)), g] = 1.0
+            self.group_rules[g, r] = 1.0
+        capacity = np.array(capacity, dtype=np.float32)
+        # A threshold of 0 is always met
+        self._always = capacity == 0
+        self.capacity = np.where(self._always, 1.0, capacity).astype(np.float32)
+        self.conditions = conditions
+
+    @classmethod
+    def from_file(cls, path: str, weights: Optional[Mapping[str, int]] = None) -> "ScoringMatrix":
+        return cls(CompiledRuleSet.from_file(path), weights)
+
+    def case_matrix(self, cases: Iterable) -> np.ndarray:
+        """0/1 matrix of sessions.Case facts, one row per case; untested facts are ignored"""
+        cases = list(cases)
+        x = np.zeros((len(cases), len(self.facts)), dtype=np.float32)
+        columns = self.columns
+        for i, case in enumerate(cases):
+            cols = [columns[f] for f in
+                    [("has_symptom", s) for s, _ in case.symptoms]
+                    + [("user_response", k, v) for k, v in case.response_facts] if f in columns]
+            x[i, cols] = 1.0
+        return x
+
+    def rule_scores(self, x: np.ndarray) -> np.ndarray:
+        """Share of each rule's conditions met, cases x rules"""
+        met = x @ self.required
+        if self.group_rules.shape[0]:
+            counts = np.minimum((x @ self.groups) / self.capacity, 1.0)
+            counts[:, self._always] = 1.0
+            met += counts @ self.group_rules
+        # A rule with no conditions always holds
+        return np.divide(met, self.conditions, out=np.ones_like(met), where=self.conditions > 0)
+
+    def disease_scores(self, rule_scores: np.ndarray) -> np.ndarray:
+        """Best rule score of each disease, cases x diseases"""
+        scores = np.zeros((rule_scores.shape[0], len(self.diseases)), dtype=np.float32)
+        np.maximum.at(scores.T, self.rule_disease, rule_scores.T)
+        return scores
+
+    def matches(self, rule_scores: np.ndarray) -> List[List[str]]:
+        """Diseases whose rule holds for each case, in rule order, like CompiledRuleSet.evaluate"""
+        found = []
+        for row in rule_scores >= _FULL:
+            found.append(list(dict.fromkeys(self.diseases[self.rule_disease[r]]
+                                            for r in np.flatnonzero(row))))
+        return found
+
+    def ranked(self, disease_scores: np.ndarray, limit: int = 5) -> List[Dict[str, float]]:
+        """{disease: score} of the best partial matches per case, best first.
+
+        Ties are broken by the disease weight (RULE_LEN), as in
+        Differential.ranked().
+        """
+        # Sort key: score first, then weight; lexsort takes the last key first
+        order = np.lexsort((-self.weights[None, :].repeat(len(disease_scores), 0), -disease_scores))
+        ranked = []
+        for row, scores in zip(order[:, :limit], disease_scores):
+            ranked.append({self.diseases[d]: round(float(scores[d]), 2) for d in row if scores[d] > 0})
+        return ranked
+
+    def score_cases(self, cases: Iterable, limit: int = 5):
+        """(matched diseases, ranked differential) for each case"""
+        rule_scores = self.rule_scores(self.case_matrix(cases))
+        return self.matches(rule_scores), self.ranked(self.disease_scores(rule_scores), limit)
+
+
+def _bit_positions(mask: int) -> Iterable[int]:
+    j = 0
+    while mask:
+        if mask & 1:
+            yield j
+        mask >>= 1
+        j += 1
+
+
+def check_against_rules(mode: str, count: int = 2000):
+    """Compare full matches with CompiledRuleSet and scores with Differential"""
+    from differential import _progress
+
+    rules = load_rules(mode)
+    matrix = ScoringMatrix(rules)
+    cases = generate_cases(rules, count)
+    # One case at a time, every rule scored as Differential.ranked() does
+    start = time.perf_counter()
+    expected_scores = []
+    for case in cases:
+        mask = rules.case_mask(case)
+        expected_scores.append([_progress(rule, mask) for rule in rules.rules])
+    per_case_time = time.perf_counter() - start
+    start = time.perf_counter()
+    rule_scores = matrix.rule_scores(matrix.case_matrix(cases))
+    matrix_time = time.perf_counter() - start
+    matched = matrix.matches(rule_scores)
+    mismatches = []
+    for i, case in enumerate(cases):
+        expected = rules.evaluate_case(case)
+        if matched[i] != expected or not np.allclose(expected_scores[i], rule_scores[i], atol=1e-5):
+            mismatches.append((case, expected, matched[i]))
+    return mismatches, per_case_time, matrix_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare matrix scoring with the compiled rules")
+    parser.add_argument("--mode", choices=sorted(KB_FILES), default="normal")
+    parser.add_argument("--check", action="store_true", help="run the comparison")
+    parser.add_argument("--cases", type=int, default=2000)
+    args = parser.parse_args()
+
+    if not args.check:
+        matrix = ScoringMatrix(load_rules(args.mode))
+        print(f"{len(matrix.diseases)} diseases, {len(matrix.rules.rules)} rules, "
+              f"{len(matrix.facts)} facts, {matrix.groups.shape[1]} condition groups")
+        raise SystemExit(0)
+    mismatches, per_case_time, matrix_time = check_against_rules(args.mode, args.cases)
+    for case, expected, actual in mismatches[:20]:
+        print(f"MISMATCH {case.symptoms} {case.response_facts}\n  compiled: {expected}\n  matrix:   {actual}")
+    print(f"{args.cases - len(mismatches)}/{args.cases} cases agree; "
+          f"scored per case {per_case_time / args.cases * 1e6:.1f} us/case, "
+          f"as one matrix {matrix_time / args.cases * 1e6:.1f} us/case")
+    raise SystemExit(1 if mismatches else 0)
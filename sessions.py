@@ -0,0 +1,290 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from kb_compiler import KBSnapshot, load_snapshot
+
+SESSION_COOKIE = "session_id"
+SESSION_HEADER = "X-Session-ID"
+
+
+class SymbolTable:
+    """Append-only symptom name <-> ID map shared by every Case in the process.
+
+    Only KB symptoms are added: the snapshot's vocabulary when the module is
+    imported, and that of each new KB release (see kb_release.py). Client
+    input never reaches the table, so symptom IDs, and with them the case
+    bitsets, stay small. IDs are only meaningful inside one process;
+    Case.to_bytes() writes names, never IDs.
+
+    words holds one copy of each response key and answer the KB knows
+    (kb_words()), for cases to share instead of keeping their own.
+    """
+
+    def __init__(self, names: Iterable[str] = (), limit: int = 1024, word_limit: int = 8192):
+        self.limit = limit
+        self.word_limit = word_limit
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.words: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.add(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names: Iterable[str]):
+        """Give each new name an ID while there is room; the rest stay unnumbered"""
+        with self._lock:
+            for name in names:
+                if name not in self.ids and len(self.names) < self.limit:
+                    self.names.append(name)
+                    self.ids[name] = len(self.names) - 1
+
+    def add_words(self, words: Iterable[str]):
+        with self._lock:
+            for word in words:
+                if len(self.words) < self.word_limit:
+                    self.words.setdefault(word, word)
+
+
+def kb_words(kb: KBSnapshot) -> Iterator[str]:
+    """Response keys and answers that come from the KB rather than the client"""
+    yield from ("y", "n", "yes", "no")
+    for s in kb.symptoms:
+        yield s
+        yield f"{s}_detail"
+    for trigger, questions in kb.t3.items():
+        key = "_".join(trigger)
+        yield from (f"{key}_{i}" for i in range(len(questions)))
+        yield from kb.differentiators.get(key, ())
+
+
+_SNAPSHOT = load_snapshot()
+SYMBOLS = SymbolTable(_SNAPSHOT.symptoms)
+SYMBOLS.add_words(kb_words(_SNAPSHOT))
+
+_FORMAT = 1
+
+
+def _bit_ids(bits: int) -> Iterator[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _write_varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+class Case:
+    """Facts collected for one diagnosis, independent of the Prolog KB.
+
+    KB symptoms are kept as one bitset of SYMBOLS IDs per tier; any other
+    symptom goes to a short list of its own. Responses are client text, so
+    they stay plain strings held by this case. to_bytes()/from_bytes() give a
+    portable form of a few hundred bytes, which is also what pickling a case
+    sends to a worker.
+    """
+
+    __slots__ = ("kb_version", "_tier_bits", "_extra", "_responses")
+
+    def __init__(self, kb_version: Optional[str] = None):
+        # KB release the case runs on (see kb_release.py); None until pinned
+        self.kb_version = kb_version
+        # Symptom bitsets of tiers 1 and 2
+        self._tier_bits = [0, 0]
+        # (symptom, tier) that the bitsets cannot hold; usually None
+        self._extra: Optional[List[Tuple[str, int]]] = None
+        # Every user_response/2 fact, in order (keys may repeat), as
+        # alternating keys and values
+        self._responses: List[str] = []
+
+    def add_symptom(self, symptom: str, tier: int = 1):
+        id_ = SYMBOLS.ids.get(symptom) if tier in (1, 2) else None
+        if id_ is not None:
+            self._tier_bits[tier - 1] |= 1 << id_
+        elif (symptom, tier) not in (self._extra or ()):
+            self._extra = (self._extra or []) + [(symptom, tier)]
+
+    def add_response(self, key: str, value: str):
+        # KB keys and y/n answers are shared with SYMBOLS.words; anything
+        # else is the client's text and stays this case's own string
+        words = SYMBOLS.words
+        self._responses += (words.get(key, key), words.get(value, value))
+
+    @property
+    def symptoms(self) -> List[Tuple[str, int]]:
+        """has_symptom/2 facts as (symptom, tier), without duplicates"""
+        names = SYMBOLS.names
+        symptoms = [(names[i], tier + 1) for tier, bits in enumerate(self._tier_bits)
+                    for i in _bit_ids(bits)]
+        return symptoms + self._extra if self._extra else symptoms
+
+    @property
+    def response_facts(self) -> List[Tuple[str, str]]:
+        """Every asserted user_response/2 fact, in order (keys may repeat)"""
+        facts = self._responses
+        return list(zip(facts[::2], facts[1::2]))
+
+    @property
+    def responses(self) -> Dict[str, str]:
+        """The latest value of each response key"""
+        return dict(self.response_facts)
+
+    def symptom_names(self, tier: Optional[int] = None) -> List[str]:
+        return [s for s, t in self.symptoms if tier is None or t == tier]
+
+    def symptom_mark(self) -> Tuple[int, int]:
+        """Opaque position for symptoms_since()"""
+        return self._tier_bits[0] | self._tier_bits[1], len(self._extra or ())
+
+    def symptoms_since(self, mark: Tuple[int, int]) -> List[str]:
+        """Symptoms added since symptom_mark() returned mark"""
+        bits, extra = mark
+        names = SYMBOLS.names
+        new = [names[i] for i in _bit_ids((self._tier_bits[0] | self._tier_bits[1]) & ~bits)]
+        return new + [s for s, _ in (self._extra or ())[extra:]]
+
+    def response_count(self) -> int:
+        return len(self._responses) // 2
+
+    def to_bytes(self) -> bytes:
+        """Portable encoding: a string table, then symptoms and responses by string index"""
+        strings: Dict[str, int] = {}
+        symptoms = [(strings.setdefault(s, len(strings)), t) for s, t in self.symptoms]
+        facts = [(strings.setdefault(k, len(strings)), strings.setdefault(v, len(strings)))
+                 for k, v in self.response_facts]
+        out = bytearray([_FORMAT])
+        # The string count leaves out kb_version, which comes first ("" for None)
+        _write_varint(out, len(strings))
+        for text in [self.kb_version or ""] + list(strings):
+            encoded = text.encode("utf-8")
+            _write_varint(out, len(encoded))
+            out += encoded
+        for pairs in (symptoms, facts):
+            _write_varint(out, len(pairs))
+            for a, b in pairs:
+                _write_varint(out, a)
+                _write_varint(out, b)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Case":
+        if data[0] != _FORMAT:
+            raise ValueError(f"unknown case format {data[0]}")
+        count, pos = _read_varint(data, 1)
+        strings = []
+        for _ in range(count + 1):
+            size, pos = _read_varint(data, pos)
+            strings.append(data[pos:pos + size].decode("utf-8"))
+            pos += size
+        case = cls(strings.pop(0) or None)
+        pairs = []
+        for _ in range(2):
+            count, pos = _read_varint(data, pos)
+            items = []
+            for _ in range(count):
+                a, pos = _read_varint(data, pos)
+                b, pos = _read_varint(data, pos)
+                items.append((a, b))
+            pairs.append(items)
+        symptoms, facts = pairs
+        for s, tier in symptoms:
+            case.add_symptom(strings[s], tier)
+        for k, v in facts:
+            case.add_response(strings[k], strings[v])
+        return case
+
+    def __reduce__(self):
+        return Case.from_bytes, (self.to_bytes(),)
+
+
+class Session:
+    """Per-client state: one case per diagnosis mode"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.cases: Dict[str, Case] = {}
+        # Live differential.Differential per mode, following cases[mode]
+        self.differentials: Dict[str, object] = {}
+        self.touched = time.monotonic()
+
+    def case(self, mode: str) -> Case:
+        if mode not in self.cases:
+            self.cases[mode] = Case()
+        return self.cases[mode]
+
+    def new_case(self, mode: str, kb_version: Optional[str] = None) -> Case:
+        self.cases[mode] = Case(kb_version)
+        self.differentials.pop(mode, None)
+        return self.cases[mode]
+
+
+class SessionStore:
+    """In-memory session store with idle TTL and LRU eviction"""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 3600.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id: Optional[str]) -> Session:
+        """Return the live session for session_id, or a new one if there is none.
+
+        A new session always gets a fresh ID of our own: an ID the client
+        made up (or one that expired) is never adopted, so nobody can plant
+        a session ID for someone else to use.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = Session(uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session.session_id)
+            session.touched = now
+            return session
+
+    def kb_versions(self) -> set:
+        """KB releases that live sessions' cases run on"""
+        with self._lock:
+            return {case.kb_version for session in self._sessions.values()
+                    for case in session.cases.values() if case.kb_version}
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _expire(self, now: float):
+        # Sessions are kept in access order, so expired ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.touched <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,109 @@
+"""Tier-2 keyword extraction: detail text -> adaptive symptoms.
+
+The keyword table is declarative and compiled once into a word lookup set.
+A detail string is split into words once and intersected with that set, so
+the cost grows with the text length rather than with text x keywords.
+Keywords match whole words; a trailing ``*`` marks a stem ("wheez*" matches
+"wheezing" and "wheezy").
+
+Run ``python symptom_extractor.py`` to benchmark against the old nested loop.
+"""
+import string
+from typing import Dict, List, Tuple
+
+# keyword -> adaptive symptoms it implies
+ADAPTIVE_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("high", ("high_grade_fever",)),
+    ("intermittent", ("persistent_fever",)),
+    ("chills", ("chills",)),
+    ("night", ("night_sweats", "worsens_at_night")),
+    ("dry", ("dry_cough",)),
+    ("wheez*", ("wheezing",)),
+    ("productive", ("productive_cough",)),
+    ("phlegm", ("productive_cough",)),
+    ("itchy", ("itchy_rash",)),
+    ("localized", ("rash_localized_or_widespread",)),
+    ("widespread", ("rash_localized_or_widespread",)),
+    ("peeling", ("peeling_skin",)),
+    ("blisters", ("chickenpox_blisters",)),
+    ("frequent", ("frequent_loose_stools",)),
+    ("severe", ("dehydration_signs",)),
+    ("watery", ("watery_stool",)),
+    ("cramps", ("abdominal_cramps",)),
+)
+
+# Punctuation (except "_") separates words, as in a regex word boundary
+_PUNCTUATION = str.maketrans({c: " " for c in string.punctuation if c != "_"})
+
+
+class KeywordExtractor:
+    def __init__(self, table=ADAPTIVE_KEYWORDS):
+        self._exact: Dict[str, Tuple[str, ...]] = {}
+        self._stems: Dict[str, Tuple[str, ...]] = {}
+        self._rank: Dict[str, int] = {}
+        for keyword, symptoms in table:
+            keyword = keyword.lower()
+            if keyword.endswith("*"):
+                self._stems[keyword[:-1]] = self._stems.get(keyword[:-1], ()) + tuple(symptoms)
+            else:
+                self._exact[keyword] = self._exact.get(keyword, ()) + tuple(symptoms)
+            self._rank.setdefault(keyword.rstrip("*"), len(self._rank))
+        self._keywords = frozenset(self._exact)
+
+    def extract(self, text: str) -> List[str]:
+        """Adaptive symptoms mentioned in text, unique, in keyword-table order"""
+        lower = text.lower()
+        words = set(lower.translate(_PUNCTUATION).split())
+        hits = list(self._keywords.intersection(words))
+        for stem in self._stems:
+            if stem in lower and any(w.startswith(stem) for w in words):
+                hits.append(stem)
+        if not hits:
+            return []
+        hits.sort(key=self._rank.__getitem__)
+        found: Dict[str, None] = {}
+        for keyword in hits:
+            found.update(dict.fromkeys(self._exact.get(keyword, ()) + self._stems.get(keyword, ())))
+        return list(found)
+
+
+_EXTRACTOR = KeywordExtractor()
+
+
+def extract_adaptive_symptoms(text: str) -> List[str]:
+    return _EXTRACTOR.extract(text)
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    def legacy_extract(table, form):
+        # The per-request dict and nested substring loop this module replaced
+        keyword_to_symptom = {keyword.rstrip("*"): symptoms[-1] for keyword, symptoms in table}
+        out = []
+        for details in form.values():
+            details_lower = details.lower()
+            for keyword, adaptive_symptom in keyword_to_symptom.items():
+                if keyword in details_lower:
+                    out.append(adaptive_symptom)
+        return out
+
+    def compiled_extract(extractor, form):
+        return [s for details in form.values() for s in extractor.extract(details)]
+
+    rng = random.Random(0)
+    filler = "the child has been mild since monday very and with a little after eating during day".split()
+    synthetic = tuple((f"term{i}", (f"symptom_{i}",)) for i in range(500))
+    for name, table in (("repo table", ADAPTIVE_KEYWORDS), ("500 keywords", ADAPTIVE_KEYWORDS + synthetic)):
+        extractor = KeywordExtractor(table)
+        keywords = [k.rstrip("*") for k, _ in table]
+        for fields, length in ((7, 5), (50, 40), (200, 200)):
+            form = {f"s{i}_detail": " ".join(rng.choice(keywords) if rng.random() < 0.1 else rng.choice(filler)
+                                             for _ in range(length))
+                    for i in range(fields)}
+            runs = 50
+            t_legacy = timeit.timeit(lambda: legacy_extract(table, form), number=runs) / runs
+            t_compiled = timeit.timeit(lambda: compiled_extract(extractor, form), number=runs) / runs
+            print(f"{name:13s} {fields:4d} fields x {length:3d} words: "
+                  f"legacy {t_legacy * 1e6:9.1f} us  compiled {t_compiled * 1e6:9.1f} us")
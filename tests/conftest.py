@@ -0,0 +1,14 @@
+"""Checks that run without SWI-Prolog, on the compiled engine and parser.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The KB files are opened relative to the repository root
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+os.environ["DIAGNOSIS_ENGINE"] = "compiled"
+os.environ.setdefault("DIAGNOSIS_WORKERS", "1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,49 @@
+import io
+import json
+
+import pytest
+
+import batch
+
+RECORDS = [
+    {"id": "ok", "mode": "normal", "symptoms": ["fever", "rash"],
+     "details": {"rash": "itchy rash after fever, blisters"}},
+    {"id": "typo", "mode": "nromal", "symptoms": ["fever"]},
+    {"id": "default", "symptoms": ["cough"]},
+]
+
+
+@pytest.mark.parametrize("scoring", ["rules", "matrix"])
+def test_unknown_mode_is_an_error_row(scoring):
+    if scoring == "matrix":
+        pytest.importorskip("numpy")
+    out = io.StringIO()
+    assert batch.run(iter(RECORDS), out, engine_options={"engine": "compiled"},
+                     progress=None, scoring=scoring) == 3
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row["id"] for row in rows] == ["ok", "typo", "default"]
+    assert rows[1]["mode"] == "nromal" and "unknown mode" in rows[1]["error"]
+    assert "diagnoses" in rows[0] and rows[2]["mode"] == "normal"
+
+
+@pytest.mark.parametrize("scoring", ["rules", "matrix"])
+def test_bad_lines_are_error_rows_and_unmatched_cases_fall_back(tmp_path, scoring):
+    if scoring == "matrix":
+        pytest.importorskip("numpy")
+    path = tmp_path / "cases.jsonl"
+    path.write_text("\n".join([
+        json.dumps(RECORDS[0]),
+        '{"id": "cut", "symptoms": ["fev',
+        "[1, 2]",
+        json.dumps({"id": "none", "symptoms": ["fever"], "details": {"fever": "high"}}),
+    ]) + "\n", encoding="utf-8")
+    out = io.StringIO()
+    assert batch.run(batch.read_cases(str(path)), out, engine_options={"engine": "compiled"},
+                     progress=None, scoring=scoring) == 4
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row["id"] for row in rows] == ["ok", "2", "3", "none"]
+    assert rows[1]["error"].startswith("line 2: invalid JSON")
+    assert rows[2]["error"] == "line 3: expected a JSON object"
+    # No rule matches a lone high fever: same answer as POST /v1/normal/diagnose
+    assert rows[3]["diagnoses"] == ["Severe Viral Infection"]
+    assert rows[3]["department"] == "General Medicine"
@@ -0,0 +1,71 @@
+import gc
+import pickle
+import sys
+import tracemalloc
+
+from sessions import SYMBOLS, Case
+
+
+def _case(answer: str = "yes") -> Case:
+    case = Case("abc123")
+    for symptom in ("fever", "rash"):
+        case.add_symptom(symptom, 1)
+    case.add_symptom("rash_after_fever", 2)
+    case.add_symptom("not_in_the_kb", 2)
+    case.add_response("fever_detail", "high fever for three days, worse at night")
+    case.add_response("fever_rash", answer)
+    case.add_response("fever_rash", "no")
+    return case
+
+
+def test_round_trip():
+    case = _case()
+    for copy in (Case.from_bytes(case.to_bytes()), pickle.loads(pickle.dumps(case))):
+        assert copy.kb_version == case.kb_version
+        assert copy.symptoms == case.symptoms
+        assert copy.response_facts == case.response_facts
+    assert case.responses == {"fever_detail": "high fever for three days, worse at night",
+                              "fever_rash": "no"}
+    assert ("not_in_the_kb", 2) in case.symptoms
+
+
+def test_client_input_does_not_grow_the_cases():
+    before = len(_case().to_bytes())
+    symbols = len(SYMBOLS)
+    for i in range(50000):
+        case = Case()
+        case.add_response(f"question_{i}", f"answer {i}")
+        case.add_symptom(f"made_up_symptom_{i}", 2)
+    assert len(SYMBOLS) == symbols
+    case = _case()
+    assert len(case.to_bytes()) == before
+    assert max(sys.getsizeof(bits) for bits in case._tier_bits) <= sys.getsizeof(1 << len(SYMBOLS))
+
+
+def test_kb_answers_are_shared_and_client_text_is_freed():
+    # Equal but distinct string objects, as each request parses them anew
+    yes, key = "".join(["y", "es"]), "".join(["fever", "_detail"])
+    case = Case()
+    case.add_response(key, yes)
+    assert case._responses[0] is SYMBOLS.words["fever_detail"]
+    assert case._responses[1] is SYMBOLS.words["yes"]
+    # Client text is not interned: interned strings are immortal on CPython 3.12
+    text = "".join(["a rash ", "nobody else typed"])
+    case.add_response("rash_detail", text)
+    assert sys.intern("".join(["a rash ", "nobody else typed"])) is not text
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        cases = []
+        for i in range(20000):
+            case = Case()
+            case.add_response("fever_detail", f"free text answer number {i} " * 4)
+            cases.append(case)
+        assert tracemalloc.get_traced_memory()[0] - before > 20000 * 100
+        del cases, case
+        gc.collect()
+        # Nothing of the client text outlives the cases
+        assert tracemalloc.get_traced_memory()[0] - before < 100000
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,21 @@
+import pytest
+
+import diagnosis_engine
+from diagnosis_engine import DiagnosisEngine
+
+pytestmark = pytest.mark.skipif(diagnosis_engine.Prolog is None, reason="needs SWI-Prolog")
+
+TEXTS = [
+    "my son has a rash and fever",
+    'she said "itchy rash" and a cough',
+    "a backslash \\ before the fever",
+    # Closes the string of a spliced-in query and runs a goal of its own
+    'rash \\", S), assertz(user:injected), X = ("',
+]
+
+
+def test_dcg_parser_takes_user_text_as_data():
+    engine = DiagnosisEngine("dcg", parser="dcg", engine="compiled")
+    for text in TEXTS:
+        assert engine._extract_symptoms(text) == engine.matcher.match(text)
+    assert not list(engine.prolog.query("current_predicate(user:injected/0)"))
@@ -0,0 +1,48 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import tiers
+from benchmarks.cases import CaseGenerator
+from diagnosis_engine import DiagnosisEngine
+from differential import Differential
+from sessions import Case
+
+
+def _tier_case(engine, record, differential):
+    """Run a /v1-shaped record through the tiers, closing them as the app does"""
+    case = Case()
+    tiers.tier1(case, engine.parse_many([t.lower() for t in record["symptoms"]]))
+    differential.update(case)
+    details = {f"{s}_detail": d for s, d in record["details"].items()}
+    tiers.tier2(case, details, engine.parse_many(list(details.values())))
+    differential.update(case)
+    differential.close_tier(2)
+    tiers.tier3(case, record["answers"])
+    differential.update(case)
+    return case
+
+
+@pytest.mark.parametrize("mode", ["normal", "dcg"])
+def test_candidates_never_drop_a_diagnosis(mode):
+    engine = DiagnosisEngine(mode=mode, engine="compiled")
+    rules = engine.rules
+    records = CaseGenerator(seed=7).cases(2000, mode)
+    # A tier-1 symptom that only turns up in the tier-2 detail text
+    records.append({"symptoms": ["my child has a rash"], "details": {"rash": "itchy rash after fever, blisters"},
+                    "answers": {}})
+    for record in records:
+        differential = Differential(rules)
+        case = _tier_case(engine, record, differential)
+        full = rules.evaluate(rules.case_mask(case))
+        assert rules.evaluate(rules.case_mask(case), differential.candidates()) == full, record
+        assert engine.match_case(case, differential.candidates()) == full, record
+
+
+def test_tier1_symptom_reported_in_tier2_detail():
+    import app
+
+    with TestClient(app.app) as client:
+        client.post("/dcg/process_tier1", data={"symptoms": "my child has a rash"})
+        client.post("/dcg/process_tier2", data={"rash_detail": "itchy rash after fever, blisters"})
+        result = client.post("/dcg/diagnose").json()
+    assert sorted(result["diagnoses"]) == ["Chickenpox", "Roseola"]
@@ -0,0 +1,40 @@
+import json
+
+import kb_compiler
+from kb_compiler import load_snapshot
+from prolog_reader import read_file
+from rule_compiler import KB_FILES, clauses_by_predicate
+
+
+def _facts(name, arity):
+    preds = clauses_by_predicate(read_file(KB_FILES["normal"]))
+    return [head.args for head, body in preds.get((name, arity), ()) if body == "true"]
+
+
+def test_snapshot_is_rebuilt_when_missing_stale_or_corrupt(tmp_path, monkeypatch):
+    path = str(tmp_path / "kb_snapshot.json")
+    kb = load_snapshot(path)
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["kb_sha256"] == kb.kb_sha256
+
+    # A current snapshot is read back, not recompiled
+    monkeypatch.setattr(kb_compiler, "compile_kb", lambda *a: (_ for _ in ()).throw(AssertionError))
+    assert load_snapshot(path).t3 == kb.t3
+    monkeypatch.undo()
+
+    for stale in ('{"format": 1, "kb_sha256": "0"}', "not json"):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(stale)
+        assert load_snapshot(path).kb_sha256 == kb.kb_sha256
+
+
+def test_tables_come_from_the_kb_facts():
+    kb = load_snapshot()
+    assert list(kb.t1) == list(dict.fromkeys(s for (s,) in _facts("preliminary_symptom", 1)))
+    for symptom, question in _facts("tier2_question", 2):
+        assert question in kb.t2[symptom]
+    for trigger, question in _facts("tier3_question", 2):
+        assert question in kb.t3[tuple(trigger)]
+    for primary, symptoms in _facts("adaptive_symptom", 2):
+        assert set(symptoms) <= set(kb.adaptive[primary])
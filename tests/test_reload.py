@@ -0,0 +1,102 @@
+import os
+import shutil
+import threading
+
+from fastapi.testclient import TestClient
+
+import app as app_module
+from kb_release import KBRelease, frozen_path, load_corpus
+from rule_compiler import KB_FILES
+
+NEW_VERSION = "0123456789ab"
+
+
+def _freeze_new_version(edit=None, version=NEW_VERSION):
+    """A release under another version, as an edit would give; edit(text)
+    changes diagnosis.pl, otherwise the rules stay the same"""
+    for path in dict.fromkeys(KB_FILES.values()):
+        shutil.copyfile(path, frozen_path(path, version))
+    if edit is not None:
+        target = frozen_path(KB_FILES["normal"], version)
+        with open(target, encoding="utf-8") as f:
+            text = edit(f.read())
+        with open(target, "w", encoding="utf-8") as f:
+            f.write(text)
+    return KBRelease(version, {mode: frozen_path(path, version) for mode, path in KB_FILES.items()})
+
+
+def _reload(client):
+    return client.post("/admin/reload_kb", headers={"X-Admin-Token": "secret"}).json()
+
+
+def test_reload_waits_for_requests_in_flight(monkeypatch):
+    record = next(r for r in load_corpus() if r["mode"] == "normal" and r.get("must_include"))
+    case_input = {key: record[key] for key in ("symptoms", "details", "answers")}
+    entered, proceed = threading.Event(), threading.Event()
+    call_engine = app_module._call_engine
+
+    async def gated_call_engine(session, mode, method, *args, **kwargs):
+        # Hold the first /v1 diagnosis inside the engine call until the reload is done
+        if method == "diagnose_case" and not entered.is_set():
+            entered.set()
+            await app_module.asyncio.to_thread(proceed.wait, 30)
+        return await call_engine(session, mode, method, *args, **kwargs)
+
+    monkeypatch.setattr(app_module, "_call_engine", gated_call_engine)
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    with TestClient(app_module.app) as client:
+        old = app_module.releases.current.version
+        old_file = frozen_path(KB_FILES["normal"], old)
+        result = {}
+        request = threading.Thread(target=lambda: result.update(
+            response=client.post("/v1/normal/diagnose", json=case_input)))
+        request.start()
+        try:
+            assert entered.wait(30)
+            monkeypatch.setattr(app_module, "freeze", _freeze_new_version)
+            reload = _reload(client)
+            assert reload["status"] == "promoted" and reload["version"] == NEW_VERSION
+            # The old release is still held by the request in flight
+            assert old in app_module.releases.versions()
+            assert os.path.exists(old_file)
+        finally:
+            proceed.set()
+            request.join(30)
+        response = result["response"]
+        assert response.status_code == 200
+        assert set(record["must_include"]) <= set(response.json()["diagnoses"])
+
+        # Once the request is done, the next reload retires what nothing uses
+        monkeypatch.setattr(app_module, "freeze", lambda: app_module.releases.get(old))
+        reload = _reload(client)
+        assert reload["status"] == "promoted" and reload["version"] == old
+    assert app_module.releases.versions() == [old]
+    assert not os.path.exists(frozen_path(KB_FILES["normal"], NEW_VERSION))
+
+
+def test_rule_changes_are_accepted_unless_they_break_an_invariant(monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", "secret")
+    # A new rule changes the answer of many smoke cases
+    new_rule = "\ndiagnosis(common_cold) :- has_symptom(runny_nose, _).\n"
+    # ...while dropping chickenpox breaks a curated invariant
+    def no_chickenpox(text):
+        start = text.index("diagnosis(chickenpox) :-")
+        return text[:start] + text[text.index(".", start) + 1:]
+
+    with TestClient(app_module.app) as client:
+        old = app_module.releases.current.version
+        try:
+            monkeypatch.setattr(app_module, "freeze", lambda: _freeze_new_version(lambda t: t + new_rule))
+            result = _reload(client)
+            assert result["status"] == "promoted", result
+
+            monkeypatch.setattr(app_module, "freeze", lambda: _freeze_new_version(no_chickenpox, "ba5eba11c0de"))
+            result = _reload(client)
+            assert result["status"] == "rejected"
+            assert any("Chickenpox" in failure for failure in result["failures"])
+            assert app_module.releases.current.version == NEW_VERSION
+        finally:
+            monkeypatch.setattr(app_module, "freeze", lambda: app_module.releases.get(old) or _freeze_new_version(version=old))
+            assert _reload(client)["status"] == "promoted"
+    assert app_module.releases.versions() == [old]
+    assert not os.path.exists(frozen_path(KB_FILES["normal"], "ba5eba11c0de"))
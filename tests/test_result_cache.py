@@ -0,0 +1,37 @@
+import tiers
+from diagnosis_engine import RESULT_CACHE, DiagnosisEngine
+from sessions import Case
+
+ENGINE = DiagnosisEngine(mode="dcg", engine="compiled")
+
+
+def _case():
+    case = Case()
+    tiers.tier1(case, ENGINE.parse_many(["my child has a rash"]))
+    details = {"rash_detail": "itchy rash after fever, blisters"}
+    tiers.tier2(case, details, ENGINE.parse_many(list(details.values())))
+    return case
+
+
+def test_cache_key_honours_candidates():
+    engine = ENGINE
+    RESULT_CACHE.clear()
+    full = engine.diagnose_case(_case())
+    assert full[0], "the case should match at least one rule"
+
+    RESULT_CACHE.clear()
+    # A restricted evaluation first must not poison later unrestricted ones
+    assert engine.diagnose_case(_case(), [])[0] == []
+    assert engine.diagnose_case(_case(), ["measles"])[0] == []
+    assert engine.diagnose_case(_case()) == full
+    # ...and an unrestricted result is not served to a restricted call
+    assert engine.diagnose_case(_case(), []) == ([], None, {})
+
+
+def test_cached_results_are_copies():
+    engine = ENGINE
+    RESULT_CACHE.clear()
+    results, _, probabilities = engine.diagnose_case(_case())
+    results.append("edited")
+    probabilities.clear()
+    assert engine.diagnose_case(_case()) != (results, _, probabilities)
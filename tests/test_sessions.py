@@ -0,0 +1,19 @@
+from sessions import SessionStore
+
+
+def test_unknown_ids_are_not_adopted():
+    store = SessionStore()
+    for chosen in ("attacker-chosen", "x" * 100000):
+        session = store.get(chosen)
+        assert session.session_id != chosen
+        assert len(session.session_id) == 32
+    assert store.get(session.session_id) is session
+    assert len(store) == 2
+
+
+def test_expired_ids_get_a_new_session():
+    store = SessionStore(ttl=0.0)
+    first = store.get(None)
+    first.touched -= 1
+    second = store.get(first.session_id)
+    assert second is not first and second.session_id != first.session_id
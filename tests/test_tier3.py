@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+
+import tiers
+from benchmarks import cases
+from kb_compiler import KBSnapshot, compile_kb
+from rule_compiler import KB_FILES
+from sessions import Case
+
+TRIGGER = ("fever", "rash", "runny_nose")
+
+
+@pytest.fixture
+def kb(tmp_path):
+    """The KB plus a tier-3 trigger of three symptoms"""
+    files = {}
+    for mode, path in KB_FILES.items():
+        files[mode] = str(tmp_path / path)
+        shutil.copyfile(path, files[mode])
+    with open(files["normal"], "a", encoding="utf-8") as f:
+        f.write("\ntier3_trigger([fever, rash, runny_nose], [koplik_spots, conjunctivitis]).\n"
+                "tier3_question([fever, rash, runny_nose], 'Are there white spots inside the cheeks? (y/n):').\n"
+                "tier3_question([fever, rash, runny_nose], 'Are the eyes red and watery? (y/n):').\n")
+    return KBSnapshot(compile_kb(files))
+
+
+def test_generated_answers_use_the_whole_trigger_key(kb, monkeypatch):
+    monkeypatch.setattr(cases, "T3", kb.t3)
+    gen = cases.CaseGenerator(seed=3)
+    answers = [c["answers"] for c in gen.cases(500)
+               if all(s in c["symptoms"] for s in TRIGGER)]
+    assert answers
+    for case_answers in answers:
+        assert {"fever_rash_runny_nose_0", "fever_rash_runny_nose_1"} <= set(case_answers)
+
+
+def test_triggers_of_any_size_fire_once_all_their_symptoms_are_present(kb):
+    assert kb.t3[TRIGGER] == ("Are there white spots inside the cheeks? (y/n):",
+                              "Are the eyes red and watery? (y/n):")
+    assert list(tiers.triggered_tier3(["rash", "fever"], kb)) == ["fever_rash"]
+    triggered = tiers.triggered_tier3(["runny_nose", "rash", "cough", "fever"], kb)
+    assert list(triggered) == ["fever_rash", "cough_fever", "fever_rash_runny_nose"]
+    assert triggered["fever_rash_runny_nose"] == list(kb.t3[TRIGGER])
+
+
+def test_answers_to_an_nary_trigger_record_its_facts(kb):
+    # The longest trigger key wins over fever_rash
+    assert tiers.split_tier3_key("fever_rash_runny_nose_1", kb) == (TRIGGER, "1")
+    assert tiers.split_tier3_key("fever_rash_1", kb) == (("fever", "rash"), "1")
+    case = Case()
+    processed = tiers.tier3(case, {"fever_rash_runny_nose_koplik_spots": "y",
+                                   "fever_rash_runny_nose_conjunctivitis": "n"}, kb)
+    assert processed["koplik_spots"] == "yes" and "conjunctivitis" not in processed
+    assert ("koplik_spots", "yes") in case.response_facts
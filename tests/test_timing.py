@@ -0,0 +1,29 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app import TIMING_HEADER, app
+
+
+def _start_case(client):
+    client.post("/normal/process_tier1", json={"symptoms": ["fever", "rash"]})
+    client.post("/normal/process_tier2", data={"rash_detail": "itchy rash after fever"})
+
+
+def test_timing_needs_the_header_set_to_1():
+    with TestClient(app) as client:
+        _start_case(client)
+        assert "Server-Timing" in client.post("/normal/diagnose", headers={TIMING_HEADER: "1"}).headers
+        for value in ("0", "false", ""):
+            assert "Server-Timing" not in client.post("/normal/diagnose", headers={TIMING_HEADER: value}).headers
+
+
+def test_streams_report_timing_in_the_last_line():
+    with TestClient(app) as client:
+        _start_case(client)
+        response = client.post("/normal/diagnose/stream", headers={TIMING_HEADER: "1"})
+        assert "Server-Timing" not in response.headers
+        last = json.loads(response.text.splitlines()[-1])
+        assert "result" in last and "compiled" in last["timing"]
+        last = json.loads(client.post("/normal/diagnose/stream").text.splitlines()[-1])
+        assert "timing" not in last
@@ -0,0 +1,131 @@
+"""Tier logic shared by the web app and the batch runner.
+
+These functions only update a sessions.Case; anything that needs Prolog
+(symptom extraction, diagnosis) is done by the caller, which passes the
+extracted symptoms in. That keeps them synchronous, so the same code runs
+behind the async endpoints and inside batch worker processes.
+
+The KB tables come from kb, a kb_compiler.KBSnapshot: by default the one
+loaded at startup, or the release a case runs on (see kb_release.py).
+"""
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+from diagnosis_engine import SNAPSHOT
+from kb_compiler import KBSnapshot
+from symptom_extractor import extract_adaptive_symptoms
+
+
+def tier1(case, detected: Sequence[List[str]], kb: KBSnapshot = SNAPSHOT) -> dict:
+    """Record tier-1 symptoms; detected holds the extraction result per input text"""
+    responses = {}
+    for symptoms in detected:
+        for s in symptoms:
+            responses[s] = "y"
+            case.add_symptom(s, 1)
+    for s in kb.t1:
+        responses.setdefault(s, "n")
+    return {
+        "symptoms": responses,
+        "tier2_questions": {s: kb.t2[s] for s in responses if responses[s] == "y" and s in kb.t2}
+    }
+
+
+def tier2(case, form_data: Mapping[str, str], parsed: Sequence[List[str]],
+          kb: KBSnapshot = SNAPSHOT) -> Tuple[List[str], Dict[str, List[str]]]:
+    """Record tier-2 details; parsed holds the extraction result per form value.
+
+    Returns the primary symptoms described and the triggered tier-3 questions.
+    """
+    symptoms_present = []
+    for (key, details), specs in zip(form_data.items(), parsed):
+        symptom = key.replace("_detail", "")
+        symptoms_present.append(symptom)
+
+        # Store the original input
+        atom = f"{symptom}_detail"
+        case.add_response(atom, details)
+        case.add_response(symptom, details)
+
+        # Process keywords in the details to map to specific adaptive symptoms
+        for adaptive_symptom in extract_adaptive_symptoms(details):
+            case.add_response(adaptive_symptom, "yes")
+            case.add_symptom(adaptive_symptom, 2)
+
+        # Process additional details via natural language
+        for spec in specs:
+            case.add_symptom(spec, 2)
+
+    return symptoms_present, triggered_tier3(symptoms_present, kb)
+
+
+def triggered_tier3(symptoms_present: Iterable[str], kb: KBSnapshot = SNAPSHOT) -> Dict[str, List[str]]:
+    """Tier-3 questions of every trigger whose symptoms are all present.
+
+    Only the index entries of the reported symptoms are visited: a trigger
+    fires once each of its symptoms has been counted, so the cost does not
+    grow with the number of triggers in the KB. Triggers of any size work.
+    """
+    counts: Dict[int, int] = {}
+    fired = []
+    for s in set(symptoms_present):
+        for index in kb.t3_by_symptom.get(s, ()):
+            counts[index] = counts.get(index, 0) + 1
+            if counts[index] == kb.t3_sizes[index]:
+                fired.append(index)
+    triggered = {}
+    for index in sorted(fired):  # KB order
+        trigger = kb.t3_triggers[index]
+        if kb.t3[trigger]:
+            triggered["_".join(trigger)] = list(kb.t3[trigger])
+    return triggered
+
+
+# Differentiating fact implied by a "yes" to the n-th question of a trigger
+TIER3_QUESTION_FACTS = {
+    (("fever", "rash"), "0"): "measles_path",
+    (("fever", "rash"), "1"): "strawberry_tongue",
+}
+
+
+def split_tier3_key(key: str, kb: KBSnapshot = SNAPSHOT) -> Tuple[Optional[Tuple[str, ...]], str]:
+    """"fatigue_runny_nose_0" -> (("fatigue", "runny_nose"), "0"); (None, key) if no trigger matches"""
+    prefix = key
+    while "_" in prefix:
+        # Longest trigger key first, since symptom names contain underscores
+        prefix = prefix.rsplit("_", 1)[0]
+        trigger = kb.t3_by_key.get(prefix)
+        if trigger is not None:
+            return trigger, key[len(prefix) + 1:]
+    return None, key
+
+
+def tier3(case, form_data: Mapping[str, str], kb: KBSnapshot = SNAPSHOT) -> Dict[str, str]:
+    """Record tier-3 answers and the differentiating facts they imply"""
+    processed_responses = {}
+    for key, value in form_data.items():
+        # Keys are "<trigger key>_<question index>" or "<trigger key>_<fact>"
+        trigger, rest = split_tier3_key(key, kb)
+        if trigger is not None and value.lower() in ['y', 'yes']:
+            # The tier3_trigger/2 facts of the trigger, by name or by question
+            fact = TIER3_QUESTION_FACTS.get((trigger, rest), rest)
+            if fact in kb.differentiators.get("_".join(trigger), ()):
+                case.add_response(fact, "yes")
+                processed_responses[fact] = "yes"
+
+        # Also add the original key/value pair
+        case.add_response(key, value)
+        processed_responses[key] = value
+    return processed_responses
+
+
+def fallback_diagnosis(responses: Mapping[str, str]) -> Tuple[str, List[str], str, Dict[str, str]]:
+    """Heuristic answer when no rule matched: (kind, results, department, probabilities)"""
+    rash_detail = responses.get("rash_detail", "").strip().lower()
+    fever_detail = responses.get("fever_detail", "").strip().lower()
+
+    if "rash" in responses and any(word in rash_detail for word in ["yes", "y", "localized", "widespread", "itchy"]):
+        return "Rash-related", ["Measles"], "Infectious Disease", {"Measles": "70%", "Scarlet Fever": "30%"}
+    if "fever" in responses and any(word in fever_detail for word in ["high", "very high"]):
+        return ("Fever-related", ["Severe Viral Infection"], "General Medicine",
+                {"Severe Viral Infection": "65%", "Mild Viral Infection": "35%"})
+    return "Default", ["Default Diagnosis"], "General", {"Default Diagnosis": "100%"}
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+from engine_executor import EngineExecutor, get_engine, retire_engines
+from metrics import WORKER_STARTUP
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(conn, engine_options):
+    """Serve DiagnosisEngine calls sent over conn until the pipe closes"""
+    # Engines are built on first use, so a new worker is ready as soon as
+    # it has imported the engine module
+    engines = {}
+    conn.send(("ready", os.getpid(), time.time()))
+    while True:
+        try:
+            mode, version, method, args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        try:
+            if mode is None and method == "retire":
+                conn.send(("ok", retire_engines(engines, *args)))
+                continue
+            engine = get_engine(engines, mode, version, engine_options)
+            conn.send(("ok", getattr(engine, method)(*args)))
+        except Exception as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                # The exception itself could not be pickled
+                conn.send(("error", RuntimeError(repr(e))))
+
+
+class WorkerHandle:
+    """One Prolog worker process; calls to it are serialized in order"""
+
+    def __init__(self, ctx, index: int, engine_options: dict):
+        self._ctx = ctx
+        self._engine_options = engine_options
+        self.index = index
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}")
+        self._start()
+
+    def _start(self):
+        self._conn, child_conn = self._ctx.Pipe()
+        self._spawned = time.time()
+        self.process = self._ctx.Process(target=_worker_main, args=(child_conn, self._engine_options),
+                                         name=f"prolog-worker-{self.index}", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self._ready = False
+        # Queued ahead of any call, so startup is timed as soon as it ends
+        self._thread.submit(self._await_ready)
+
+    def _await_ready(self):
+        if self._ready:
+            return
+        try:
+            _, pid, ready_at = self._conn.recv()
+        except (EOFError, OSError):
+            return  # _roundtrip notices the dead worker and restarts it
+        self._ready = True
+        seconds = max(ready_at - self._spawned, 0.0)
+        WORKER_STARTUP.observe(seconds)
+        logger.info("prolog worker ready", extra={"worker": self.index, "pid": pid,
+                                                   "seconds": round(seconds, 3)})
+
+    def _roundtrip(self, mode: Optional[str], version: Optional[str], method: str, args):
+        try:
+            if not self._ready:
+                self._await_ready()
+            self._conn.send((mode, version, method, args))
+            status, value = self._conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            # The worker died; replace it so later calls for its sessions succeed
+            self.process.join(timeout=1)
+            self._start()
+            raise RuntimeError(f"Prolog worker {self.index} exited during {method}")
+        if status == "error":
+            raise value
+        return value
+
+    async def call(self, mode: str, method: str, *args, version: Optional[str] = None):
+        """Run DiagnosisEngine.<method>(*args) for mode (and KB release) in this worker"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread, self._roundtrip, mode, version, method, args)
+
+    async def retire(self, keep: Iterable[str]):
+        """Unload every KB release not in keep"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._thread, self._roundtrip, None, None, "retire", (list(keep),))
+
+    def shutdown(self):
+        self._thread.shutdown(wait=True)
+        self._conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class WorkerPool:
+    """Fixed pool of Prolog worker processes with per-session affinity.
+
+    pyswip allows a single SWI-Prolog engine per process, so scaling across
+    cores needs one process per engine. Every session is pinned to one worker
+    by hashing its ID, so its tier calls always reach the same process.
+    """
+
+    def __init__(self, size: int, **engine_options):
+        if size < 1:
+            raise ValueError("Worker pool size must be at least 1")
+        # spawn: forking a process that already runs threads is unsafe
+        ctx = multiprocessing.get_context("spawn")
+        self.workers: List[WorkerHandle] = [WorkerHandle(ctx, i, engine_options) for i in range(size)]
+
+    def __len__(self):
+        return len(self.workers)
+
+    def for_session(self, session_id: str) -> WorkerHandle:
+        return self.workers[zlib.crc32(session_id.encode()) % len(self.workers)]
+
+    async def retire(self, keep: Iterable[str]):
+        """Unload every KB release not in keep, in every worker"""
+        keep = list(keep)
+        await asyncio.gather(*(worker.retire(keep) for worker in self.workers))
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.shutdown()
+
+
+def create_engine_pool(size: int = None):
+    """Build the Prolog backend: in-process for size <= 1, else a WorkerPool.
+
+    The size defaults to the DIAGNOSIS_WORKERS environment variable and the
+    rule evaluator ("prolog" or "compiled") to DIAGNOSIS_ENGINE.
+    """
+    if size is None:
+        size = int(os.environ.get("DIAGNOSIS_WORKERS", "1"))
+    engine_options = {"engine": os.environ.get("DIAGNOSIS_ENGINE", "prolog")}
+    if size <= 1:
+        return EngineExecutor(**engine_options)
+    return WorkerPool(size, **engine_options)